@@ -5,6 +5,10 @@ from bs4 import BeautifulSoup
 import asyncio
 from tabulate import tabulate
 from .village import fetch_villages
+from .telemetry import event_hooks
+from .farm_list import FarmList, load_targets
+from .travel import run_waves, travel_time, village_coords
+from .troop_inventory import TroopInventory
 
 BASE_URL = "https://fun.gotravspeed.com"
 
@@ -26,7 +30,7 @@ async def attack_village(cookies, village_url, troop_data):
             "Upgrade-Insecure-Requests": "1"
         }
 
-        async with httpx.AsyncClient(cookies=cookies) as client:
+        async with httpx.AsyncClient(cookies=cookies, event_hooks=event_hooks()) as client:
             response = await client.get(village_url, headers=headers)
             soup = BeautifulSoup(response.text, 'html.parser')
             key = soup.find('input', {'name': 'key'})['value']
@@ -65,12 +69,21 @@ async def select_and_attack_village(session_manager, conn):
         print("Invalid choice. Returning to main menu.")
         return
 
-    # Logic to select the target player and village
-    # Placeholder: Assuming you have a function to fetch players and their villages
-    target_players = [
-        {"player_name": "Player1", "villages": [{"name": "Village1", "url": f"{BASE_URL}/village2.php?vid=1"}]},
-        {"player_name": "Player2", "villages": [{"name": "Village2", "url": f"{BASE_URL}/village2.php?vid=2"}]}
-    ]
+    # Players with villages near the selected village, from the crawled villages table
+    target_players = []
+    by_player = {}
+    for distance, village_id, player_name, village_name, x, y in load_targets(conn, session_manager.username, int(selected_village[1]), limit=200):
+        if player_name not in by_player:
+            by_player[player_name] = {"player_name": player_name, "villages": []}
+            target_players.append(by_player[player_name])
+        by_player[player_name]["villages"].append({
+            "name": f"{village_name} ({x}|{y}, {distance:.1f} tiles)",
+            "url": f"{session_manager.server_url}/v2v.php?id={village_id}",
+        })
+    target_players = target_players[:20]
+    if not target_players:
+        print("No targets known near this village. Run 'Fetch All Player Villages' first.")
+        return
 
     print("\nAvailable Players:")
     for index, player in enumerate(target_players):
@@ -110,3 +123,78 @@ async def select_and_attack_village(session_manager, conn):
 
     cookies = await session_manager.get_cookies()
     await attack_village(cookies, target_village['url'], troop_data)
+
+
+async def run_farm_list(session_manager, conn):
+    """
+    Raid the nearest villages from one of our villages with a fixed troop set.
+    """
+    villages = await fetch_villages(session_manager.username, session_manager, conn)
+    for index, (name, vid, x, y) in enumerate(villages):
+        print(f"{index + 1}. {name} ({x}|{y})")
+    village_choice = int(input("Select the village to raid from (enter the index): ")) - 1
+    if not 0 <= village_choice < len(villages):
+        print("Invalid choice. Returning to main menu.")
+        return
+    source = villages[village_choice]
+
+    radius = float(input("Raid targets within how many tiles? [10]: ") or 10)
+    targets = load_targets(conn, session_manager.username, int(source[1]), radius=radius)
+    if not targets:
+        print("No targets in range. Run 'Fetch All Player Villages' first.")
+        return
+
+    troop_index = int(input("Troop type to raid with (1-6) [1]: ") or 1)
+    per_raid = int(input("Troops per raid [10]: ") or 10)
+    rounds = int(input("Rounds [1]: ") or 1)
+
+    client = await session_manager.get_client()
+    inventory = TroopInventory(client, session_manager.server_url)
+    farm = FarmList(client, session_manager.server_url, source[1], targets, {troop_index: per_raid}, callback=print,
+                    inventory=inventory)
+    report = await farm.run(rounds=rounds)
+    print(f"Sent {report['sent']} raids to {len(targets)} targets ({report['raids_per_minute']:.0f}/min), "
+          f"{report['failed']} failed, {report['skipped']} skipped")
+
+
+async def run_attack_waves(session_manager, conn):
+    """
+    Send several attack waves from our villages that land on one target together.
+    """
+    villages = await fetch_villages(session_manager.username, session_manager, conn)
+    for index, (name, vid, x, y) in enumerate(villages):
+        print(f"{index + 1}. {name} ({x}|{y})")
+
+    target_id = int(input("Target village ID: "))
+    target_xy = village_coords(conn, target_id)
+    if target_xy is None:
+        print("Unknown target. Run 'Fetch All Player Villages' first.")
+        return
+    tribe = input("Our tribe (roman/teuton/gaul) [roman]: ").strip().lower() or 'roman'
+    tournament_square = int(input("Tournament Square level [0]: ") or 0)
+    server_speed = float(input("Server troop speed [1]: ") or 1)
+
+    waves = []
+    while True:
+        choice = input(f"Wave {len(waves) + 1} - village to send from (index, blank to finish): ").strip()
+        if not choice:
+            break
+        name, vid, x, y = villages[int(choice) - 1]
+        troops = {}
+        for part in input("Troops as index=count, e.g. 1=500,7=20: ").split(','):
+            if '=' in part:
+                index, count = part.split('=', 1)
+                troops[int(index)] = int(count)
+        wave = {'source': vid, 'origin': (int(x), int(y)), 'target': target_id, 'target_xy': target_xy, 'troops': troops}
+        seconds = travel_time(wave['origin'], target_xy, troops, tribe, tournament_square, server_speed)
+        print(f"Travel time from {name}: {seconds // 3600}:{seconds % 3600 // 60:02}:{seconds % 60:02}")
+        waves.append(wave)
+    if not waves:
+        return
+
+    client = await session_manager.get_client()
+    results = await run_waves(client, session_manager.server_url, waves, tribe, tournament_square=tournament_square,
+                              server_speed=server_speed, inventory=TroopInventory(client, session_manager.server_url))
+    for wave in sorted(results, key=lambda w: w['order']):
+        status = f"sent {wave['late_ms']:.1f} ms after plan" if wave['sent'] else "FAILED"
+        print(f"Wave {wave['order'] + 1}: {status}")
@@ -0,0 +1,339 @@
+# bench.py
+"""
+Standard benchmark scenarios, run against the local fake server or a replay
+archive, so a change that slows down a hot path shows up before it ships.
+
+Scenarios:
+- shop: storage purchases split across workers on one pooled client;
+- preset: apply_preset end to end (this includes the preset's deliberate
+  delays between requests, so watch its requests and CPU time);
+- village_scan: get_field_info for all 40 positions of the village;
+- map_scan: find_empty_village_spots over every tile within radius 25;
+- crawl: fetch_and_store_all_villages over a 1,000-player world;
+- parse: time per page for each page parser.
+
+Each scenario reports wall and CPU time, requests, requests per second,
+p95 request latency and the process's peak RSS so far. Results are saved as
+JSON; given a baseline from an earlier run, any metric that got worse by
+more than the tolerance is listed and the exit status is 1.
+
+    tbot-bench --output bench.json                     # against FakeServer
+    tbot-bench --baseline bench.json --output new.json
+    tbot-bench --replay fixtures/fun.jsonl.gz --scale 0 shop parse
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+
+from . import replay
+from .construction import apply_preset, get_field_info
+from .database import init_db
+from .fake_server import FakeServer, village_id
+from .farm_list import parse_send_page
+from .fetch_all_villages import fetch_and_store_all_villages, parse_profile, parse_statistics
+from .map_finder import find_empty_village_spots, generate_spiral_village_ids
+from .session_manager import SessionManager
+from .storage import increase_storage_async
+from .village import parse_resources
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+SERVER_URL = "https://fun.gotravspeed.com"
+USERNAME = 'bench'
+PASSWORD = 'bench'
+RESULTS_VERSION = 1
+TOLERANCE = 0.2          # Relative change counted as a regression
+
+# Scenario sizes
+SHOP_LOOPS = 1000
+SHOP_WORKERS = 4
+SCAN_ROUNDS = 10
+MAP_RADIUS = 25
+CRAWL_PLAYERS = 1000
+PARSE_ROUNDS = 200
+
+BENCH_PRESET = {
+    'name': 'Benchmark',
+    'buildings': [
+        {'bid': 15, 'name': 'Main Building', 'level': 5},
+        {'bid': 19, 'name': 'Barracks', 'level': 3},
+        {'bid': 10, 'name': 'Warehouse', 'level': 3},
+    ],
+}
+
+# Metrics compared against the baseline: name -> (higher is better, change too small to count)
+METRICS = {
+    'wall_seconds': (False, 0.05),
+    'cpu_seconds': (False, 0.05),
+    'p95_ms': (False, 1.0),
+    'peak_rss_mb': (False, 5.0),
+    'requests_per_second': (True, 0.0),
+}
+PARSE_NOISE_MS = 0.5     # Per-page parse times (the parse scenario's *_parse_ms) are compared too
+MIN_REQUESTS = 20        # Fewer requests than this make p95 and req/s too noisy to compare
+
+
+class TimedTransport(httpx.AsyncBaseTransport):
+    """Records the latency of every request sent through the transport it wraps."""
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.latencies = []
+
+    async def handle_async_request(self, request):
+        start = time.perf_counter()
+        response = await self.transport.handle_async_request(request)
+        await response.aread()
+        self.latencies.append(time.perf_counter() - start)
+        return response
+
+    async def aclose(self):
+        pass  # Shared by every client of the run; closing one client must not close it
+
+
+class Bench:
+    """
+    One benchmark run: the transport, a logged-in session and a scratch database.
+
+    Args:
+        transport: Transport answering the game's requests (FakeServer or replay)
+        directory: Directory for the scratch database
+    """
+
+    def __init__(self, transport, directory):
+        self.timed = TimedTransport(transport)
+        self.conn = init_db(os.path.join(directory, 'bench.db'))
+        self.session = None
+        self.cookies = None
+
+    async def login(self):
+        self.session = SessionManager(USERNAME, PASSWORD, 'roman', self.conn)
+        self.cookies = await self.session.login() or {}
+
+    async def measure(self, scenario):
+        """Run one scenario and return its metrics."""
+        self.timed.latencies.clear()
+        cpu = time.process_time()
+        start = time.perf_counter()
+        details = await scenario(self) or {}
+        wall = time.perf_counter() - start
+        latencies = sorted(self.timed.latencies)
+        result = {
+            'wall_seconds': wall,
+            'cpu_seconds': time.process_time() - cpu,
+            'requests': len(latencies),
+            'requests_per_second': len(latencies) / wall if wall else 0.0,
+            'p95_ms': statistics.quantiles(latencies, n=20)[-1] * 1000 if len(latencies) > 1 else 0.0,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+        result.update(details)
+        return result
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB (0 where unknown)."""
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10   # bytes on macOS, KB elsewhere
+
+
+async def bench_shop(bench):
+    client = await bench.session.get_client()
+    shares = [SHOP_LOOPS // SHOP_WORKERS + (i < SHOP_LOOPS % SHOP_WORKERS) for i in range(SHOP_WORKERS)]
+    await asyncio.gather(*(increase_storage_async(USERNAME, PASSWORD, share, bench.conn, client=client)
+                           for share in shares))
+    return {'purchases': SHOP_LOOPS}
+
+
+async def bench_preset(bench):
+    await apply_preset(bench.cookies, SERVER_URL, BENCH_PRESET)
+
+
+async def bench_village_scan(bench):
+    client = await bench.session.get_client()
+    for _ in range(SCAN_ROUNDS):
+        await asyncio.gather(*(get_field_info(client, SERVER_URL, position) for position in range(1, 41)))
+    return {'positions': 40 * SCAN_ROUNDS}
+
+
+async def bench_map_scan(bench):
+    ids = generate_spiral_village_ids(village_id(0, 0), max_villages=(2 * MAP_RADIUS + 1) ** 2, max_radius=MAP_RADIUS)
+    await find_empty_village_spots(bench.cookies, ids, bench.conn)
+    return {'tiles': len(ids)}
+
+
+async def bench_crawl(bench):
+    stats = await fetch_and_store_all_villages(bench.session, bench.conn, full=True)
+    return {'players': stats['players'], 'villages': stats['villages']}
+
+
+async def bench_parse(bench):
+    """Milliseconds per page for each parser, on pages fetched once up front."""
+    client = await bench.session.get_client()
+    pages = {
+        'statistics': ('/statistics.php?page=1', parse_statistics),
+        'profile': ('/profile.php?uid=1', parse_profile),
+        'village': ('/village1.php', parse_resources),
+        'send_troops': ('/v2v.php?id=1', parse_send_page),
+    }
+    result = {}
+    for name, (path, parser) in pages.items():
+        html = (await client.get(SERVER_URL + path)).text
+        start = time.perf_counter()
+        for _ in range(PARSE_ROUNDS):
+            parser(html)
+        result[f"{name}_parse_ms"] = (time.perf_counter() - start) / PARSE_ROUNDS * 1000
+    return result
+
+
+SCENARIOS = {
+    'shop': bench_shop,
+    'preset': bench_preset,
+    'village_scan': bench_village_scan,
+    'map_scan': bench_map_scan,
+    'crawl': bench_crawl,
+    'parse': bench_parse,
+}
+
+
+async def run_scenarios(transport, names=None):
+    """
+    Run the named scenarios (default: all) against transport.
+
+    Returns: {scenario: metrics}
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        bench = Bench(transport, directory)
+        with replay.installed(bench.timed):
+            await bench.login()
+            try:
+                for name in names or SCENARIOS:
+                    logger.info(f"Running {name}...")
+                    results[name] = await bench.measure(SCENARIOS[name])
+            finally:
+                await bench.session.close()
+                bench.conn.close()
+    return results
+
+
+def _metrics(result):
+    metrics = dict(METRICS)
+    if result.get('requests', 0) < MIN_REQUESTS:
+        del metrics['p95_ms'], metrics['requests_per_second']
+    metrics.update({key: (False, PARSE_NOISE_MS) for key in result if key.endswith('_parse_ms')})
+    return metrics
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Metrics that got worse than the baseline by more than tolerance.
+
+    Returns: list of (scenario, metric, baseline value, current value, relative change)
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for metric, (higher_is_better, noise) in _metrics(current).items():
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None or abs(new - old) <= noise:
+                continue
+            change = (new - old) / old
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append((name, metric, old, new, change))
+    return regressions
+
+
+def load_results(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['scenarios']
+
+
+def save_results(path, results, options):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'version': RESULTS_VERSION, 'created': time.time(), 'python': platform.python_version(),
+                   'platform': platform.platform(), 'options': options, 'scenarios': results}, f, indent=2)
+
+
+def format_results(results, baseline=None):
+    lines = [f"{'scenario':<14}{'wall s':>9}{'cpu s':>9}{'requests':>10}{'req/s':>9}{'p95 ms':>9}{'rss MB':>9}"]
+    for name, result in results.items():
+        lines.append(f"{name:<14}{result['wall_seconds']:>9.2f}{result['cpu_seconds']:>9.2f}{result['requests']:>10}"
+                     f"{result['requests_per_second']:>9.0f}{result['p95_ms']:>9.2f}{result['peak_rss_mb']:>9.1f}")
+        previous = (baseline or {}).get(name)
+        if previous:
+            changes = ', '.join(f"{metric} {(result[metric] - previous[metric]) / previous[metric]:+.0%}"
+                                for metric in _metrics(result) if previous.get(metric) and metric in result)
+            lines.append(f"{'':<14}vs baseline: {changes}")
+        extra = {key: value for key, value in result.items() if key not in METRICS and key != 'requests'}
+        if extra:
+            lines.append(f"{'':<14}" + ', '.join(f"{key} {value:.3g}" if isinstance(value, float) else f"{key} {value}"
+                                                 for key, value in extra.items()))
+    return '\n'.join(lines)
+
+
+def run():
+    """Entry point for tbot-bench."""
+    parser = argparse.ArgumentParser(description="Run the benchmark scenarios and compare them with a baseline.")
+    parser.add_argument('scenarios', nargs='*', metavar='SCENARIO',
+                        help=f"Scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument('--replay', metavar='ARCHIVE', help="Serve requests from a replay archive instead of the fake server")
+    parser.add_argument('--latency', type=float, help="Seconds per response (fake server default: 0)")
+    parser.add_argument('--scale', type=float, default=1.0, help="Multiplier for recorded latencies (replay)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Random +/- fraction applied to latencies")
+    parser.add_argument('--output', metavar='PATH', help="Save the results as JSON")
+    parser.add_argument('--baseline', metavar='PATH', help="Compare with results saved by an earlier run")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help="Relative change counted as a regression")
+    parser.add_argument('--verbose', action='store_true', help="Show the bot's own log output")
+    args = parser.parse_args()
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario: {', '.join(unknown)}")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    if args.replay:
+        transport = replay.ReplayTransport(args.replay, latency=args.latency, scale=args.scale, jitter=args.jitter)
+    else:
+        transport = httpx.ASGITransport(app=FakeServer(latency=args.latency or 0.0, jitter=args.jitter,
+                                                       players=CRAWL_PLAYERS))
+    results = asyncio.run(run_scenarios(transport, args.scenarios))
+
+    baseline = load_results(args.baseline) if args.baseline else None
+    print(format_results(results, baseline))
+    if args.output:
+        save_results(args.output, results, {'replay': args.replay, 'latency': args.latency, 'scale': args.scale,
+                                            'jitter': args.jitter})
+        print(f"\nResults saved to {args.output}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for name, metric, old, new, change in regressions:
+            print(f"REGRESSION {name} {metric}: {old:.3g} -> {new:.3g} ({change:+.0%})")
+        if regressions:
+            raise SystemExit(1)
+        print(f"\nNo regressions beyond {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    run()
@@ -8,11 +8,13 @@ from .construction import construct_capital, construct_village, research_academy
 from .storage import increase_storage_async
 from .production import increase_production_async
 from .database import init_db, get_all_users, delete_all_users, get_all_empty_spots
+from .db_writer import DatabaseWriter
 from .map_finder import generate_spiral_village_ids, find_empty_village_spots
 from .fetch_all_villages import fetch_and_store_all_villages
-from .attack_village import select_and_attack_village
+from .attack_village import select_and_attack_village, run_farm_list, run_attack_waves
 from .troop_training import train_troops
 from .tasks import loop_task_until_escape
+from . import instrumentation
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -40,11 +42,17 @@ async def main_menu(session_manager):
         print("13. Attack Village")
         print("14. Find Empty Village Spots")
         print("15. Train Troops")
+        print("16. Run Farm List")
+        print("17. Send Attack Waves")
         print("0. Exit")
         action = input("Select an action: ")
 
         if action == '12':
-            await fetch_and_store_all_villages(session_manager, session_manager.conn)
+            writer = DatabaseWriter().start()
+            try:
+                await fetch_and_store_all_villages(session_manager, session_manager.conn, writer=writer)
+            finally:
+                writer.close()
             print("All player villages fetched and stored.")
 
         elif action == '14':
@@ -67,6 +75,12 @@ async def main_menu(session_manager):
         elif action == '15':
             await train_troops_action(session_manager)
 
+        elif action == '16':
+            await run_farm_list(session_manager, session_manager.conn)
+
+        elif action == '17':
+            await run_attack_waves(session_manager, session_manager.conn)
+
         elif action == '1':
             while True:
                 print("\nStorage Menu")
@@ -243,8 +257,12 @@ async def login_menu():
 def main():
     """Entry point for the bot."""
     print("Welcome to Bot for Fun Server")
-    session_manager = asyncio.run(login_menu())
-    asyncio.run(main_menu(session_manager))
+    instrumentation.enable_from_env()
+    try:
+        session_manager = asyncio.run(login_menu())
+        asyncio.run(main_menu(session_manager))
+    finally:
+        instrumentation.disable()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,113 @@
+# checkpoint.py
+"""
+Crash-safe progress for long task runs.
+
+A Checkpoint tracks attempts and successes of a run and writes them to the
+runs table every CHECKPOINT_EVERY successes or CHECKPOINT_INTERVAL seconds,
+whichever comes first. Used as an async context manager it always writes a
+final checkpoint: 'done' on normal exit, 'cancelled' when the task is
+cancelled (TaskManager, loop_task_until_escape) and 'failed' on errors.
+
+A run started with a name can be resumed: if the named run exists and is not
+done, its stored counts are loaded and only the remaining attempts are made.
+
+    async with Checkpoint(conn, 'storage-50k', username, 'storage', 50000) as checkpoint:
+        for _ in range(checkpoint.remaining):
+            await checkpoint.step(await do_one())
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+
+from .async_db import run_db
+from .database import save_run, get_run
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_EVERY = 100     # Successes between checkpoints
+CHECKPOINT_INTERVAL = 10   # Seconds between checkpoints
+
+_run_ids = itertools.count(1)
+
+
+class Checkpoint:
+    """
+    Checkpointed counters of one task run.
+
+    Args:
+        conn: Database connection or AsyncDatabase
+        run_name: Name to resume by; None generates a unique name
+        username: Owner of the run
+        task_type: e.g. 'storage' or 'production'
+        requested: Attempts requested for a new run (a resumed run keeps its own)
+        every: Successes between checkpoints
+        interval: Seconds between checkpoints
+    """
+
+    def __init__(self, conn, run_name, username, task_type, requested,
+                 every=CHECKPOINT_EVERY, interval=CHECKPOINT_INTERVAL):
+        self.conn = conn
+        # Generated names get a counter so runs started in the same second stay apart
+        self.run_name = run_name or f"{task_type}-{username}-{time.strftime('%Y%m%d-%H%M%S')}-{next(_run_ids)}"
+        self.username = username
+        self.task_type = task_type
+        self.requested = requested
+        self.attempted = 0
+        self.completed = 0
+        self.started_at = int(time.time())
+        self.every = every
+        self.interval = interval
+        self.saved_completed = 0
+        self.saved_at = time.monotonic()
+        self.resumed = False
+
+    @property
+    def remaining(self):
+        """Attempts left in the run."""
+        return max(0, self.requested - self.attempted)
+
+    async def resume(self):
+        """Load the stored progress of an unfinished run with this name. Returns True if resumed."""
+        row = await run_db(self.conn, get_run, self.run_name)
+        if row is None or row[6] == 'done':
+            return False
+        _, _, _, self.requested, self.attempted, self.completed, _, self.started_at, _ = row
+        self.saved_completed = self.completed
+        self.resumed = True
+        logger.info(f"Resuming run {self.run_name}: {self.completed} done, {self.remaining} attempts left")
+        return True
+
+    async def save(self, status='running'):
+        """Write the current counts."""
+        await run_db(self.conn, save_run, self.run_name, self.username, self.task_type, self.requested,
+                     self.attempted, self.completed, status, self.started_at, int(time.time()))
+        self.saved_completed = self.completed
+        self.saved_at = time.monotonic()
+
+    async def step(self, success):
+        """Count one attempt; checkpoint when enough successes or time have passed."""
+        self.attempted += 1
+        if success:
+            self.completed += 1
+        if (self.completed - self.saved_completed >= self.every
+                or time.monotonic() - self.saved_at >= self.interval):
+            await self.save()
+
+    async def __aenter__(self):
+        await self.resume()
+        await self.save()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            status = 'done'
+        elif issubclass(exc_type, asyncio.CancelledError):
+            status = 'cancelled'
+        else:
+            status = 'failed'
+        await self.save(status)
+        if status != 'done':
+            logger.warning(f"Run {self.run_name} {status} at {self.completed}/{self.requested}; "
+                           f"resume with run_name='{self.run_name}'")
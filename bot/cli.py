@@ -4,13 +4,19 @@ Travian Bot - Minimal Keyboard CLI
 Clean, minimal keyboard-only interface.
 """
 
+import argparse
 import asyncio
 import httpx
 import os
+import queue
 import sys
+import threading
 from bs4 import BeautifulSoup
 from datetime import datetime
 
+from bot import instrumentation, profiling, tracing
+from bot.telemetry import event_hooks
+
 # Suppress logging noise
 import logging
 logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -23,6 +29,43 @@ def clear():
     os.system('cls' if os.name == 'nt' else 'clear')
 
 
+_input_requests = queue.SimpleQueue()
+_input_thread = None
+
+
+def _deliver(future, line):
+    if not future.done():
+        if line is None:
+            future.set_exception(EOFError())
+        else:
+            future.set_result(line)
+
+
+def _read_lines():
+    """Reader thread: read one stdin line per request and hand it to the waiting coroutine."""
+    while True:
+        loop, future = _input_requests.get()
+        line = sys.stdin.readline()
+        loop.call_soon_threadsafe(_deliver, future, line.rstrip('\n') if line else None)
+
+
+async def ainput(prompt: str = "") -> str:
+    """
+    input() that does not block the event loop.
+
+    Lines are read by a daemon thread, so background tasks keep running at
+    full speed while a menu waits, and a pending read never holds up exit.
+    """
+    global _input_thread
+    if _input_thread is None:
+        _input_thread = threading.Thread(target=_read_lines, name="stdin-reader", daemon=True)
+        _input_thread.start()
+    print(prompt, end="", flush=True)
+    future = asyncio.get_running_loop().create_future()
+    _input_requests.put((asyncio.get_running_loop(), future))
+    return await future
+
+
 def format_number(num_str: str) -> str:
     """Format large numbers."""
     try:
@@ -52,7 +95,7 @@ class TaskManager:
     
     def add_task(self, name, coro):
         """Start a coroutine as a background task."""
-        task = asyncio.create_task(coro)
+        task = asyncio.create_task(profiling.labelled(name, tracing.root(name, coro)))
         self.tasks.append({
             'name': name,
             'task': task,
@@ -102,13 +145,15 @@ class TravianCLI:
         self.current_village = None
         self.resources = {}
         self.tm = TaskManager()  # New TaskManager
+        self.village_lock = asyncio.Lock()  # Held while a request depends on or changes the active village
         
     async def login(self, username: str, password: str, server_id: int = 9):
         """Login to the game."""
-        from bot.database import init_db
+        from bot.async_db import AsyncDatabase
         from bot.session_manager import SessionManager, SERVERS
         
-        self.conn = init_db()
+        if self.conn is None:
+            self.conn = await asyncio.to_thread(AsyncDatabase().open)
         self.username = username
         self.server_id = server_id
         server_info = SERVERS.get(server_id, SERVERS[9])
@@ -130,7 +175,7 @@ class TravianCLI:
         """Fetch all villages."""
         from bot.session_manager import HEADERS
         
-        async with httpx.AsyncClient(cookies=self.cookies, headers=HEADERS) as client:
+        async with httpx.AsyncClient(cookies=self.cookies, headers=HEADERS, event_hooks=event_hooks()) as client:
             response = await client.get(f"{self.server_url}/profile.php")
             soup = BeautifulSoup(response.text, 'html.parser')
             
@@ -177,7 +222,7 @@ class TravianCLI:
         """Fetch current resources."""
         from bot.session_manager import HEADERS
         
-        async with httpx.AsyncClient(cookies=self.cookies, headers=HEADERS) as client:
+        async with httpx.AsyncClient(cookies=self.cookies, headers=HEADERS, event_hooks=event_hooks()) as client:
             response = await client.get(f"{self.server_url}/village1.php")
             soup = BeautifulSoup(response.text, 'html.parser')
             
@@ -196,7 +241,7 @@ class TravianCLI:
         """Fetch resource fields (positions 1-18) with levels."""
         from bot.session_manager import HEADERS
         fields = []
-        async with httpx.AsyncClient(cookies=self.cookies, headers=HEADERS) as client:
+        async with httpx.AsyncClient(cookies=self.cookies, headers=HEADERS, event_hooks=event_hooks()) as client:
             response = await client.get(f"{self.server_url}/village1.php")
             soup = BeautifulSoup(response.text, 'html.parser')
             
@@ -222,7 +267,7 @@ class TravianCLI:
         """Fetch buildings (positions 19-40) with levels."""
         from bot.session_manager import HEADERS
         buildings = []
-        async with httpx.AsyncClient(cookies=self.cookies, headers=HEADERS) as client:
+        async with httpx.AsyncClient(cookies=self.cookies, headers=HEADERS, event_hooks=event_hooks()) as client:
             response = await client.get(f"{self.server_url}/village2.php")
             soup = BeautifulSoup(response.text, 'html.parser')
             
@@ -246,7 +291,8 @@ class TravianCLI:
     async def switch_village(self, village_id: str):
         """Switch to a different village."""
         from bot.session_manager import HEADERS
-        async with httpx.AsyncClient(cookies=self.cookies, headers=HEADERS) as client:
+        async with self.village_lock, \
+                httpx.AsyncClient(cookies=self.cookies, headers=HEADERS, event_hooks=event_hooks()) as client:
             await client.get(f"{self.server_url}/village1.php?newdid={village_id}")
         # Update current village
         for v in self.villages:
@@ -279,10 +325,12 @@ class TravianCLI:
             print("  [5] Village Selection")
             print("  [6] Train Troops")
             print("  [7] Find Empty Spots & Settle")
+            print("  [8] Farm List (raid nearby villages)")
+            print("  [9] Attack Waves (land together)")
             print("  [r] Refresh")
             print("  [q] Quit")
             
-            cmd = input("\n  > ").strip().lower()
+            cmd = (await ainput("\n  > ")).strip().lower()
             
             if cmd == '1':
                 await self.production_menu()
@@ -300,6 +348,10 @@ class TravianCLI:
                 await self.troop_training_menu()
             elif cmd == '7':
                 await self.settling_menu()
+            elif cmd == '8':
+                await self.farm_list_menu()
+            elif cmd == '9':
+                await self.attack_waves_menu()
             elif cmd == 'r':
                 await self.fetch_resources()
             elif cmd == 'q':
@@ -307,19 +359,17 @@ class TravianCLI:
                 return
         print("  " + "-" * 40)
         
-        loops = input("  Number of loops [10]: ").strip()
+        loops = (await ainput("  Number of loops [10]: ")).strip()
         loops = int(loops) if loops.isdigit() else 10
         
         print(f"\n  Running {loops} production increases...")
         print("  (Note: May not work due to anti-bot protection)")
         
         from bot.production import increase_production_async
-        from bot.database import init_db
-        conn = init_db()
-        await increase_production_async(self.username, "", loops, conn, self.cookies)
+        await increase_production_async(self.username, "", loops, self.conn, self.cookies)
         
         await self.fetch_resources()
-        input("\n  Press Enter to continue...")
+        await ainput("\n  Press Enter to continue...")
     
     async def storage_menu(self):
         """Storage increase menu."""
@@ -328,19 +378,17 @@ class TravianCLI:
         print("\n  STORAGE INCREASE")
         print("  " + "-" * 40)
         
-        loops = input("  Number of loops [10]: ").strip()
+        loops = (await ainput("  Number of loops [10]: ")).strip()
         loops = int(loops) if loops.isdigit() else 10
         
         print(f"\n  Running {loops} storage increases...")
         print("  (Note: May not work due to anti-bot protection)")
         
         from bot.storage import increase_storage_async
-        from bot.database import init_db
-        conn = init_db()
-        await increase_storage_async(self.username, "", loops, conn, self.cookies)
+        await increase_storage_async(self.username, "", loops, self.conn, self.cookies)
         
         await self.fetch_resources()
-        input("\n  Press Enter to continue...")
+        await ainput("\n  Press Enter to continue...")
     
     async def resource_fields_menu(self):
         """Resource fields upgrade - Background Task version."""
@@ -354,7 +402,7 @@ class TravianCLI:
         print("\n  Fetching current levels...")
         from bot.construction import get_field_info, upgrade_all_resources, HEADERS
         
-        async with httpx.AsyncClient(cookies=self.cookies, headers=HEADERS) as client:
+        async with httpx.AsyncClient(cookies=self.cookies, headers=HEADERS, event_hooks=event_hooks()) as client:
             print(f"\n  {'Pos':<5} {'Type':<20} {'Level':<10}")
             print("  " + "-" * 40)
             for pos in range(1, 19):
@@ -364,7 +412,7 @@ class TravianCLI:
         print("\n  [Enter] Upgrade ALL to Level 30")
         print("  [b] Back")
         
-        target = input("\n  Target Level [30]: ").strip()
+        target = (await ainput("\n  Target Level [30]: ")).strip()
         if target.lower() == 'b':
             return
             
@@ -388,7 +436,7 @@ class TravianCLI:
         
         print("  " + "=" * 50)
         print("  ✓ Done!")
-        input("\n  Press Enter to continue...")
+        await ainput("\n  Press Enter to continue...")
     
     async def production_menu(self):
         """Production increase menu - synchronous with real-time logs."""
@@ -397,23 +445,20 @@ class TravianCLI:
         print("\n  PRODUCTION INCREASE")
         print("  " + "-" * 50)
         
-        loops = input("  Number of loops [5]: ").strip()
+        loops = (await ainput("  Number of loops [5]: ")).strip()
         loops = int(loops) if loops.isdigit() else 5
         
         print(f"\n  Running {loops} production increases...")
         print("  " + "=" * 50)
         
         from bot.production import increase_production_async
-        from bot.database import init_db
-        
-        conn = init_db()
         for i in range(loops):
             print(f"  Loop {i+1}/{loops}...")
-            await increase_production_async(self.cookies, self.server_url, conn)
+            await increase_production_async(self.cookies, self.server_url, self.conn)
         
         print("  " + "=" * 50)
         print("  ✓ Done!")
-        input("\n  Press Enter to continue...")
+        await ainput("\n  Press Enter to continue...")
     
     async def storage_menu(self):
         """Storage increase menu - synchronous with real-time logs."""
@@ -422,23 +467,20 @@ class TravianCLI:
         print("\n  STORAGE INCREASE")
         print("  " + "-" * 50)
         
-        loops = input("  Number of loops [5]: ").strip()
+        loops = (await ainput("  Number of loops [5]: ")).strip()
         loops = int(loops) if loops.isdigit() else 5
         
         print(f"\n  Running {loops} storage increases...")
         print("  " + "=" * 50)
         
         from bot.storage import increase_storage_async
-        from bot.database import init_db
-        
-        conn = init_db()
         for i in range(loops):
             print(f"  Loop {i+1}/{loops}...")
-            await increase_storage_async(self.cookies, self.server_url, conn)
+            await increase_storage_async(self.cookies, self.server_url, self.conn)
         
         print("  " + "=" * 50)
         print("  ✓ Done!")
-        input("\n  Press Enter to continue...")
+        await ainput("\n  Press Enter to continue...")
     
     async def buildings_menu(self):
         """Buildings upgrade with presets - Background Task version."""
@@ -463,13 +505,13 @@ class TravianCLI:
         print("  [d] Demolish (destroy a building)")
         print("  [b] Back")
         
-        choice = input("\n  > ").strip().lower()
+        choice = (await ainput("\n  > ")).strip().lower()
         if choice == 'b':
             return
         
         if choice == '0':
             # Standard upgrade - upgrade all existing buildings
-            target = input("  Target Level [20]: ").strip()
+            target = (await ainput("  Target Level [20]: ")).strip()
             target = int(target) if target.isdigit() else 20
             
             print(f"\n  Upgrading all buildings to Level {target}...")
@@ -482,7 +524,7 @@ class TravianCLI:
             
             print("  " + "=" * 50)
             print("  ✓ Done!")
-            input("\n  Press Enter to continue...")
+            await ainput("\n  Press Enter to continue...")
             return
         
         if choice == 'd':
@@ -498,7 +540,7 @@ class TravianCLI:
             print(f"    Resources: {'Level ' + str(preset['resource_target']) if preset['resource_target'] else 'SKIP'}")
             print(f"    Buildings: {len(preset['buildings'])} total")
             
-            confirm = input("\n  Start build? [y/N]: ").strip().lower()
+            confirm = (await ainput("\n  Start build? [y/N]: ")).strip().lower()
             if confirm != 'y':
                 return
             
@@ -524,7 +566,7 @@ class TravianCLI:
             
             print("  " + "=" * 50)
             print(f"  ✓ Done: {preset['name']}")
-            input("\n  Press Enter to continue...")
+            await ainput("\n  Press Enter to continue...")
             return
             
         else:
@@ -545,7 +587,7 @@ class TravianCLI:
                 print(f"  [{i}] {v['name']} ({v['x']}|{v['y']}){marker}")
             
             print("\n  Enter number to switch, or [b] to go back")
-            choice = input("  > ").strip().lower()
+            choice = (await ainput("  > ")).strip().lower()
             
             if choice == 'b':
                 break
@@ -574,7 +616,7 @@ class TravianCLI:
             if b['name'] and b['name'] != 'Empty':
                 print(f"  [{b['pos']:>2}] {b['name']:<20} Lv.{b['level']}")
         
-        input("\n  Press Enter to continue...")
+        await ainput("\n  Press Enter to continue...")
 
     async def demolish_menu(self):
         """Demolish/destroy a building."""
@@ -591,7 +633,7 @@ class TravianCLI:
             if b['name'] and b['name'] != 'Empty' and 'construction' not in b['name'].lower():
                 print(f"  [{b['pos']:>2}] {b['name']:<20} Lv.{b['level']}")
         
-        pos = input("\n  Enter building position to demolish (or 'b' to cancel): ").strip()
+        pos = (await ainput("\n  Enter building position to demolish (or 'b' to cancel): ")).strip()
         if pos.lower() == 'b':
             return
         
@@ -602,7 +644,7 @@ class TravianCLI:
                 await asyncio.sleep(1)
                 return
             
-            confirm = input(f"  Demolish building at position {pos}? [y/N]: ").strip().lower()
+            confirm = (await ainput(f"  Demolish building at position {pos}? [y/N]: ")).strip().lower()
             if confirm != 'y':
                 return
             
@@ -633,7 +675,7 @@ class TravianCLI:
         from bot.construction import research_academy
         await research_academy(self.session_manager)
         
-        input("\n  Press Enter to continue...")
+        await ainput("\n  Press Enter to continue...")
     
     async def upgrade_armory(self):
         """Upgrade in Armory."""
@@ -644,7 +686,7 @@ class TravianCLI:
         from bot.construction import upgrade_armory
         await upgrade_armory(self.session_manager)
         
-        input("\n  Press Enter to continue...")
+        await ainput("\n  Press Enter to continue...")
     
     async def upgrade_smithy(self):
         """Upgrade in Smithy."""
@@ -655,7 +697,7 @@ class TravianCLI:
         from bot.construction import upgrade_smithy
         await upgrade_smithy(self.session_manager)
         
-        input("\n  Press Enter to continue...")
+        await ainput("\n  Press Enter to continue...")
 
     async def troop_training_menu(self):
         """Troop training menu."""
@@ -669,12 +711,45 @@ class TravianCLI:
         print("  [2] Stable (Cavalry)")
         print("  [3] Siege Workshop")
         print("  [4] Residence (Train Settlers)")
+        print("  [5] All buildings (parallel max training)")
         print("  [b] Back")
         
-        choice = input("\n  > ").strip().lower()
+        choice = (await ainput("\n  > ")).strip().lower()
         if choice == 'b':
             return
         
+        if choice == '5':
+            from bot.training_engine import TrainingEngine, parse_ratio
+            
+            tribe = self.session_manager.civilization or 'roman'
+            text = (await ainput("  Units and ratio (e.g. legionnaire=3,equites_imperatoris=1): ")).strip()
+            try:
+                ratio = parse_ratio(text, tribe)
+            except ValueError as e:
+                print(f"  {e}")
+                await asyncio.sleep(1)
+                return
+            if not ratio:
+                print("  No units given.")
+                await asyncio.sleep(1)
+                return
+            
+            client = await self.session_manager.get_client()
+            engine = TrainingEngine(client, self.server_url, ratio, tribe, callback=self.tm.log)
+            
+            async def training_engine_task():
+                try:
+                    await engine.run()
+                finally:
+                    for village_id, stats in engine.report().items():
+                        self.tm.log(f"Village {village_id or 'active'}: {stats['troops']} troops queued "
+                                    f"({stats['per_hour']:.0f}/hour)")
+            
+            self.tm.add_task("Training engine", training_engine_task())
+            print("  Training engine started in the background.")
+            await asyncio.sleep(1)
+            return
+        
         building_positions = {'1': 19, '2': 20, '3': 21, '4': 25}
         
         if choice not in building_positions:
@@ -686,7 +761,7 @@ class TravianCLI:
         
         # For settlers
         if choice == '4':
-            count = input("  How many settlers? [3]: ").strip()
+            count = (await ainput("  How many settlers? [3]: ")).strip()
             count = int(count) if count.isdigit() else 3
             
             async def train_settlers_task():
@@ -707,13 +782,13 @@ class TravianCLI:
             
             print("  " + "=" * 50)
             print("  ✓ Settlers training queued!")
-            input("\n  Press Enter to continue...")
+            await ainput("\n  Press Enter to continue...")
         else:
             # Regular troops
-            troop_idx = input("  Troop type (1-6) [1]: ").strip()
+            troop_idx = (await ainput("  Troop type (1-6) [1]: ")).strip()
             troop_idx = int(troop_idx) if troop_idx.isdigit() else 1
             
-            loops = input("  Training loops [10]: ").strip()
+            loops = (await ainput("  Training loops [10]: ")).strip()
             loops = int(loops) if loops.isdigit() else 10
             
             print(f"\n  Training troops ({loops} loops)...")
@@ -728,7 +803,7 @@ class TravianCLI:
             
             print("  " + "=" * 50)
             print("  ✓ Troop training complete!")
-            input("\n  Press Enter to continue...")
+            await ainput("\n  Press Enter to continue...")
 
     async def settling_menu(self):
         """Find empty spots and settle menu."""
@@ -743,7 +818,7 @@ class TravianCLI:
         print("  [3] Settle at specific coordinates")
         print("  [b] Back")
         
-        choice = input("\n  > ").strip().lower()
+        choice = (await ainput("\n  > ")).strip().lower()
         if choice == 'b':
             return
         
@@ -769,7 +844,7 @@ class TravianCLI:
                 print("  No empty spots found nearby.")
             
             print("  " + "=" * 50)
-            input("\n  Press Enter to continue...")
+            await ainput("\n  Press Enter to continue...")
             
         elif choice == '2':
             # Smart settle
@@ -788,12 +863,12 @@ class TravianCLI:
                 print("  ✓ Village settled successfully!")
             else:
                 print("  ✗ Settling not complete - see messages above")
-            input("\n  Press Enter to continue...")
+            await ainput("\n  Press Enter to continue...")
             
         elif choice == '3':
             # Settle at coordinates
-            x = input("  Enter X coordinate: ").strip()
-            y = input("  Enter Y coordinate: ").strip()
+            x = (await ainput("  Enter X coordinate: ")).strip()
+            y = (await ainput("  Enter Y coordinate: ")).strip()
             
             try:
                 x, y = int(x), int(y)
@@ -815,27 +890,139 @@ class TravianCLI:
                     print(f"  ✓ Settled at ({x}|{y})!")
                 else:
                     print(f"  ✗ Failed to settle at ({x}|{y})")
-                input("\n  Press Enter to continue...")
+                await ainput("\n  Press Enter to continue...")
                 
             except ValueError:
                 print("  Invalid coordinates!")
                 await asyncio.sleep(1)
 
 
-    async def increase_production_task(self, loops):
-        """Wrapper task for production."""
+    async def select_village(self, prompt):
+        """Ask for one of our villages by number. Returns the village dict or None."""
+        for i, v in enumerate(self.villages, 1):
+            print(f"  [{i}] {v['name']} ({v['x']}|{v['y']})")
+        choice = (await ainput(prompt)).strip()
+        if choice.isdigit() and 1 <= int(choice) <= len(self.villages):
+            return self.villages[int(choice) - 1]
+        return None
+
+    async def farm_list_menu(self):
+        """Raid the nearest villages from one of ours with a fixed troop set, in the background."""
+        clear()
+        self.print_header()
+        print("\n  FARM LIST")
+        print("  " + "-" * 50)
+
+        source = await self.select_village("\n  Raid from village: ")
+        if source is None:
+            return
+
+        from bot.async_db import run_db
+        from bot.farm_list import FarmList, load_targets
+        from bot.troop_inventory import TroopInventory
+
+        radius = (await ainput("  Raid targets within how many tiles? [10]: ")).strip()
+        radius = float(radius) if radius.replace('.', '', 1).isdigit() else 10.0
+        targets = await run_db(self.conn, load_targets, self.username, int(source['id']), radius)
+        if not targets:
+            print("  No targets in range. Crawl the player villages first.")
+            await ainput("\n  Press Enter to continue...")
+            return
+
+        troop_idx = (await ainput("  Troop type to raid with (1-6) [1]: ")).strip()
+        troop_idx = int(troop_idx) if troop_idx.isdigit() else 1
+        per_raid = (await ainput("  Troops per raid [10]: ")).strip()
+        per_raid = int(per_raid) if per_raid.isdigit() else 10
+        rounds = (await ainput("  Rounds [1]: ")).strip()
+        rounds = int(rounds) if rounds.isdigit() else 1
+
+        client = await self.session_manager.get_client()
+        farm = FarmList(client, self.server_url, source['id'], targets, {troop_idx: per_raid}, callback=self.tm.log,
+                        inventory=TroopInventory(client, self.server_url, village_lock=self.village_lock),
+                        village_lock=self.village_lock)
+
+        async def farm_list_task():
+            report = await farm.run(rounds=rounds)
+            self.tm.log(f"Farm list: {report['sent']} raids sent ({report['raids_per_minute']:.0f}/min), "
+                        f"{report['failed']} failed, {report['skipped']} skipped")
+
+        self.tm.add_task(f"Farm list ({len(targets)} targets)", farm_list_task())
+        print(f"  Farm list started in the background against {len(targets)} targets.")
+        await asyncio.sleep(1)
+
+    async def attack_waves_menu(self):
+        """Send attack waves from several of our villages that land on one target together."""
+        clear()
+        self.print_header()
+        print("\n  ATTACK WAVES")
+        print("  " + "-" * 50)
+
+        from bot.async_db import run_db
+        from bot.travel import run_waves, travel_time, village_coords
+        from bot.troop_inventory import TroopInventory
+
+        target_id = (await ainput("  Target village ID: ")).strip()
+        if not target_id.isdigit():
+            return
+        target_id = int(target_id)
+        target_xy = await run_db(self.conn, village_coords, target_id)
+        if target_xy is None:
+            print("  Unknown target. Crawl the player villages first.")
+            await ainput("\n  Press Enter to continue...")
+            return
+
+        tribe = self.session_manager.civilization or 'roman'
+        tournament_square = (await ainput("  Tournament Square level [0]: ")).strip()
+        tournament_square = int(tournament_square) if tournament_square.isdigit() else 0
+        server_speed = (await ainput("  Server troop speed [1]: ")).strip()
+        server_speed = float(server_speed) if server_speed.replace('.', '', 1).isdigit() else 1.0
+
+        waves = []
+        while True:
+            print(f"\n  Wave {len(waves) + 1}")
+            source = await self.select_village("  Send from village (blank to finish): ")
+            if source is None:
+                break
+            troops = {}
+            for part in (await ainput("  Troops as index=count, e.g. 1=500,7=20: ")).split(','):
+                index, _, count = part.partition('=')
+                if index.strip().isdigit() and count.strip().isdigit():
+                    troops[int(index)] = int(count)
+            if not troops:
+                continue
+            wave = {'source': source['id'], 'origin': (source['x'], source['y']), 'target': target_id,
+                    'target_xy': target_xy, 'troops': troops}
+            seconds = travel_time(wave['origin'], target_xy, troops, tribe, tournament_square, server_speed)
+            print(f"  Travel time from {source['name']}: {seconds // 3600}:{seconds % 3600 // 60:02}:{seconds % 60:02}")
+            waves.append(wave)
+        if not waves:
+            return
+
+        print("\n  " + "=" * 50)
+        client = await self.session_manager.get_client()
+        results = await run_waves(client, self.server_url, waves, tribe, tournament_square=tournament_square,
+                                  server_speed=server_speed,
+                                  inventory=TroopInventory(client, self.server_url, village_lock=self.village_lock))
+        for wave in sorted(results, key=lambda w: w['order']):
+            status = f"sent {wave['late_ms']:.1f} ms after plan" if wave['sent'] else "FAILED"
+            print(f"  Wave {wave['order'] + 1}: {status}")
+        print("  " + "=" * 50)
+        await ainput("\n  Press Enter to continue...")
+
+    async def increase_production_task(self, loops, run_name=None):
+        """Wrapper task for production. Passing the name of an unfinished run resumes it."""
         from bot.production import increase_production_async
         self.tm.log(f"Starting production increase ({loops} loops)")
         # Create a custom callback or pass db connection
         # For now reusing existing function which prints to stdout (might interfere with UI slightly but OK)
-        await increase_production_async(self.username, "", loops, self.conn, self.cookies)
+        await increase_production_async(self.username, "", loops, self.conn, self.cookies, run_name=run_name)
         self.tm.log("Finished production increase")
 
-    async def increase_storage_task(self, loops):
-        """Wrapper task for storage."""
+    async def increase_storage_task(self, loops, run_name=None):
+        """Wrapper task for storage. Passing the name of an unfinished run resumes it."""
         from bot.storage import increase_storage_async
         self.tm.log(f"Starting storage increase ({loops} loops)")
-        await increase_storage_async(self.username, "", loops, self.conn, self.cookies)
+        await increase_storage_async(self.username, "", loops, self.conn, self.cookies, run_name=run_name)
         self.tm.log("Finished storage increase")
 
     async def view_logs(self):
@@ -849,7 +1036,7 @@ class TravianCLI:
                 print(f"  {log}")
             print("-" * 60)
             print("  [b] Back")
-            if input("  > ").lower() == 'b':
+            if (await ainput("  > ")).lower() == 'b':
                 break
             await asyncio.sleep(0.5)
 
@@ -914,8 +1101,8 @@ async def main():
     
     # Login credentials with defaults
     print("  Press Enter for defaults (abaddon/bristleback)")
-    username = input("  Username [abaddon]: ").strip() or "abaddon"
-    password = input("  Password [bristleback]: ").strip() or "bristleback"
+    username = (await ainput("  Username [abaddon]: ")).strip() or "abaddon"
+    password = (await ainput("  Password [bristleback]: ")).strip() or "bristleback"
     
     print("\n  Logging in to gotravspeed.com...")
     
@@ -959,7 +1146,7 @@ async def main():
             print(f"  {s['id']:<4} {s['name']:<12} {s['speed']:<18} {s['players']}")
         
         print()
-        server_choice = input("  Enter server ID [9]: ").strip()
+        server_choice = (await ainput("  Enter server ID [9]: ")).strip()
         server_id = int(server_choice) if server_choice.isdigit() else 9
         
         # Find server name
@@ -984,7 +1171,7 @@ async def main():
             print("  [1] Roman")
             print("  [2] Teuton")
             print("  [3] Gaul")
-            tribe = input("\n  Tribe (1/2/3) [1]: ").strip()
+            tribe = (await ainput("\n  Tribe (1/2/3) [1]: ")).strip()
             if tribe not in ['1', '2', '3']:
                 tribe = '1'
             
@@ -1082,20 +1269,33 @@ def arrow_menu(title: str, options: list) -> int:
             return int(key) - 1
 
 
-def run():
-    """Entry point for package - auto login."""
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Minimal keyboard CLI for the bot.")
+    parser.add_argument('--profile', nargs='?', const=profiling.PROFILE_DIR, metavar='DIR',
+                        help=f"Profile every task and write the dumps to DIR (default: {profiling.PROFILE_DIR})")
+    return parser.parse_args()
+
+
+def _start(entry):
+    args = _parse_args()
+    instrumentation.enable_from_env()
+    coro = entry()
     try:
-        asyncio.run(main_auto())
+        asyncio.run(profiling.run(coro, args.profile) if args.profile else coro)
     except KeyboardInterrupt:
         print("\n\n  Interrupted. Goodbye!")
+    finally:
+        instrumentation.disable()
+
+
+def run():
+    """Entry point for package - auto login."""
+    _start(main_auto)
 
 
 def run_manual():
     """Entry point for manual login."""
-    try:
-        asyncio.run(main())
-    except KeyboardInterrupt:
-        print("\n\n  Interrupted. Goodbye!")
+    _start(main)
 
 
 if __name__ == "__main__":
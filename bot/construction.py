@@ -1,8 +1,11 @@
 # construction.py
+import contextlib
 import httpx
 import logging
 from bs4 import BeautifulSoup
+from . import metrics, profiling, tracing
 from .database import get_buildings
+from .telemetry import event_hooks
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
@@ -15,10 +18,23 @@ HEADERS = {
 }
 
 
+def _client(cookies, client=None, **kwargs):
+    """The given shared client (left open), or a new client for these cookies."""
+    if client is not None:
+        return contextlib.nullcontext(client)
+    return httpx.AsyncClient(cookies=cookies, headers=HEADERS, event_hooks=event_hooks(), **kwargs)
+
+
+def _soup(html):
+    """Parse a page, traced as a 'parse' span."""
+    with tracing.span('BeautifulSoup', 'parse'):
+        return BeautifulSoup(html, "html.parser")
+
+
 async def get_field_info(client, server_url: str, position_id: int) -> dict:
     """Get info about a resource field or building."""
     response = await client.get(f"{server_url}/build.php?id={position_id}")
-    soup = BeautifulSoup(response.text, "html.parser")
+    soup = _soup(response.text)
     
     # Get name from h1
     h1 = soup.find('h1')
@@ -51,7 +67,7 @@ async def get_field_info(client, server_url: str, position_id: int) -> dict:
 async def upgrade_field(client, server_url: str, position_id: int) -> bool:
     """Upgrade a single resource field or building once."""
     response = await client.get(f"{server_url}/build.php?id={position_id}")
-    soup = BeautifulSoup(response.text, "html.parser")
+    soup = _soup(response.text)
     build_link = soup.find("a", class_="build")
     
     if build_link is None:
@@ -86,7 +102,7 @@ async def construct_building(client, server_url: str, position_id: int, building
         logger.warning(f"Position {position_id} is not empty - cannot construct new building")
         return False
     
-    soup = BeautifulSoup(response.text, "html.parser")
+    soup = _soup(response.text)
     
     # Find the build link for the specific building ID
     # Format: village2.php?id=X&b=Y&k=CSRF
@@ -125,7 +141,22 @@ async def find_empty_slot(client, server_url: str) -> int:
     return -1
 
 
-async def apply_preset(cookies, server_url: str, preset: dict, callback=None):
+def _track_build_queue(buildings):
+    """Yield preset buildings, counting the ones not yet processed in tbot_build_queue_steps."""
+    counts = [building.get('count', 1) for building in buildings]
+    remaining = sum(counts)
+    metrics.BUILD_QUEUE.inc(remaining)
+    try:
+        for building, count in zip(buildings, counts):
+            yield building
+            remaining -= count
+            metrics.BUILD_QUEUE.dec(count)
+    finally:
+        metrics.BUILD_QUEUE.dec(remaining)
+
+
+@profiling.profiled
+async def apply_preset(cookies, server_url: str, preset: dict, callback=None, client=None):
     """
     Apply a building preset to the current village.
     
@@ -133,9 +164,11 @@ async def apply_preset(cookies, server_url: str, preset: dict, callback=None):
     1. Scan all positions to find existing buildings
     2. For each building in preset, find or construct it
     3. Upgrade all buildings to their target levels
+
+    With a shared client (e.g. SessionManager.get_client()) its requests go
+    through that client's pool, and it is left open.
     """
-    import asyncio
-    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS, timeout=30.0) as client:
+    async with _client(cookies, client, timeout=30.0) as client:
         # Step 1: Scan all positions to see what's already built
         if callback:
             callback("Scanning existing buildings...")
@@ -145,7 +178,7 @@ async def apply_preset(cookies, server_url: str, preset: dict, callback=None):
         import re
         for pos in range(19, 41):
             # Add delay to avoid rate limiting
-            await asyncio.sleep(0.3)
+            await tracing.sleep(0.3)
             
             try:
                 response = await client.get(f"{server_url}/build.php?id={pos}")
@@ -154,10 +187,10 @@ async def apply_preset(cookies, server_url: str, preset: dict, callback=None):
                 if response.status_code == 503:
                     if callback:
                         callback(f"  [{pos}] Rate limited, waiting...")
-                    await asyncio.sleep(2)
+                    await tracing.sleep(2)
                     response = await client.get(f"{server_url}/build.php?id={pos}")
                 
-                soup = BeautifulSoup(response.text, "html.parser")
+                soup = _soup(response.text)
                 h1 = soup.find('h1')
                 
                 if h1:
@@ -198,7 +231,7 @@ async def apply_preset(cookies, server_url: str, preset: dict, callback=None):
         buildings_to_build = preset.get('buildings', [])
         used_positions = set()
         
-        for building in buildings_to_build:
+        for building in _track_build_queue(buildings_to_build):
             bid = building['bid']
             name = building['name']
             target_level = building.get('level', 1)
@@ -243,7 +276,7 @@ async def apply_preset(cookies, server_url: str, preset: dict, callback=None):
                         callback(f"  Building {name} at slot {empty_pos}...")
                     
                     # Delay before construction
-                    await asyncio.sleep(0.5)
+                    await tracing.sleep(0.5)
                     success = await construct_building(client, server_url, empty_pos, bid)
                     if success:
                         existing_pos = empty_pos
@@ -270,7 +303,7 @@ async def apply_preset(cookies, server_url: str, preset: dict, callback=None):
                     
                     upgrades_done = 0
                     while current < target_level:
-                        await asyncio.sleep(0.3)  # Delay between upgrades
+                        await tracing.sleep(0.3)  # Delay between upgrades
                         
                         info = await get_field_info(client, server_url, existing_pos)
                         current = info['level']
@@ -310,7 +343,7 @@ async def find_building_position(client, server_url: str, building_name: str) ->
     """Find position of an existing building by name. Returns -1 if not found."""
     for pos in range(19, 41):
         response = await client.get(f"{server_url}/build.php?id={pos}")
-        soup = BeautifulSoup(response.text, "html.parser")
+        soup = _soup(response.text)
         h1 = soup.find('h1')
         if h1:
             text = h1.text.lower()
@@ -335,7 +368,7 @@ async def demolish_building(cookies, server_url: str, position_id: int, callback
     Returns:
         True if demolition started
     """
-    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS) as client:
+    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS, event_hooks=event_hooks()) as client:
         # Find Main Building position (usually position 26, but check)
         main_building_pos = await find_building_position(client, server_url, "Main Building")
         
@@ -346,7 +379,7 @@ async def demolish_building(cookies, server_url: str, position_id: int, callback
         
         # Go to Main Building page
         response = await client.get(f"{server_url}/build.php?id={main_building_pos}")
-        soup = BeautifulSoup(response.text, "html.parser")
+        soup = _soup(response.text)
         
         # Look for demolish/destroy link or tab
         # Usually it's a link like build.php?id=26&t=2 or similar
@@ -368,7 +401,7 @@ async def demolish_building(cookies, server_url: str, position_id: int, callback
             demolish_link = f"{server_url}/{demolish_link}"
         
         response = await client.get(demolish_link)
-        soup = BeautifulSoup(response.text, "html.parser")
+        soup = _soup(response.text)
         
         # Find the building in the list and click demolish
         # Usually a form with building position select
@@ -403,7 +436,7 @@ async def upgrade_field_to_level(cookies, server_url: str, position_id: int, tar
     Upgrade a field to a target level.
     Returns (success_count, current_level)
     """
-    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS) as client:
+    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS, event_hooks=event_hooks()) as client:
         success = 0
         current = 0
         
@@ -428,11 +461,12 @@ async def upgrade_field_to_level(cookies, server_url: str, position_id: int, tar
         return success, current
 
 
+@profiling.profiled
 async def upgrade_all_resources(cookies, server_url: str, target_level: int = 30, callback=None):
     """
     Upgrade all resource fields (1-18) to target level.
     """
-    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS) as client:
+    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS, event_hooks=event_hooks()) as client:
         results = []
         
         for pos in range(1, 19):
@@ -473,11 +507,12 @@ async def upgrade_all_resources(cookies, server_url: str, target_level: int = 30
         return results
 
 
+@profiling.profiled
 async def upgrade_all_buildings(cookies, server_url: str, target_level: int = 20, callback=None):
     """
     Upgrade all buildings (19-40) to target level.
     """
-    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS) as client:
+    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS, event_hooks=event_hooks()) as client:
         results = []
         
         for pos in range(19, 41):
@@ -532,7 +567,7 @@ async def upgrade_all_buildings(cookies, server_url: str, target_level: int = 20
 # Legacy functions for backwards compatibility
 async def build_or_upgrade_resource(cookies, position_id, loop, server_url="https://fun.gotravspeed.com"):
     """Build or upgrade a resource field."""
-    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS) as client:
+    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS, event_hooks=event_hooks()) as client:
         for _ in range(loop):
             if not await upgrade_field(client, server_url, position_id):
                 break
@@ -541,20 +576,20 @@ async def build_or_upgrade_resource(cookies, position_id, loop, server_url="http
 
 async def construct_and_upgrade_building(cookies, position_id, building_id, loops, server_url="https://fun.gotravspeed.com"):
     """Construct or upgrade a building."""
-    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS) as client:
+    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS, event_hooks=event_hooks()) as client:
         for _ in range(loops):
             if not await upgrade_field(client, server_url, position_id):
                 break
             logger.info(f"Upgraded building at position {position_id}")
 
 
-async def research_academy(session_manager, server_url="https://fun.gotravspeed.com"):
-    """Research new troops in the Academy."""
-    cookies = await session_manager.get_cookies()
-    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS) as client:
+async def research_academy(session_manager, server_url="https://fun.gotravspeed.com", client=None):
+    """Research new troops in the Academy. Uses client if given, else a client on the session's transport."""
+    cookies = await session_manager.get_cookies() if client is None else None
+    async with _client(cookies, client, transport=session_manager.transport) as client:
         while True:
             response = await client.get(f"{server_url}/build.php?id=33")
-            soup = BeautifulSoup(response.text, 'html.parser')
+            soup = _soup(response.text)
             research_links = soup.select('table.build_details .act a.build')
             if not research_links:
                 logger.info("All troops in the Academy are fully researched.")
@@ -567,13 +602,13 @@ async def research_academy(session_manager, server_url="https://fun.gotravspeed.
                 break
 
 
-async def upgrade_armory(session_manager, server_url="https://fun.gotravspeed.com"):
-    """Upgrade troops in the Armory."""
-    cookies = await session_manager.get_cookies()
-    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS) as client:
+async def upgrade_armory(session_manager, server_url="https://fun.gotravspeed.com", client=None):
+    """Upgrade troops in the Armory. Uses client if given, else a client on the session's transport."""
+    cookies = await session_manager.get_cookies() if client is None else None
+    async with _client(cookies, client, transport=session_manager.transport) as client:
         while True:
             response = await client.get(f"{server_url}/build.php?id=29")
-            soup = BeautifulSoup(response.text, 'html.parser')
+            soup = _soup(response.text)
             upgrade_links = soup.select('table.build_details .act a.build')
             if not upgrade_links:
                 logger.info("All troops in the Armory are fully upgraded.")
@@ -589,13 +624,13 @@ async def upgrade_armory(session_manager, server_url="https://fun.gotravspeed.co
                     break
 
 
-async def upgrade_smithy(session_manager, server_url="https://fun.gotravspeed.com"):
-    """Upgrade troops in the Smithy."""
-    cookies = await session_manager.get_cookies()
-    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS) as client:
+async def upgrade_smithy(session_manager, server_url="https://fun.gotravspeed.com", client=None):
+    """Upgrade troops in the Smithy. Uses client if given, else a client on the session's transport."""
+    cookies = await session_manager.get_cookies() if client is None else None
+    async with _client(cookies, client, transport=session_manager.transport) as client:
         while True:
             response = await client.get(f"{server_url}/build.php?id=21")
-            soup = BeautifulSoup(response.text, 'html.parser')
+            soup = _soup(response.text)
             upgrade_links = soup.select('table.build_details .act a.build')
             if not upgrade_links:
                 logger.info("All troops in the Smithy are fully upgraded.")
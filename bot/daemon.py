@@ -0,0 +1,437 @@
+# daemon.py
+"""
+Headless daemon driven by a job file.
+
+Runs every job of every account concurrently under one event loop, without
+ever prompting. Each account logs in once and its jobs share the session's
+pooled client and one AsyncDatabase.
+
+    tbot-daemon jobs.json [--status daemon_status.json] [--profile profiles]
+
+Job file (JSON):
+
+    {
+      "max_jobs": 8,
+      "max_connections": 64,
+      "host_rates": {"fun.gotravspeed.com": 40},
+      "status_file": "daemon_status.json",
+      "accounts": [
+        {
+          "username": "abaddon",
+          "password_env": "TBOT_PASSWORD",
+          "server": 9,
+          "tribe": "roman",
+          "max_jobs": 3,
+          "jobs": [
+            {"type": "storage", "loops": 500, "concurrency": 2, "target": {"storage": 50000000},
+             "restart": "on-failure", "max_restarts": 10},
+            {"type": "production", "loops": 200, "restart": "always", "interval": 600},
+            {"type": "preset", "village": 123456, "preset": "farm"},
+            {"type": "research", "village": 123456, "what": ["academy", "smithy", "armory"]},
+            {"type": "training", "villages": [123456], "ratio": "legionnaire=3,imperian=1", "duration": 3600,
+             "restart": "always"},
+            {"type": "settling"}
+          ]
+        }
+      ]
+    }
+
+Restart policies: 'never' (default), 'on-failure' (retry with exponential
+backoff from `backoff` seconds) and 'always' (run again `interval` seconds
+after finishing, or after a backoff when failed). `max_restarts` caps both.
+
+All accounts share one Orchestrator: one connection pool, a request rate
+budget per host (host_rate, or host_rates per host) and job slots handed
+out round-robin across accounts. The status file includes its throughput.
+
+Jobs that work on the active village (preset, research, settling) hold
+their account's village lock while running, since the game keeps the
+active village per session. Training holds it for each village's cycle,
+but not while it sleeps between cycles.
+
+With TBOT_METRICS_PORT set, the orchestrator's job and host queues are also
+exported at http://127.0.0.1:<port>/metrics (see metrics.py).
+
+The status file is rewritten (atomically) every STATUS_INTERVAL seconds and
+whenever a job changes state.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+
+from . import instrumentation, metrics, profiling, tracing
+from .async_db import AsyncDatabase
+from .construction import apply_preset, research_academy, upgrade_armory, upgrade_smithy
+from .database import DB_PATH
+from .orchestrator import Orchestrator, MAX_CONNECTIONS, HOST_RATE
+from .presets import PRESETS, PRESET_ARMY, PRESET_FARM, PRESET_QUICK_SETTLE, PRESET_FULL
+from .production import increase_production_async
+from .settling import smart_settle
+from .storage import increase_storage_async
+from .training_engine import TrainingEngine, parse_ratio, resolve_ratio
+from .village import parse_resources
+
+logger = logging.getLogger(__name__)
+
+RESTART_POLICIES = ('never', 'on-failure', 'always')
+BACKOFF = 5             # First retry delay after a failure, doubled up to MAX_BACKOFF
+MAX_BACKOFF = 300
+STATUS_INTERVAL = 5     # Seconds between status file writes
+MAX_JOBS = 8            # Jobs running at once across all accounts, unless the file says otherwise
+
+PRESET_NAMES = {'army': PRESET_ARMY, 'farm': PRESET_FARM, 'quick_settle': PRESET_QUICK_SETTLE, 'full': PRESET_FULL}
+RESEARCH = {'academy': research_academy, 'smithy': upgrade_smithy, 'armory': upgrade_armory}
+
+
+def _number(text):
+    """Game numbers as shown in #res, e.g. '1,234,567' or '1.234.567'."""
+    digits = ''.join(ch for ch in str(text) if ch.isdigit())
+    return int(digits) if digits else 0
+
+
+class Account:
+    """One game login shared by its jobs."""
+
+    def __init__(self, spec, db, orchestrator):
+        self.username = spec['username']
+        password = spec.get('password')
+        if password is None and spec.get('password_env'):
+            password = os.environ.get(spec['password_env'])
+        if password is None:
+            raise ValueError(f"No password for account {self.username} (set 'password' or 'password_env')")
+        self.tribe = spec.get('tribe', 'roman')
+        self.session = orchestrator.add_account(self.username, password, self.tribe, db, spec.get('server', 9))
+        self.server_url = self.session.server_url
+        self.slots = asyncio.Semaphore(spec.get('max_jobs', MAX_JOBS))
+        self.village_lock = asyncio.Lock()
+        self.login_lock = asyncio.Lock()
+
+    async def client(self):
+        """The session's pooled client, logging in first if needed."""
+        async with self.login_lock:
+            if self.session.cookies is None and await self.session.login() is None:
+                raise RuntimeError(f"Login failed for {self.username}")
+            return await self.session.get_client()
+
+    async def switch_village(self, village_id):
+        client = await self.client()
+        await client.get(f"{self.server_url}/village1.php?newdid={village_id}")
+
+
+class Job:
+    """One entry of an account's job list, with its run state."""
+
+    def __init__(self, spec, account, index):
+        self.spec = spec
+        self.account = account
+        self.type = spec['type']
+        if self.type not in JOB_RUNNERS:
+            raise ValueError(f"Unknown job type: {self.type}")
+        self.name = spec.get('name') or f"{account.username}-{self.type}-{index}"
+        self.restart = spec.get('restart', 'never')
+        if self.restart not in RESTART_POLICIES:
+            raise ValueError(f"Unknown restart policy for {self.name}: {self.restart}")
+        self.max_restarts = spec.get('max_restarts')
+        self.backoff = spec.get('backoff', BACKOFF)
+        self.interval = spec.get('interval', 0)
+        self.concurrency = max(1, spec.get('concurrency', 1))
+
+        self.state = 'pending'
+        self.runs = 0
+        self.restarts = 0
+        self.last_error = None
+        self.last_message = None
+        self.started_at = None
+        self.finished_at = None
+        self.next_start = None
+
+    def log(self, message):
+        logger.info(f"[{self.name}] {message}")
+        self.last_message = str(message)
+
+    def status(self):
+        return {
+            'name': self.name, 'account': self.account.username, 'type': self.type, 'state': self.state,
+            'runs': self.runs, 'restarts': self.restarts, 'last_error': self.last_error,
+            'last_message': self.last_message, 'started_at': self.started_at,
+            'finished_at': self.finished_at, 'next_start': self.next_start,
+        }
+
+
+async def _shop_targets_reached(job):
+    """True once every stat in the job's 'target' (e.g. {'storage': 5e7}) is reached."""
+    target = job.spec.get('target')
+    if not target:
+        return False
+    client = await job.account.client()
+    response = await client.get(f"{job.account.server_url}/village1.php")
+    stats = await tracing.to_thread(parse_resources, response.text)
+    return all(_number(stats.get(key, 0)) >= value for key, value in target.items())
+
+
+async def _run_shop(job, db, increase):
+    """Shop loops, split across `concurrency` workers, repeated until the target is reached."""
+    if await _shop_targets_reached(job):
+        job.log("Target already reached")
+        return
+    loops = job.spec.get('loops', 100)
+    while True:
+        client = await job.account.client()
+        shares = [loops // job.concurrency + (i < loops % job.concurrency) for i in range(job.concurrency)]
+        # Stable run names, so a restarted daemon resumes unfinished batches from their checkpoints
+        await asyncio.gather(*(increase(job.account.username, job.account.session.password, share, db,
+                                        run_name=f"daemon-{job.name}-{i}", client=client, callback=job.log)
+                               for i, share in enumerate(shares) if share))
+        if not job.spec.get('target') or await _shop_targets_reached(job):
+            return
+
+
+async def run_storage(job, db):
+    await _run_shop(job, db, increase_storage_async)
+
+
+async def run_production(job, db):
+    await _run_shop(job, db, increase_production_async)
+
+
+async def run_preset(job, db):
+    name = str(job.spec['preset'])
+    preset = PRESET_NAMES.get(name) or PRESETS.get(name)
+    if preset is None:
+        raise ValueError(f"Unknown preset: {name}")
+    account = job.account
+    async with account.village_lock:
+        if job.spec.get('village'):
+            await account.switch_village(job.spec['village'])
+        client = await account.client()
+        await apply_preset(client.cookies, account.server_url, preset, callback=job.log, client=client)
+
+
+async def run_research(job, db):
+    account = job.account
+    async with account.village_lock:
+        if job.spec.get('village'):
+            await account.switch_village(job.spec['village'])
+        for what in job.spec.get('what', list(RESEARCH)):
+            job.log(f"Running {what}")
+            await RESEARCH[what](account.session, account.server_url, client=await account.client())
+
+
+async def run_training(job, db):
+    account = job.account
+    ratio = job.spec['ratio']
+    ratio = parse_ratio(ratio, account.tribe) if isinstance(ratio, str) else resolve_ratio(ratio, account.tribe)
+    engine = TrainingEngine(await account.client(), account.server_url, ratio, account.tribe,
+                            villages=job.spec.get('villages'), positions=job.spec.get('positions'),
+                            callback=job.log, village_lock=account.village_lock)
+    report = await engine.run(duration=job.spec.get('duration'), cycles=job.spec.get('cycles'))
+    for village_id, stats in report.items():
+        job.log(f"Village {village_id or 'active'}: {stats['troops']} troops queued")
+
+
+async def run_settling(job, db):
+    account = job.account
+    async with account.village_lock:
+        if job.spec.get('village'):
+            await account.switch_village(job.spec['village'])
+        client = await account.client()
+        if not await smart_settle(client.cookies, account.server_url, callback=job.log, client=client):
+            raise RuntimeError("Settling did not complete")
+
+
+JOB_RUNNERS = {
+    'storage': run_storage,
+    'production': run_production,
+    'preset': run_preset,
+    'research': run_research,
+    'training': run_training,
+    'settling': run_settling,
+}
+
+
+def load_jobs(path):
+    """Read a job file. Raises ValueError if it has no accounts."""
+    with open(path) as f:
+        config = json.load(f)
+    if not config.get('accounts'):
+        raise ValueError(f"{path} defines no accounts")
+    return config
+
+
+class Daemon:
+    """
+    Runs the jobs of a job file until they are all finished or stop() is called.
+
+    Args:
+        config: Parsed job file (load_jobs())
+        status_path: Where to write the status file
+        db_path: SQLite database path
+    """
+
+    def __init__(self, config, status_path=None, db_path=DB_PATH):
+        self.config = config
+        self.status_path = status_path or config.get('status_file', 'daemon_status.json')
+        self.db = AsyncDatabase(config.get('database', db_path))
+        self.orchestrator = Orchestrator(max_connections=config.get('max_connections', MAX_CONNECTIONS),
+                                         host_rates=config.get('host_rates'), rate=config.get('host_rate', HOST_RATE),
+                                         max_jobs=config.get('max_jobs', MAX_JOBS))
+        metrics.track_orchestrator(self.orchestrator)
+        self.accounts = []
+        self.jobs = []
+        self.started_at = None
+        self.changed = asyncio.Event()
+        self.main_task = None
+
+    def _build(self):
+        for spec in self.config['accounts']:
+            account = Account(spec, self.db, self.orchestrator)
+            self.accounts.append(account)
+            for index, job_spec in enumerate(spec.get('jobs', []), 1):
+                self.jobs.append(Job(job_spec, account, index))
+
+    def _set_state(self, job, state):
+        job.state = state
+        self.changed.set()
+
+    async def _run_once(self, job):
+        self._set_state(job, 'waiting')
+        async with job.account.slots, self.orchestrator.jobs.slot(job.account.username):
+            job.runs += 1
+            job.started_at = time.time()
+            job.next_start = None
+            self._set_state(job, 'running')
+            try:
+                with tracing.span(job.name, 'job', root=True, run=job.runs), profiling.label(job.name):
+                    await JOB_RUNNERS[job.type](job, self.db)
+            finally:
+                job.finished_at = time.time()
+
+    async def _supervise(self, job):
+        """Run one job under its restart policy."""
+        try:
+            await self._restart_loop(job)
+        except asyncio.CancelledError:
+            self._set_state(job, 'cancelled')
+            raise
+
+    async def _restart_loop(self, job):
+        delay = job.backoff
+        while True:
+            try:
+                await self._run_once(job)
+                succeeded = True
+                job.last_error = None
+            except Exception as e:
+                succeeded = False
+                job.last_error = f"{type(e).__name__}: {e}"
+                logger.exception(f"[{job.name}] failed")
+
+            if job.restart == 'never' or (job.restart == 'on-failure' and succeeded):
+                self._set_state(job, 'done' if succeeded else 'failed')
+                return
+            if job.max_restarts is not None and job.restarts >= job.max_restarts:
+                logger.warning(f"[{job.name}] reached {job.max_restarts} restarts; giving up")
+                self._set_state(job, 'done' if succeeded else 'failed')
+                return
+
+            if succeeded:
+                wait, delay = job.interval, job.backoff
+            else:
+                wait, delay = delay, min(delay * 2, MAX_BACKOFF)
+            job.restarts += 1
+            job.next_start = time.time() + wait
+            self._set_state(job, 'scheduled' if succeeded else 'backoff')
+            await asyncio.sleep(wait)
+
+    def status(self):
+        return {
+            'pid': os.getpid(),
+            'started_at': self.started_at,
+            'updated_at': time.time(),
+            'jobs': [job.status() for job in self.jobs],
+            'throughput': self.orchestrator.stats(),
+        }
+
+    def _write_status(self, status):
+        tmp_path = f"{self.status_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(status, f, indent=2)
+        os.replace(tmp_path, self.status_path)
+
+    async def _status_writer(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.changed.wait(), STATUS_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.changed.clear()
+            await asyncio.to_thread(self._write_status, self.status())
+
+    async def run(self):
+        """Run all jobs. Returns the final status."""
+        self.main_task = asyncio.current_task()
+        self.started_at = time.time()
+        await asyncio.to_thread(self.db.open)
+        writer = None
+        try:
+            self._build()
+            logger.info(f"Daemon started: {len(self.jobs)} jobs for {len(self.accounts)} accounts")
+            writer = asyncio.create_task(self._status_writer())
+            await asyncio.gather(*(self._supervise(job) for job in self.jobs), return_exceptions=True)
+        except asyncio.CancelledError:
+            logger.info("Daemon stopping")
+        finally:
+            if writer is not None:
+                writer.cancel()
+            await self.orchestrator.close()
+            await self.db.close()
+            status = self.status()
+            await asyncio.to_thread(self._write_status, status)
+        return status
+
+    def stop(self):
+        """Cancel all jobs; run() then cleans up and writes the final status."""
+        if self.main_task is not None:
+            self.main_task.cancel()
+
+
+async def _main(args):
+    daemon = Daemon(load_jobs(args.job_file), args.status)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, daemon.stop)
+        except NotImplementedError:  # Windows
+            pass
+    status = await daemon.run()
+    failed = [job['name'] for job in status['jobs'] if job['state'] == 'failed']
+    if failed:
+        logger.warning(f"Failed jobs: {', '.join(failed)}")
+    return 1 if failed else 0
+
+
+def run():
+    """Entry point for tbot-daemon."""
+    parser = argparse.ArgumentParser(description="Run the jobs of a job file without prompting.")
+    parser.add_argument('job_file', help="JSON job file")
+    parser.add_argument('--status', help="Status file path (overrides the job file's status_file)")
+    parser.add_argument('--profile', metavar='DIR', help="Profile every job and write the dumps to DIR")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    instrumentation.enable_from_env()
+    try:
+        coro = _main(args)
+        raise SystemExit(asyncio.run(profiling.run(coro, args.profile) if args.profile else coro))
+    finally:
+        instrumentation.disable()
+
+
+if __name__ == "__main__":
+    run()
@@ -1,9 +1,58 @@
+import logging
 import sqlite3
 
-def init_db():
-    conn = sqlite3.connect('data.db')
-    cursor = conn.cursor()
-
+logger = logging.getLogger(__name__)
+
+DB_PATH = 'data.db'
+
+# Building seed data including resource fields: (pid, bid, tgt, name)
+SEED_BUILDINGS = [
+    # Resource fields
+    (1, 1, 30, 'Woodcutter'),
+    (2, 2, 30, 'Woodcutter'),
+    (3, 3, 30, 'Woodcutter'),
+    (4, 4, 30, 'Woodcutter'),
+    (5, 5, 30, 'Clay Pit'),
+    (6, 6, 30, 'Clay Pit'),
+    (7, 7, 30, 'Clay Pit'),
+    (8, 8, 30, 'Clay Pit'),
+    (9, 9, 30, 'Iron Mine'),
+    (10, 10, 30, 'Iron Mine'),
+    (11, 11, 30, 'Iron Mine'),
+    (12, 12, 30, 'Iron Mine'),
+    (13, 13, 30, 'Cropland'),
+    (14, 14, 30, 'Cropland'),
+    (15, 15, 30, 'Cropland'),
+    (16, 16, 30, 'Cropland'),
+    (17, 17, 30, 'Cropland'),
+    (18, 18, 30, 'Cropland'),
+    # Existing buildings
+    (26, 15, 20, 'Main Building'),
+    (39, 16, 20, 'Rally Point'),
+    (40, 33, 20, 'City Wall'),
+    (25, 19, 20, 'Barracks'),
+    (33, 22, 20, 'Academy'),
+    (30, 25, 20, 'Residence'),
+    (29, 13, 20, 'Armory'),
+    (21, 12, 20, 'Smithy'),
+    (34, 7, 20, 'Iron Foundry'),
+    (31, 5, 20, 'Sawmill'),
+    (27, 6, 20, 'Brickworks'),
+    (24, 37, 20, "Hero's Mansion"),
+    (24, 44, 1, 'Christmas Tree'),
+    (22, 11, 20, 'Granary'),
+    (20, 17, 20, 'Marketplace'),
+    (19, 20, 20, 'Stable'),
+    (28, 21, 20, 'Siege Workshop'),
+    (32, 14, 20, 'Tournament Square'),
+    (35, 24, 20, 'Town Hall'),
+    (38, 18, 20, 'Embassy'),
+    (37, 27, 20, 'Treasure')
+]
+
+
+def _migrate_base_tables(cursor):
+    """Original schema. IF NOT EXISTS lets databases from before versioning adopt it."""
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS users (
         username TEXT PRIMARY KEY,
@@ -48,60 +97,152 @@ def init_db():
         name TEXT
     )''')
 
-    # Insert initial building data including resource fields
-    buildings = [
-        # Resource fields
-        (1, 1, 30, 'Woodcutter'),
-        (2, 2, 30, 'Woodcutter'),
-        (3, 3, 30, 'Woodcutter'),
-        (4, 4, 30, 'Woodcutter'),
-        (5, 5, 30, 'Clay Pit'),
-        (6, 6, 30, 'Clay Pit'),
-        (7, 7, 30, 'Clay Pit'),
-        (8, 8, 30, 'Clay Pit'),
-        (9, 9, 30, 'Iron Mine'),
-        (10, 10, 30, 'Iron Mine'),
-        (11, 11, 30, 'Iron Mine'),
-        (12, 12, 30, 'Iron Mine'),
-        (13, 13, 30, 'Cropland'),
-        (14, 14, 30, 'Cropland'),
-        (15, 15, 30, 'Cropland'),
-        (16, 16, 30, 'Cropland'),
-        (17, 17, 30, 'Cropland'),
-        (18, 18, 30, 'Cropland'),
-        # Existing buildings
-        (26, 15, 20, 'Main Building'),
-        (39, 16, 20, 'Rally Point'),
-        (40, 33, 20, 'City Wall'),
-        (25, 19, 20, 'Barracks'),
-        (33, 22, 20, 'Academy'),
-        (30, 25, 20, 'Residence'),
-        (29, 13, 20, 'Armory'),
-        (21, 12, 20, 'Smithy'),
-        (34, 7, 20, 'Iron Foundry'),
-        (31, 5, 20, 'Sawmill'),
-        (27, 6, 20, 'Brickworks'),
-        (24, 37, 20, "Hero's Mansion"),
-        (24, 44, 1, 'Christmas Tree'),
-        (22, 11, 20, 'Granary'),
-        (20, 17, 20, 'Marketplace'),
-        (19, 20, 20, 'Stable'),
-        (28, 21, 20, 'Siege Workshop'),
-        (32, 14, 20, 'Tournament Square'),
-        (35, 24, 20, 'Town Hall'),
-        (38, 18, 20, 'Embassy'),
-        (37, 27, 20, 'Treasure')
-    ]
-
-    cursor.executemany('INSERT INTO buildings (pid, bid, tgt, name) VALUES (?, ?, ?, ?)', buildings)
-
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS empty_spots (
             id INTEGER PRIMARY KEY,
             settled INTEGER
         )''')
 
-    conn.commit()
+
+def _migrate_world_tables(cursor):
+    """World crawler state, history snapshots and the coordinate index."""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_villages_coords ON villages (x_coord, y_coord)')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS players (
+        player_id INTEGER PRIMARY KEY,
+        player_name TEXT,
+        population INTEGER,
+        village_count INTEGER,
+        profile_hash TEXT,
+        fetched_at INTEGER
+    )''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS snapshots (
+        snapshot_id INTEGER PRIMARY KEY,
+        taken_at INTEGER,
+        village_count INTEGER
+    )''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS village_snapshots (
+        snapshot_id INTEGER PRIMARY KEY,
+        base_id INTEGER,
+        village_ids BLOB,
+        populations BLOB,
+        owner_ids BLOB,
+        FOREIGN KEY (snapshot_id) REFERENCES snapshots(snapshot_id)
+    )''')
+
+
+def _migrate_unique_buildings(cursor):
+    """De-duplicate the buildings seed, make it unique and index per-user lookups."""
+    # Older versions re-inserted the seed on every start
+    cursor.execute("DELETE FROM buildings WHERE rowid NOT IN (SELECT MIN(rowid) FROM buildings GROUP BY pid, bid)")
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_buildings_pid_bid ON buildings (pid, bid)')
+    cursor.executemany('INSERT OR IGNORE INTO buildings (pid, bid, tgt, name) VALUES (?, ?, ?, ?)', SEED_BUILDINGS)
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_username ON tasks (username, task_type)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_stats_username ON stats (username, task_type)')
+
+
+def _migrate_request_telemetry(cursor):
+    """Per-request telemetry: raw log plus hourly rollups of downsampled rows."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS request_log (
+        ts REAL,
+        task_id TEXT,
+        endpoint TEXT,
+        status INTEGER,
+        latency_ms REAL,
+        bytes INTEGER
+    )''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_request_log_ts ON request_log (ts)')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS request_rollup (
+        hour INTEGER,
+        endpoint TEXT,
+        requests INTEGER,
+        successes INTEGER,
+        bytes INTEGER,
+        latency_histogram BLOB,
+        PRIMARY KEY (hour, endpoint)
+    )''')
+
+
+def _migrate_runs(cursor):
+    """Checkpointed progress of long task runs, so they can be resumed by name."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS runs (
+        run_name TEXT PRIMARY KEY,
+        username TEXT,
+        task_type TEXT,
+        requested INTEGER,
+        attempted INTEGER,
+        completed INTEGER,
+        status TEXT,
+        started_at INTEGER,
+        updated_at INTEGER
+    )''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_runs_username ON runs (username, status)')
+
+
+# Ordered schema migrations: (version, description, function taking a cursor).
+# Append new migrations at the end; never edit one that has shipped.
+MIGRATIONS = [
+    (1, "base tables", _migrate_base_tables),
+    (2, "world crawler tables", _migrate_world_tables),
+    (3, "unique buildings seed and username indexes", _migrate_unique_buildings),
+    (4, "request telemetry tables", _migrate_request_telemetry),
+    (5, "checkpointed runs", _migrate_runs),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn):
+    """Return the schema version stored in the database file."""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """
+    Bring the database up to SCHEMA_VERSION.
+
+    Each migration runs in its own write transaction together with the version
+    bump, so a failed migration leaves the previous version intact. The version
+    is re-read under the write lock, so concurrent starts migrate only once.
+    """
+    for version, description, migration in MIGRATIONS:
+        if version <= get_schema_version(conn):
+            continue
+
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            if version <= get_schema_version(conn):
+                conn.rollback()
+                continue
+            migration(cursor)
+            cursor.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info(f"Database migrated to version {version}: {description}")
+
+
+def init_db(path=DB_PATH):
+    """
+    Open the database and apply pending migrations.
+
+    When the schema is already current no DDL is executed at all.
+    """
+    conn = sqlite3.connect(path)
+    if get_schema_version(conn) < SCHEMA_VERSION:
+        migrate(conn)
     return conn
 
 def save_user(conn, username, password):
@@ -134,6 +275,42 @@ def save_stats(conn, username, task_type, requested, completed):
     conn.commit()
 
 
+def save_run(conn, run_name, username, task_type, requested, attempted, completed, status, started_at, updated_at):
+    """
+    Insert or update the checkpoint of a task run.
+    """
+    cursor = conn.cursor()
+    cursor.execute("INSERT OR REPLACE INTO runs (run_name, username, task_type, requested, attempted, completed, status, started_at, updated_at) "
+                   "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                   (run_name, username, task_type, requested, attempted, completed, status, started_at, updated_at))
+    conn.commit()
+
+
+def get_run(conn, run_name):
+    """
+    Retrieve one run's checkpoint, or None.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT run_name, username, task_type, requested, attempted, completed, status, started_at, updated_at "
+                   "FROM runs WHERE run_name=?", (run_name,))
+    return cursor.fetchone()
+
+
+def get_runs(conn, username, status=None):
+    """
+    Retrieve a user's runs, newest first, optionally filtered by status.
+    """
+    cursor = conn.cursor()
+    query = ("SELECT run_name, username, task_type, requested, attempted, completed, status, started_at, updated_at "
+             "FROM runs WHERE username=?")
+    params = [username]
+    if status is not None:
+        query += " AND status=?"
+        params.append(status)
+    cursor.execute(query + " ORDER BY updated_at DESC", params)
+    return cursor.fetchall()
+
+
 def save_village(conn, username, village_id, village_name, x_coord, y_coord):
     """
     Save a village's information to the database.
@@ -144,6 +321,56 @@ def save_village(conn, username, village_id, village_name, x_coord, y_coord):
     conn.commit()
 
 
+def save_villages(conn, villages):
+    """
+    Save many villages in a single transaction.
+
+    Args:
+        villages: Iterable of (username, village_id, village_name, x_coord, y_coord) tuples
+    """
+    cursor = conn.cursor()
+    cursor.executemany("INSERT OR REPLACE INTO villages (username, village_id, village_name, x_coord, y_coord) VALUES (?, ?, ?, ?, ?)",
+                       villages)
+    conn.commit()
+
+
+def replace_player_villages(conn, usernames, villages):
+    """
+    Replace all stored villages of the given players in a single transaction.
+
+    Args:
+        usernames: Player names whose existing village rows are dropped first
+        villages: Iterable of (username, village_id, village_name, x_coord, y_coord) tuples
+    """
+    cursor = conn.cursor()
+    cursor.executemany("DELETE FROM villages WHERE username=?", [(username,) for username in usernames])
+    cursor.executemany("INSERT OR REPLACE INTO villages (username, village_id, village_name, x_coord, y_coord) VALUES (?, ?, ?, ?, ?)",
+                       villages)
+    conn.commit()
+
+
+def save_players(conn, players):
+    """
+    Save crawl state for many players in a single transaction.
+
+    Args:
+        players: Iterable of (player_id, player_name, population, village_count, profile_hash, fetched_at) tuples
+    """
+    cursor = conn.cursor()
+    cursor.executemany("INSERT OR REPLACE INTO players (player_id, player_name, population, village_count, profile_hash, fetched_at) VALUES (?, ?, ?, ?, ?, ?)",
+                       players)
+    conn.commit()
+
+
+def get_players(conn):
+    """
+    Retrieve crawl state for all players, keyed by player ID.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT player_id, player_name, population, village_count, profile_hash, fetched_at FROM players")
+    return {row[0]: row for row in cursor.fetchall()}
+
+
 def get_user(conn, username):
     """
     Retrieve a user's information from the database.
@@ -0,0 +1,230 @@
+# db_writer.py
+"""
+Write-behind database writer.
+
+Hot paths submit typed records instead of calling the save_* helpers, which
+commit on every row. A background thread owns its own connection, drains the
+queue, and writes records in executemany transactions, committing when a
+batch is full or when the oldest pending record is older than the flush
+interval. The database runs in WAL mode so readers never wait on the writer.
+
+Records are written in submission order; consecutive records of the same type
+share one executemany call.
+"""
+
+import asyncio
+import atexit
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from . import tracing
+from .database import DB_PATH, init_db
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500        # Records per transaction
+FLUSH_INTERVAL = 0.5    # Seconds a record may wait before it is committed
+
+UserRecord = namedtuple('UserRecord', 'username password')
+TaskRecord = namedtuple('TaskRecord', 'username task_type loops')
+StatsRecord = namedtuple('StatsRecord', 'username task_type requested completed')
+VillageRecord = namedtuple('VillageRecord', 'username village_id village_name x_coord y_coord')
+DeleteVillagesRecord = namedtuple('DeleteVillagesRecord', 'username')
+PlayerRecord = namedtuple('PlayerRecord', 'player_id player_name population village_count profile_hash fetched_at')
+EmptySpotRecord = namedtuple('EmptySpotRecord', 'village_id settled')
+RequestRecord = namedtuple('RequestRecord', 'ts task_id endpoint status latency_ms bytes')
+
+RECORD_SQL = {
+    UserRecord: "INSERT OR IGNORE INTO users (username, password) VALUES (?, ?)",
+    TaskRecord: "INSERT INTO tasks (username, task_type, loops) VALUES (?, ?, ?)",
+    StatsRecord: "INSERT INTO stats (username, task_type, requested, completed) VALUES (?, ?, ?, ?)",
+    VillageRecord: "INSERT OR REPLACE INTO villages (username, village_id, village_name, x_coord, y_coord) VALUES (?, ?, ?, ?, ?)",
+    DeleteVillagesRecord: "DELETE FROM villages WHERE username=?",
+    PlayerRecord: "INSERT OR REPLACE INTO players (player_id, player_name, population, village_count, profile_hash, fetched_at) VALUES (?, ?, ?, ?, ?, ?)",
+    EmptySpotRecord: "INSERT OR REPLACE INTO empty_spots (id, settled) VALUES (?, ?)",
+    RequestRecord: "INSERT INTO request_log (ts, task_id, endpoint, status, latency_ms, bytes) VALUES (?, ?, ?, ?, ?, ?)",
+}
+
+_STOP = object()
+
+
+class DatabaseWriter:
+    """
+    Background writer thread fed by a queue of records.
+
+    Usage:
+        writer = DatabaseWriter().start()
+        writer.submit(VillageRecord(...))
+        await writer.aflush()   # or writer.flush() from sync code
+        writer.close()
+    """
+
+    def __init__(self, path=DB_PATH, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.thread = None
+        self.max_queue_depth = 0
+        self.commits = 0
+        self.rows_written = 0
+        self.errors = 0
+        self.commit_seconds = 0.0
+        self.last_commit_seconds = 0.0
+        self.max_commit_seconds = 0.0
+        self.maintenance = []
+
+    def add_maintenance(self, fn, interval):
+        """Run fn(conn) on the writer thread every `interval` seconds (e.g. rollups, pruning)."""
+        self.maintenance.append([fn, interval, time.monotonic() + interval])
+        self.queue.put(None)  # Wake the writer so it picks up the new schedule
+
+    def start(self):
+        """Start the writer thread; returns self for chaining."""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+            self.thread.start()
+            atexit.register(self.close)
+        return self
+
+    def submit(self, record):
+        """Queue a record for writing. Never blocks."""
+        if type(record) not in RECORD_SQL:
+            raise TypeError(f"Unsupported record type: {type(record).__name__}")
+        self.queue.put(record)
+        depth = self.queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    def submit_many(self, records):
+        """Queue several records."""
+        for record in records:
+            self.submit(record)
+
+    def flush(self, timeout=None):
+        """Block until everything submitted so far is committed."""
+        if self.thread is None or not self.thread.is_alive():
+            return True
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+
+    async def aflush(self, timeout=None):
+        """Like flush(), without blocking the event loop."""
+        return await asyncio.to_thread(self.flush, timeout)
+
+    def close(self, timeout=None):
+        """Flush pending records and stop the writer thread."""
+        if self.thread is None:
+            return
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+        self.thread = None
+        atexit.unregister(self.close)
+
+    def metrics(self):
+        """Queue depth and commit latency figures."""
+        return {
+            'queue_depth': self.queue.qsize(),
+            'max_queue_depth': self.max_queue_depth,
+            'commits': self.commits,
+            'rows_written': self.rows_written,
+            'errors': self.errors,
+            'last_commit_ms': self.last_commit_seconds * 1000,
+            'max_commit_ms': self.max_commit_seconds * 1000,
+            'avg_commit_ms': self.commit_seconds / self.commits * 1000 if self.commits else 0.0,
+        }
+
+    def _connect(self):
+        conn = init_db(self.path)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _write(self, conn, batch):
+        """Write a batch in one transaction, grouping runs of the same record type."""
+        start = time.perf_counter()
+        span = tracing.start('commit', 'db', rows=len(batch))
+        cursor = conn.cursor()
+        try:
+            run_type, run = None, []
+            for record in batch:
+                if type(record) is not run_type and run:
+                    cursor.executemany(RECORD_SQL[run_type], run)
+                    run = []
+                run_type = type(record)
+                run.append(record)
+            if run:
+                cursor.executemany(RECORD_SQL[run_type], run)
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            self.errors += 1
+            logger.error(f"Database writer dropped a batch of {len(batch)} records: {e}")
+            span.end(error=type(e).__name__)
+            return
+
+        elapsed = time.perf_counter() - start
+        span.end()
+        self.commits += 1
+        self.rows_written += len(batch)
+        self.commit_seconds += elapsed
+        self.last_commit_seconds = elapsed
+        self.max_commit_seconds = max(self.max_commit_seconds, elapsed)
+
+    def _run_maintenance(self, conn):
+        """Run the maintenance jobs that are due."""
+        now = time.monotonic()
+        for job in self.maintenance:
+            fn, interval, due = job
+            if now >= due:
+                try:
+                    fn(conn)
+                except sqlite3.Error as e:
+                    conn.rollback()
+                    self.errors += 1
+                    logger.error(f"Database maintenance job {getattr(fn, '__name__', fn)} failed: {e}")
+                job[2] = time.monotonic() + interval
+
+    def _run(self):
+        conn = self._connect()
+        batch = []
+        waiters = []
+        deadline = None
+        stopping = False
+
+        while not stopping:
+            maintenance_due = min((job[2] for job in self.maintenance), default=None)
+            wake = min((t for t in (deadline, maintenance_due) if t is not None), default=None)
+            timeout = None if wake is None else max(0.0, wake - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                stopping = True
+            elif isinstance(item, threading.Event):
+                waiters.append(item)
+            elif item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            due = deadline is not None and time.monotonic() >= deadline
+            if batch and (len(batch) >= self.batch_size or due or waiters or stopping):
+                self._write(conn, batch)
+                batch = []
+                deadline = None
+            if waiters and not batch:
+                for waiter in waiters:
+                    waiter.set()
+                waiters = []
+            if maintenance_due is not None and time.monotonic() >= maintenance_due:
+                self._run_maintenance(conn)
+
+        conn.close()
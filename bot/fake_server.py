@@ -0,0 +1,491 @@
+# fake_server.py
+"""
+A stand-in for the game server, for load tests that never touch the real one.
+
+FakeServer is a plain ASGI application that imitates the pages the bot
+uses, closely enough for the bot's own parsers:
+- login on / and the server picker on /game/servers (session cookie shared
+  with the game subdomains);
+- buy2.php shops with single-use keys, answering 302 when a purchase goes
+  through and 200 without a success message when the key was bad;
+- build.php, village1.php and village2.php with resource fields, buildings,
+  construction of new buildings and a build queue;
+- village3.php map tiles, profile.php, statistics.php and v2v.php.
+
+Each account gets its own village, shop totals and build queue. The world
+(players and their villages) is generated from a seed.
+
+Load knobs: a fixed latency with jitter, a share of requests answered with
+503, and a per-host rate limit (token bucket) that also answers 503, as the
+real server does when it is overloaded.
+
+    server = FakeServer(latency=0.05, jitter=0.5, error_rate=0.01, rate_limit=200)
+    with replay.installed(httpx.ASGITransport(app=server)):
+        cookies = await SessionManager('user', 'pass', 'roman', db).login()
+        await increase_storage_async('user', 'pass', 1000, db, cookies=cookies)
+    print(server.stats())
+
+The bot's clients keep their https://fun.gotravspeed.com URLs; the
+transport routes them to the fake server. Any ASGI server can also serve
+it over TCP (`uvicorn --factory bot.fake_server:create_app`).
+
+`python -m bot.fake_server` measures how many requests per second the
+fake server answers in-process.
+"""
+
+import asyncio
+import email.utils
+import logging
+import random
+import secrets
+import time
+from collections import Counter
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qsl
+
+from .presets import BUILDING_IDS
+
+logger = logging.getLogger(__name__)
+
+COOKIE_NAME = 'sid'
+MAX_KEYS = 64            # Shop and send keys kept per account; older ones stop working
+STORAGE_STEP = 10000     # Capacity added by one storage purchase
+PRODUCTION_STEP = 1000   # Hourly production added by one production purchase
+STATISTICS_PAGE_SIZE = 20
+FIELD_MAX_LEVEL = 30
+BUILDING_MAX_LEVEL = 20
+TROOPS_AT_HOME = 10000   # Per unit type; sending troops never uses them up
+
+# Resource field types of positions 1-18 (the usual 4-4-4-6 village)
+FIELD_TYPES = ('Woodcutter', 'Cropland', 'Woodcutter', 'Iron Mine', 'Clay Pit', 'Clay Pit', 'Iron Mine',
+               'Cropland', 'Cropland', 'Iron Mine', 'Iron Mine', 'Cropland', 'Cropland', 'Woodcutter',
+               'Cropland', 'Clay Pit', 'Woodcutter', 'Clay Pit')
+BUILDING_NAMES = {bid: name.replace('_', ' ').title() for name, bid in reversed(BUILDING_IDS.items())}
+UNIT_NAMES = ('Legionnaire', 'Praetorian', 'Imperian', 'Equites Legati', 'Equites Imperatoris',
+              'Equites Caesaris', 'Battering Ram', 'Fire Catapult', 'Senator', 'Settler')
+
+
+def village_id(x, y):
+    """Map tile id of coordinates (the map is 401x401, -200..200)."""
+    return (200 + y) * 401 + (200 + x) + 1
+
+
+def coordinates(tile_id):
+    """(x, y) of a map tile id."""
+    return (tile_id - 1) % 401 - 200, (tile_id - 1) // 401 - 200
+
+
+def _page(title, body):
+    return f'<html><head><title>{title}</title></head><body><div id="content">{body}</div></body></html>'
+
+
+class _Request:
+    """The parts of an ASGI request the pages need."""
+
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.query = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+        self.form = dict(parse_qsl(body.decode('utf-8', errors='replace')))
+        self.host = ''
+        cookies = SimpleCookie()
+        for name, value in scope.get('headers', []):
+            if name == b'host':
+                self.host = value.decode('latin-1').split(':')[0]
+            elif name == b'cookie':
+                cookies.load(value.decode('latin-1'))
+        self.cookie = cookies[COOKIE_NAME].value if COOKIE_NAME in cookies else None
+        self.account = None
+
+
+class _Account:
+    """Game state of one logged-in account."""
+
+    def __init__(self, username, player_id, now):
+        self.username = username
+        self.player_id = player_id
+        self.csrf = secrets.token_hex(4)
+        self.keys = {}                     # Unused shop and send keys (insertion ordered)
+        self.storage = 800
+        self.production = 100              # Per resource per hour
+        self.produced_since = now
+        self.stock = 0
+        self.fields = {position: [None, 0] for position in range(1, 19)}
+        self.fields.update({position: [None, 0] for position in range(19, 41)})
+        self.fields[26] = [15, 1]          # Main building
+        self.queue = []                    # (finishes_at, position, building id)
+
+    def new_key(self):
+        key = secrets.token_hex(8)
+        self.keys[key] = True
+        if len(self.keys) > MAX_KEYS:
+            del self.keys[next(iter(self.keys))]
+        return key
+
+    def use_key(self, key):
+        return self.keys.pop(key, None) is not None
+
+    def resources(self, now):
+        self.stock = min(self.storage, self.stock + self.production * (now - self.produced_since) / 3600)
+        self.produced_since = now
+        return int(self.stock)
+
+    def advance(self, now):
+        """Finish the queued builds that are done by now."""
+        while self.queue and self.queue[0][0] <= now:
+            _, position, bid = self.queue.pop(0)
+            field = self.fields[position]
+            field[0] = field[0] or bid
+            field[1] += 1
+
+
+class FakeServer:
+    """
+    ASGI application imitating the game server.
+
+    Args:
+        latency: Seconds before every response
+        jitter: Random +/- fraction applied to the latency
+        error_rate: Share of requests answered with 503
+        rate_limit: Requests per second per host before answering 503 (None: unlimited)
+        burst: Requests a host may make at once after being idle (default: rate_limit)
+        players: Players in the generated world
+        villages_per_player: Villages of each generated player
+        build_seconds: Time a queued build takes (0 finishes it at once)
+        build_slots: Builds an account may have queued at the same time
+        username, password: The only credentials accepted (default: any)
+        require_login: Redirect requests without a session cookie to the login page
+        seed: Seed for the world, the jitter and the injected errors
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=None, burst=None, players=200,
+                 villages_per_player=3, build_seconds=0.0, build_slots=2, username=None, password=None,
+                 require_login=True, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.burst = burst or max(1, rate_limit or 0)
+        self.build_seconds = build_seconds
+        self.build_slots = build_slots
+        self.username = username
+        self.password = password
+        self.require_login = require_login
+        self.random = random.Random(seed)
+        self.buckets = {}                  # host -> (tokens, last refill)
+        self.sessions = {}                 # session cookie -> _Account
+        self.accounts = {}                 # username -> _Account
+        self.requests = Counter()          # (method, path, status) -> count
+        self.started = time.monotonic()
+        self.players, self.villages = self._world(players, villages_per_player, random.Random(seed))
+        self.routes = {
+            '/': self.login,
+            '/game/servers': self.servers,
+            '/buy2.php': self.shop,
+            '/build.php': self.build,
+            '/village1.php': self.village,
+            '/village2.php': self.village,
+            '/village3.php': self.tile,
+            '/profile.php': self.profile,
+            '/statistics.php': self.statistics,
+            '/v2v.php': self.send_troops,
+        }
+
+    @staticmethod
+    def _world(players, villages_per_player, rng):
+        """Ranking [(player id, name, population, villages)] and villages {tile id: (player id, name, population)}."""
+        villages = {}
+        ranking = []
+        for player_id in range(1, players + 1):
+            total = 0
+            for i in range(villages_per_player):
+                tile = village_id(rng.randint(-200, 200), rng.randint(-200, 200))
+                while tile in villages:
+                    tile = village_id(rng.randint(-200, 200), rng.randint(-200, 200))
+                population = rng.randint(50, 1500)
+                villages[tile] = (player_id, f"Village {player_id}-{i + 1}", population)
+                total += population
+            ranking.append((player_id, f"player{player_id}", total, villages_per_player))
+        ranking.sort(key=lambda player: -player[2])
+        return ranking, villages
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] != 'http':
+            return
+
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        request = _Request(scope, body)
+        status, headers, content = await self.respond(request)
+        self.requests[(request.method, request.path, status)] += 1
+        content = content.encode('utf-8')
+        headers = [(b'content-type', b'text/html; charset=utf-8'), (b'content-length', str(len(content)).encode()),
+                   (b'date', email.utils.formatdate(usegmt=True).encode())] + \
+                  [(name.encode(), value.encode()) for name, value in headers]
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': content})
+
+    async def respond(self, request):
+        """(status, headers, html) for a request, after the latency and any injected failure."""
+        if self.latency:
+            await asyncio.sleep(self.latency * (1 + self.random.uniform(-self.jitter, self.jitter)))
+        if not self._take_token(request.host) or self.random.random() < self.error_rate:
+            return 503, [], _page('Error', '<h1>503 Service Unavailable</h1>')
+
+        handler = self.routes.get(request.path)
+        if handler is None:
+            return 404, [], _page('Not found', '<h1>404 Not Found</h1>')
+        if handler not in (self.login, self.servers):
+            request.account = self.sessions.get(request.cookie)
+            if request.account is None:
+                if self.require_login:
+                    return 302, [('location', 'https://gotravspeed.com/')], ''
+                request.account = self._account('guest')
+            request.account.advance(time.monotonic())
+        return handler(request)
+
+    def _take_token(self, host):
+        if self.rate_limit is None:
+            return True
+        now = time.monotonic()
+        tokens, last = self.buckets.get(host, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate_limit)
+        if tokens < 1:
+            self.buckets[host] = (tokens, now)
+            return False
+        self.buckets[host] = (tokens - 1, now)
+        return True
+
+    def _account(self, username):
+        account = self.accounts.get(username)
+        if account is None:
+            account = self.accounts[username] = _Account(username, self.players[0][0], time.monotonic())
+        return account
+
+    def stats(self):
+        """Requests answered per path and status, and the overall rate."""
+        elapsed = time.monotonic() - self.started
+        total = sum(self.requests.values())
+        by_status = Counter()
+        for (_, _, status), count in self.requests.items():
+            by_status[status] += count
+        return {'requests': total, 'per_second': total / elapsed if elapsed else 0.0,
+                'statuses': dict(by_status), 'paths': dict(self.requests)}
+
+    # Pages
+
+    def login(self, request):
+        if request.method != 'POST':
+            return 200, [], _page('Login', '<form method="post"><input name="name"><input name="password" type="password"></form>')
+        username = request.form.get('name', '')
+        if not username or (self.username is not None and
+                            (username, request.form.get('password')) != (self.username, self.password)):
+            return 200, [], _page('Login', '<p class="error">Login failed</p>')
+        sid = secrets.token_hex(16)
+        self.sessions[sid] = self._account(username)
+        cookie = f"{COOKIE_NAME}={sid}; Path=/"
+        labels = request.host.split('.')
+        if len(labels) > 1 and not labels[-1].isdigit():
+            cookie += f"; Domain={'.'.join(labels[-2:])}"
+        return 200, [('set-cookie', cookie)], _page('Welcome', f'<h1>Welcome {username}</h1>')
+
+    def servers(self, request):
+        if self.sessions.get(request.cookie) is None:
+            return 302, [('location', 'https://gotravspeed.com/')], ''
+        return 200, [], _page('Servers', '<ul id="servers"><li data-id="9">Fun</li></ul>')
+
+    def shop(self, request):
+        account = request.account
+        kind = request.query.get('t', '2')
+        if request.method == 'POST' and request.query.get('Shop') == 'done':
+            if not account.use_key(request.form.get('key', '')):
+                return 200, [], _page('Shop', '<p class="error">Invalid key</p>')
+            if kind == '0':
+                account.resources(time.monotonic())
+                account.production += PRODUCTION_STEP
+            else:
+                account.storage += STORAGE_STEP
+            return 302, [('location', f"buy2.php?t={kind}")], ''
+        key = account.new_key()
+        return 200, [], _page('Shop', f'<form method="post" action="buy2.php?t={kind}&amp;Shop=done">'
+                                      f'<input type="hidden" name="key" value="{key}">'
+                                      f'<input type="image" name="s1" src="img/buy.gif"></form>')
+
+    def _upgrade_link(self, account, position):
+        bid, level = account.fields[position]
+        queued = sum(1 for entry in account.queue if entry[1] == position)
+        max_level = FIELD_MAX_LEVEL if position <= 18 else BUILDING_MAX_LEVEL
+        if len(account.queue) >= self.build_slots or level + queued >= max_level:
+            return '<span class="none">The workers are already at work.</span>'
+        page = 'village1.php' if position <= 18 else 'village2.php'
+        return f'<a class="build" href="{page}?id={position}&amp;k={account.csrf}">Upgrade to level {level + queued + 1}</a>'
+
+    def build(self, request):
+        account = request.account
+        try:
+            position = int(request.query.get('id', ''))
+        except ValueError:
+            position = 0
+        if position not in account.fields:
+            return 200, [], _page('Build', '<h1>Error</h1>')
+
+        bid, level = account.fields[position]
+        if position <= 18:
+            name = FIELD_TYPES[position - 1]
+        elif bid is None:
+            links = ''.join(f'<div class="contract"><h2>{name}</h2><a class="build" '
+                            f'href="village2.php?id={position}&amp;b={building}&amp;k={account.csrf}">Construct building</a></div>'
+                            for building, name in BUILDING_NAMES.items())
+            return 200, [], _page('Build', f'<h1>Construction of a new building</h1>{links}')
+        else:
+            name = BUILDING_NAMES.get(bid, f"Building {bid}")
+        return 200, [], _page('Build', f'<h1>{name} level {level}</h1>{self._upgrade_link(account, position)}')
+
+    def _queue_build(self, account, request):
+        """Queue the upgrade or construction a village1/village2 link asked for, if it is valid."""
+        try:
+            position = int(request.query['id'])
+        except (KeyError, ValueError):
+            return
+        if request.query.get('k') != account.csrf or position not in account.fields:
+            return
+        if len(account.queue) >= self.build_slots:
+            return
+        bid = account.fields[position][0]
+        if position > 18 and bid is None:
+            try:
+                bid = int(request.query['b'])
+            except (KeyError, ValueError):
+                return
+            if bid not in BUILDING_NAMES or any(entry[1] == position for entry in account.queue):
+                return
+        now = time.monotonic()
+        finishes_at = max([now] + [entry[0] for entry in account.queue]) + self.build_seconds
+        account.queue.append((finishes_at, position, bid))
+        account.advance(now)
+
+    def village(self, request):
+        account = request.account
+        if 'k' in request.query:
+            self._queue_build(account, request)
+        now = time.monotonic()
+        stock = account.resources(now)
+        res = (f'<div id="res"><div class="ware">{account.storage}</div><div class="gran">{account.storage}</div>'
+               + ''.join(f'<div class="{css}">{stock}/{account.storage}</div>' for css in ('wood', 'clay', 'iron', 'crop'))
+               + '</div>')
+        queue = ''.join(f'<tr><td>Position {position}</td><td><span id="timer{i}">{max(0, int(at - now))}</span></td></tr>'
+                        for i, (at, position, _) in enumerate(account.queue, 1))
+        return 200, [], _page('Village', f'{res}<table id="building_contract"><tbody>{queue}</tbody></table>')
+
+    def tile(self, request):
+        try:
+            tile = int(request.query.get('id', ''))
+        except ValueError:
+            return 200, [], _page('Map', '<h1>Error</h1>')
+        x, y = coordinates(tile)
+        village = self.villages.get(tile)
+        if village is not None:
+            player_id, name, population = village
+            body = (f'<h1>{name} ({x}|{y})</h1><table id="village_info"><tr><td>Player:</td>'
+                    f'<td><a href="profile.php?uid={player_id}">player{player_id}</a></td></tr>'
+                    f'<tr><td>Population:</td><td>{population}</td></tr></table>')
+        elif (tile * 2654435761) % 100 < 30:
+            body = f'<h1>Abandoned valley ({x}|{y})</h1><a href="a2b.php?id={tile}&amp;s=1">»building a new village</a>'
+        else:
+            body = f'<h1>Unoccupied oasis ({x}|{y})</h1>'
+        return 200, [], _page('Map', body)
+
+    def profile(self, request):
+        try:
+            player_id = int(request.query.get('uid', request.account.player_id))
+        except ValueError:
+            player_id = 0
+        rows = ''.join(f'<tr><td class="nam"><a href="karte.php?d={tile}">{name}</a></td><td class="hab">{population}</td>'
+                       f'<td class="tribe">Roman</td><td class="oases"></td>'
+                       f'<td class="aligned_coords">({x}|{y})</td></tr>'
+                       for tile, (owner, name, population) in sorted(self.villages.items()) if owner == player_id
+                       for x, y in (coordinates(tile),))
+        return 200, [], _page('Profile', f'<table id="villages"><thead><tr><th>Name</th></tr></thead>'
+                                         f'<tbody>{rows}</tbody></table>')
+
+    def statistics(self, request):
+        try:
+            page = max(1, int(request.query.get('page', 1)))
+        except ValueError:
+            page = 1
+        start = (page - 1) * STATISTICS_PAGE_SIZE
+        rows = ''.join(f'<tr><td class="ra">{start + i + 1}.</td>'
+                       f'<td class="pla"><a href="spieler.php?uid={player_id}">{name}</a></td>'
+                       f'<td class="pop">{population}</td><td class="vil">{villages}</td></tr>'
+                       for i, (player_id, name, population, villages) in enumerate(self.players[start:start + STATISTICS_PAGE_SIZE]))
+        return 200, [], _page('Statistics', f'<table id="player"><tbody>{rows}</tbody></table>')
+
+    def send_troops(self, request):
+        account = request.account
+        if request.method == 'POST':
+            if not account.use_key(request.form.get('key', '')):
+                return 200, [], _page('Send troops', '<p class="error">Invalid key</p>')
+            return 302, [('location', 'build.php?id=39')], ''
+        target = request.query.get('id', '')
+        units = ''.join(f'<tr><td><img class="unit u{i}" alt="{name}"></td><td><input name="t[{i}]" value=""></td>'
+                        f'<td><a href="#" onclick="document.snd.t{i}.value={TROOPS_AT_HOME}; return false;">'
+                        f'({TROOPS_AT_HOME})</a></td></tr>'
+                        for i, name in enumerate(UNIT_NAMES, 1))
+        return 200, [], _page('Send troops', f'<h1>Send troops</h1><form name="snd" method="post" action="v2v.php">'
+                                             f'<input type="hidden" name="id" value="{target}">'
+                                             f'<input type="hidden" name="key" value="{account.new_key()}">'
+                                             f'<table>{units}</table></form>')
+
+
+def create_app():
+    """A FakeServer with default settings, for ASGI servers that take an app factory."""
+    return FakeServer()
+
+
+async def _bench(requests, concurrency, **options):
+    import httpx
+
+    server = FakeServer(require_login=False, **options)
+    paths = ['/village1.php', '/build.php?id=26', '/statistics.php?page=1', '/profile.php?uid=1', '/buy2.php?t=2']
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(paths[i % len(paths)])
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server), base_url='https://fun.gotravspeed.com') as client:
+        async def worker():
+            while not queue.empty():
+                await client.get(queue.get_nowait())
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return elapsed, server.stats()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Requests per second the fake game server answers in-process.")
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=float, default=None)
+    args = parser.parse_args()
+
+    elapsed, stats = asyncio.run(_bench(args.requests, args.concurrency, latency=args.latency,
+                                        error_rate=args.error_rate, rate_limit=args.rate_limit))
+    print(f"{stats['requests']} requests in {elapsed:.2f}s ({stats['requests'] / elapsed:.0f}/s), statuses {stats['statuses']}")
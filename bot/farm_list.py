@@ -0,0 +1,317 @@
+# farm_list.py
+"""
+Farm-list raid dispatcher.
+
+Targets come from the villages table, nearest first, via the spatial index.
+Raids are sent in two overlapping stages on one pooled session:
+
+- prefetchers GET the send-troops page of upcoming targets, keeping up to
+  PREFETCH (target, key) pairs ready ahead of the dispatchers;
+- dispatchers POST the raids with bounded concurrency.
+
+Raids leave from the session's active village, so each round first switches
+the session to the source village (and leaves it there). Pass the account's
+village lock to keep other village-scoped work from switching it mid-round.
+
+Each target has a cooldown so it is not raided again too soon. A TroopLedger
+tracks the troops at home and reserves them before every POST, so the
+dispatcher never sends more troops than are in the village.
+
+    farm = FarmList(client, server_url, source_village_id, targets, {1: 20})
+    await farm.run()
+    print(farm.report())
+"""
+
+import asyncio
+import contextlib
+import logging
+import time
+
+from bs4 import BeautifulSoup
+
+from . import spatial, tracing
+from .troop_training import parse_training_form
+
+logger = logging.getLogger(__name__)
+
+RAID = '4'              # v2v.php attack type: raid
+CONCURRENCY = 8         # Raids posted at the same time
+PREFETCH = 16           # Send pages fetched ahead of the dispatchers
+KEY_TTL = 60            # Seconds a prefetched key is trusted
+COOLDOWN = 600          # Seconds before the same target is raided again
+
+
+def load_targets(conn, username, village_id, radius=None, limit=None, exclude_players=()):
+    """
+    Farm targets around one of our villages, nearest first.
+
+    Args:
+        conn: Database connection
+        username: Our username (our own villages are never targets)
+        village_id: Village the raids leave from
+        radius: Only targets within this many tiles
+        limit: At most this many targets
+        exclude_players: Player names to leave alone
+
+    Returns: list of (distance, village_id, player_name, village_name, x, y)
+    """
+    if radius is None and limit is None:
+        limit = 100
+    entries = spatial.targets_near_village(conn, username, village_id, k=None if radius else limit, radius=radius)
+    excluded = set(exclude_players)
+    targets = [(dist, row[1], row[0], row[2], x, y) for dist, x, y, row in entries if row[0] not in excluded]
+    return targets[:limit] if limit else targets
+
+
+def parse_send_page(html):
+    """
+    Parse the send-troops form.
+
+    Returns: dict with 'key', 'hidden' form fields and 'troops' {input_name: count at home}
+    """
+    page = parse_training_form(html)
+    key = page['hidden'].get('key')
+    if key is None:
+        key_input = BeautifulSoup(html, 'html.parser').find('input', {'name': 'key'})
+        key = key_input.get('value') if key_input else None
+    return {'key': key, 'hidden': page['hidden'], 'troops': {unit['input']: unit['max'] for unit in page['units']}}
+
+
+class TroopLedger:
+    """
+    Troops at home, as far as we can tell between page loads.
+
+    A page requested at time T may or may not include raids that completed
+    after T, so those are subtracted again, as are raids still in flight.
+    That can only under-count what is home, never over-count it.
+    """
+
+    def __init__(self):
+        self.home = None
+        self.reserved = {}   # Troops of raids being posted right now
+        self.posted = []     # (completed_at, troops) of recent raids
+
+    def sync(self, counts, fetched_at):
+        """Take the counts read from a page requested at `fetched_at` (monotonic)."""
+        self.posted = [(at, troops) for at, troops in self.posted if at >= fetched_at - KEY_TTL]
+        home = dict(counts)
+        for at, troops in self.posted:
+            if at >= fetched_at:
+                for name, count in troops.items():
+                    home[name] = home.get(name, 0) - count
+        for name, count in self.reserved.items():
+            home[name] = home.get(name, 0) - count
+        self.home = home
+
+    def reserve(self, troops):
+        """Take troops for one raid if they are home. Returns False if they are not."""
+        if self.home is None or any(self.home.get(name, 0) < count for name, count in troops.items()):
+            return False
+        for name, count in troops.items():
+            self.home[name] -= count
+            self.reserved[name] = self.reserved.get(name, 0) + count
+        return True
+
+    def release(self, troops):
+        """Give back the troops of a raid that was not sent."""
+        for name, count in troops.items():
+            self.home[name] = self.home.get(name, 0) + count
+            self.reserved[name] -= count
+
+    def confirm(self, troops):
+        """Record a raid the game accepted."""
+        for name, count in troops.items():
+            self.reserved[name] -= count
+        self.posted.append((time.monotonic(), dict(troops)))
+
+    def raids_left(self, troops):
+        """How many more raids of this size the troops at home allow."""
+        if not self.home or not troops:
+            return 0
+        return min(self.home.get(name, 0) // count for name, count in troops.items())
+
+
+class FarmList:
+    """
+    Dispatches raids to a list of targets.
+
+    Args:
+        client: Logged-in AsyncClient (e.g. SessionManager.get_client())
+        server_url: Game server URL
+        source_village: Our village ID the raids leave from
+        targets: Output of load_targets()
+        troops: Troops per raid, {troop_index: count}
+        concurrency: Raids posted at the same time
+        prefetch: Send pages fetched ahead
+        cooldown: Seconds between raids on the same target
+        callback: Optional progress callback
+        inventory: Optional TroopInventory to record sent raids in
+        village_lock: Optional asyncio.Lock held for each round, from switching
+            to the source village until the last raid is posted
+    """
+
+    def __init__(self, client, server_url, source_village, targets, troops, concurrency=CONCURRENCY,
+                 prefetch=PREFETCH, cooldown=COOLDOWN, callback=None, inventory=None, village_lock=None):
+        self.client = client
+        self.server_url = server_url
+        self.source_village = source_village
+        self.targets = list(targets)
+        self.troops = {f"t[{index}]": count for index, count in troops.items() if count > 0}
+        self.troop_counts = {index: count for index, count in troops.items() if count > 0}
+        self.concurrency = max(1, concurrency)
+        self.prefetch = max(1, prefetch)
+        self.cooldown = cooldown
+        self.callback = callback
+        self.inventory = inventory
+        self.village_lock = village_lock
+        self.ledger = TroopLedger()
+        self.next_raid = {}  # target village ID -> monotonic time it may be raided again
+        self.out_of_troops = False
+        self.stats = {'sent': 0, 'failed': 0, 'skipped': 0, 'expired_keys': 0}
+        self.started = None
+
+    def _log(self, message):
+        logger.info(message)
+        if self.callback:
+            self.callback(message)
+
+    async def _fetch_key(self, village_id):
+        """GET the send page for one target. Returns (key, hidden fields, fetched_at)."""
+        fetched_at = time.monotonic()
+        response = await self.client.get(f"{self.server_url}/v2v.php?id={village_id}")
+        response.raise_for_status()
+        page = await tracing.to_thread(parse_send_page, response.text)
+        if page['troops']:
+            self.ledger.sync(page['troops'], fetched_at)
+        return page['key'], page['hidden'], fetched_at
+
+    async def _prefetcher(self, pending, ready):
+        while not self.out_of_troops:
+            try:
+                target = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            village_id = target[1]
+            try:
+                key, hidden, fetched_at = await self._fetch_key(village_id)
+            except Exception as e:
+                self.stats['failed'] += 1
+                logger.warning(f"Could not load send page for village {village_id}: {e}")
+                continue
+            if key is None:
+                self.stats['skipped'] += 1
+                logger.warning(f"No send form for village {village_id}")
+                continue
+            await ready.put((target, key, hidden, fetched_at))
+
+    async def _dispatcher(self, ready):
+        while True:
+            item = await ready.get()
+            if item is None:
+                return
+            target, key, hidden, fetched_at = item
+            _, village_id, player_name, village_name, x, y = target
+
+            if self.out_of_troops:
+                self.stats['skipped'] += 1
+                continue
+            if time.monotonic() - fetched_at > KEY_TTL:
+                self.stats['expired_keys'] += 1
+                try:
+                    key, hidden, fetched_at = await self._fetch_key(village_id)
+                except Exception as e:
+                    self.stats['failed'] += 1
+                    logger.warning(f"Could not refresh key for village {village_id}: {e}")
+                    continue
+            if not self.ledger.reserve(self.troops):
+                self.out_of_troops = True
+                self.stats['skipped'] += 1
+                self._log("Not enough troops at home; stopping this round")
+                continue
+
+            data = dict(hidden)
+            data.update({'id': str(village_id), 'c': RAID, 'key': key})
+            data.update({name: str(count) for name, count in self.troops.items()})
+            try:
+                response = await self.client.post(f"{self.server_url}/v2v.php", data=data)
+                accepted = response.status_code in (200, 302)
+            except Exception as e:
+                logger.warning(f"Raid on village {village_id} failed: {e}")
+                accepted = False
+
+            if accepted:
+                self.ledger.confirm(self.troops)
+                if self.inventory is not None:
+                    self.inventory.record_send(self.source_village, self.troop_counts)
+                self.next_raid[village_id] = time.monotonic() + self.cooldown
+                self.stats['sent'] += 1
+                logger.info(f"Raid sent to {village_name} ({x}|{y}) of {player_name}")
+            else:
+                self.ledger.release(self.troops)
+                self.stats['failed'] += 1
+
+    async def run_round(self):
+        """
+        Raid every target that is off cooldown, until troops run out. Returns raids sent.
+
+        Switches the session's active village to the source village.
+        """
+        now = time.monotonic()
+        pending = asyncio.Queue()
+        for target in self.targets:
+            if self.next_raid.get(target[1], 0) <= now:
+                pending.put_nowait(target)
+        if pending.empty():
+            return 0
+        if self.inventory is not None:
+            home = await self.inventory.home(self.source_village)
+            if any(home.get(index, 0) < count for index, count in self.troop_counts.items()):
+                self._log("Not enough troops at home per the rally point; skipping this round")
+                return 0
+
+        sent_before = self.stats['sent']
+        self.out_of_troops = False
+        async with self.village_lock or contextlib.nullcontext():
+            await self.client.get(f"{self.server_url}/village1.php?newdid={self.source_village}")
+            ready = asyncio.Queue(maxsize=self.prefetch)
+            dispatchers = [asyncio.create_task(self._dispatcher(ready)) for _ in range(self.concurrency)]
+            try:
+                await asyncio.gather(*(self._prefetcher(pending, ready) for _ in range(self.concurrency)))
+                for _ in dispatchers:
+                    await ready.put(None)
+                await asyncio.gather(*dispatchers)
+            finally:
+                for task in dispatchers:
+                    task.cancel()
+        return self.stats['sent'] - sent_before
+
+    async def run(self, rounds=1, wait=60):
+        """
+        Run `rounds` rounds (forever if None), pausing `wait` seconds or until
+        the next cooldown expires between them. The village lock, if any, is
+        released between rounds.
+
+        Returns: report()
+        """
+        self.started = self.started or time.monotonic()
+
+        done = 0
+        while rounds is None or done < rounds:
+            sent = await self.run_round()
+            done += 1
+            self._log(f"Round {done}: {sent} raids sent, {self.stats['failed']} failed so far")
+            if rounds is not None and done >= rounds:
+                break
+            upcoming = [at for at in self.next_raid.values() if at > time.monotonic()]
+            pause = min(min(upcoming, default=time.monotonic() + wait) - time.monotonic(), wait)
+            await asyncio.sleep(max(pause, 1))
+        return self.report()
+
+    def report(self):
+        """Raid counters and throughput."""
+        elapsed = time.monotonic() - self.started if self.started else 0.0
+        report = dict(self.stats)
+        report['elapsed'] = elapsed
+        report['raids_per_minute'] = self.stats['sent'] / elapsed * 60 if elapsed else 0.0
+        report['troops_home'] = {name: max(count, 0) for name, count in (self.ledger.home or {}).items()}
+        return report
@@ -4,59 +4,292 @@ import httpx
 from bs4 import BeautifulSoup
 import logging
 import asyncio
-from .database import save_village
+import hashlib
+import time
+from .database import replace_player_villages, save_players, get_players
+from . import history, parse_pool, spatial
+from .db_writer import DeleteVillagesRecord, VillageRecord, PlayerRecord
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 BASE_URL = "https://fun.gotravspeed.com"
 
-async def fetch_statistics(cookies):
-    async with httpx.AsyncClient(cookies=cookies) as client:
-        response = await client.get(f"{BASE_URL}/statistics.php")
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-        player_rows = soup.select('#player tbody tr')
-        players = []
-
-        for row in player_rows:
-            player_link = row.select_one('td.pla a')
-            if player_link:
-                player_id = player_link['href'].split('=')[-1]
-                player_name = player_link.text.strip()
-                players.append((player_id, player_name))
-
-        logger.info(f"Found {len(players)} players in the statistics.")
-        return players
-
-async def fetch_villages_for_player(cookies, player_id, player_name, conn):
-    async with httpx.AsyncClient(cookies=cookies) as client:
-        response = await client.get(f"{BASE_URL}/profile.php?uid={player_id}")
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-        village_rows = soup.select('#villages tbody tr')
-
-        for row in village_rows:
-            cols = row.find_all('td')
-            if len(cols) < 5:
-                continue
+# Crawler tuning
+CONCURRENCY = 16       # Profile pages fetched at the same time
+BATCH_SIZE = 500       # Village rows written per transaction
+MAX_PAGES = 1000       # Safety limit for statistics paging
+RETRIES = 3
+MAX_PROFILE_AGE = 24 * 3600  # Re-fetch unchanged players after this many seconds
+
+
+def parse_int(text):
+    """Parse a number such as '1,234', returning None if there is none."""
+    digits = ''.join(ch for ch in text if ch.isdigit())
+    return int(digits) if digits else None
+
+
+def parse_statistics(html):
+    """
+    Parse one page of the player ranking.
+
+    Returns: list of (player_id, player_name, population, village_count)
+    Population and village count are None if the page does not show them.
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    players = []
+
+    for row in soup.select('#player tbody tr'):
+        player_link = row.select_one('td.pla a')
+        if not player_link:
+            continue
+
+        try:
+            player_id = int(player_link['href'].split('=')[-1])
+        except ValueError:
+            continue
+        player_name = player_link.text.strip()
+
+        pop_cell = row.select_one('td.pop')
+        vil_cell = row.select_one('td.vil')
+        population = parse_int(pop_cell.text) if pop_cell else None
+        village_count = parse_int(vil_cell.text) if vil_cell else None
+
+        players.append((player_id, player_name, population, village_count))
+
+    return players
+
+
+def parse_profile(html):
+    """
+    Parse the village table of a player profile.
+
+    Returns: list of (village_id, village_name, population, x_coord, y_coord)
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    villages = []
 
-            village_name = cols[0].text.strip()
-            village_id = row.select_one('a')['href'].split('=')[-1]
+    for row in soup.select('#villages tbody tr'):
+        cols = row.find_all('td')
+        link = row.select_one('a')
+        if len(cols) < 5 or link is None:
+            continue
+
+        try:
+            village_id = int(link['href'].split('=')[-1])
             population = int(cols[1].text.strip())
             coords = cols[4].text.strip()[1:-1].split('|')
             x_coord = int(coords[0])
             y_coord = int(coords[1])
+        except (ValueError, IndexError):
+            continue
+
+        villages.append((village_id, cols[0].text.strip(), population, x_coord, y_coord))
+
+    return villages
+
+
+def profile_hash(villages):
+    """Content hash of a parsed village table, stable across page chrome changes."""
+    return hashlib.sha1(repr(sorted(villages)).encode()).hexdigest()
+
+
+def needs_refresh(player, known, now, max_age=MAX_PROFILE_AGE):
+    """
+    Decide whether a player's profile must be fetched again.
+
+    Args:
+        player: (player_id, player_name, population, village_count) from the ranking
+        known: Stored row from get_players(), or None
+        now: Current unix time
+        max_age: Seconds after which stored data is stale regardless of the ranking
+    """
+    if known is None:
+        return True
+
+    _, name, population, village_count = player
+    _, known_name, known_population, known_village_count, _, fetched_at = known
+
+    if population is None or village_count is None:
+        return True
+    if (name, population, village_count) != (known_name, known_population, known_village_count):
+        return True
+    return fetched_at is None or now - fetched_at >= max_age
+
+
+async def fetch_response(client, url):
+    """GET a page, retrying on network errors and 5xx responses."""
+    for attempt in range(RETRIES):
+        try:
+            response = await client.get(url)
+            if response.status_code >= 500 and attempt < RETRIES - 1:
+                await asyncio.sleep(1 + attempt)
+                continue
+            response.raise_for_status()
+            return response
+        except httpx.RequestError as e:
+            if attempt == RETRIES - 1:
+                raise
+            logger.warning(f"Network error on {url}, attempt {attempt + 1}/{RETRIES}: {e}")
+            await asyncio.sleep(1 + attempt)
 
-            save_village(conn, player_name, village_id, village_name, x_coord, y_coord)
-            logger.info(f"Saved village {village_name} (ID: {village_id}) for player {player_name}")
 
-async def fetch_and_store_all_villages(session_manager, conn):
-    cookies = await session_manager.get_cookies()
-    players = await fetch_statistics(cookies)
+async def fetch_statistics(client, server_url=BASE_URL, max_pages=MAX_PAGES):
+    """
+    Page through the whole player ranking.
 
-    for player_id, player_name in players:
-        await fetch_villages_for_player(cookies, player_id, player_name, conn)
+    Stops at the first page that adds no new players.
+    """
+    players = []
+    seen = set()
+
+    for page in range(1, max_pages + 1):
+        response = await fetch_response(client, f"{server_url}/statistics.php?page={page}")
+        rows = await parse_pool.parse(parse_statistics, response.content, response.encoding)
+        new_rows = [row for row in rows if row[0] not in seen]
+        if not new_rows:
+            break
+
+        for row in new_rows:
+            seen.add(row[0])
+            players.append(row)
+
+    logger.info(f"Found {len(players)} players in the statistics.")
+    return players
+
+
+async def fetch_villages_for_player(client, player_id, server_url=BASE_URL):
+    """
+    Fetch and parse one player's profile off the event loop (in the parse
+    pool if it is enabled).
+
+    Returns: list of (village_id, village_name, population, x_coord, y_coord)
+    """
+    response = await fetch_response(client, f"{server_url}/profile.php?uid={player_id}")
+    return await parse_pool.parse(parse_profile, response.content, response.encoding)
+
+
+async def fetch_and_store_all_villages(session_manager, conn, concurrency=CONCURRENCY, batch_size=BATCH_SIZE,
+                                       max_age=MAX_PROFILE_AGE, full=False, record_history=True, writer=None):
+    """
+    Crawl every player's villages and store them.
+
+    Profiles are fetched by a bounded pool of workers sharing the session's
+    pooled client, and villages are written in batched transactions.
+    A profile is only re-fetched when the player's ranking row changed or the
+    stored copy is older than max_age; pass full=True to fetch everything.
+    With record_history, a world snapshot is appended to the history store;
+    players that were not re-fetched keep their values from the last snapshot.
+    With a DatabaseWriter, rows are handed to its background thread instead of
+    being committed on the event loop.
+
+    Returns: dict of crawl counters, including the share of skipped profiles
+    """
+    client = await session_manager.get_client()
+    server_url = session_manager.server_url
+    start_time = time.time()
+
+    players = await fetch_statistics(client, server_url)
+    known = get_players(conn)
+    now = int(start_time)
+
+    current_names = {player[1] for player in players}
+    queue = asyncio.Queue()
+    for player in players:
+        if full or needs_refresh(player, known.get(player[0]), now, max_age):
+            queue.put_nowait(player)
+
+    to_fetch = queue.qsize()
+    stats = {'players': len(players), 'fetched': 0, 'skipped': len(players) - to_fetch,
+             'unchanged': 0, 'villages': 0, 'errors': 0}
+
+    pending_villages = []
+    pending_owners = []
+    pending_players = []
+    snapshot_rows = []
+    fetched_ids = set()
+
+    def flush():
+        if writer is not None:
+            writer.submit_many(DeleteVillagesRecord(owner) for owner in pending_owners)
+            writer.submit_many(VillageRecord(*row) for row in pending_villages)
+            writer.submit_many(PlayerRecord(*row) for row in pending_players)
+            stats['villages'] += len(pending_villages)
+        else:
+            if pending_owners:
+                replace_player_villages(conn, pending_owners, pending_villages)
+                stats['villages'] += len(pending_villages)
+            if pending_players:
+                save_players(conn, pending_players)
+        pending_villages.clear()
+        pending_owners.clear()
+        pending_players.clear()
+
+    async def worker():
+        while True:
+            try:
+                player_id, player_name, population, village_count = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            try:
+                villages = await fetch_villages_for_player(client, player_id, server_url)
+            except httpx.HTTPError as e:
+                stats['errors'] += 1
+                logger.warning(f"Failed to fetch profile of {player_name} (uid {player_id}): {e}")
+                continue
+
+            fetched_ids.add(player_id)
+            snapshot_rows.extend((village_id, village_pop, player_id)
+                                 for village_id, _, village_pop, _, _ in villages)
+
+            content_hash = profile_hash(villages)
+            previous = known.get(player_id)
+            if previous is not None and previous[1] == player_name and previous[4] == content_hash:
+                stats['unchanged'] += 1
+            else:
+                pending_owners.append(player_name)
+                if previous is not None and previous[1] != player_name and previous[1] not in current_names:
+                    # Renamed: drop the villages stored under the old name (unless someone else took it)
+                    pending_owners.append(previous[1])
+                for village_id, village_name, village_pop, x_coord, y_coord in villages:
+                    pending_villages.append((player_name, village_id, village_name, x_coord, y_coord))
+            pending_players.append((player_id, player_name, population, village_count, content_hash, int(time.time())))
+            stats['fetched'] += 1
+
+            if len(pending_villages) >= batch_size or len(pending_players) >= batch_size:
+                flush()
+
+            if stats['fetched'] % 100 == 0:
+                elapsed = time.time() - start_time
+                logger.info(f"Crawled {stats['fetched']}/{to_fetch} profiles ({stats['fetched'] / elapsed:.1f}/sec)")
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    flush()
+    if writer is not None:
+        await writer.aflush()
+
+    if record_history and players:
+        # Carried-over rows go first so freshly fetched rows win on conflicts
+        carried = []
+        snapshots = history.get_snapshots(conn)
+        if snapshots:
+            ranked_ids = {player[0] for player in players}
+            previous = history.load_snapshot(conn, snapshots[-1][0])
+            carried = [(village_id, population, owner_id)
+                       for village_id, (population, owner_id) in previous.items()
+                       if owner_id in ranked_ids and owner_id not in fetched_ids]
+        stats['snapshot_id'] = history.record_snapshot(conn, carried + snapshot_rows, taken_at=now)
+
+    if stats['villages']:
+        spatial.rebuild_world_index(conn)
+
+    stats['skip_ratio'] = stats['skipped'] / stats['players'] if stats['players'] else 0.0
+    elapsed = time.time() - start_time
+    logger.info(f"Crawl finished: {stats['fetched']} profiles fetched, {stats['skipped']} skipped "
+                f"({stats['skip_ratio']:.0%}), {stats['unchanged']} unchanged, {stats['villages']} villages saved, "
+                f"{stats['errors']} errors in {elapsed:.1f}s")
+    return stats
 
 if __name__ == "__main__":
     from .session_manager import SessionManager
@@ -67,6 +300,6 @@ if __name__ == "__main__":
         session_manager = SessionManager('your_username', 'your_password', 'roman', conn)
         await session_manager.login()
         await fetch_and_store_all_villages(session_manager, conn)
+        await session_manager.close()
 
     asyncio.run(main())
-
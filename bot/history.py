@@ -0,0 +1,232 @@
+# history.py
+"""
+World history: an append-only, columnar record of every village's
+population and owner, one snapshot per crawl.
+
+Each snapshot stores three packed integer columns (village IDs, populations,
+owner IDs) sorted by village ID. Village IDs are delta-encoded. Every
+KEYFRAME_INTERVAL snapshots a full keyframe is written; the snapshots in
+between store populations and owners as differences from that keyframe, which
+are mostly zero and compress to almost nothing. Loading any snapshot needs at
+most two rows.
+"""
+
+import logging
+import time
+import zlib
+from array import array
+
+logger = logging.getLogger(__name__)
+
+KEYFRAME_INTERVAL = 24  # One full snapshot per day of hourly crawls
+
+
+def _pack(values):
+    return zlib.compress(array('q', values).tobytes())
+
+
+def _unpack(blob):
+    values = array('q')
+    values.frombytes(zlib.decompress(blob))
+    return values
+
+
+def _delta_encode(values):
+    previous = 0
+    out = []
+    for value in values:
+        out.append(value - previous)
+        previous = value
+    return out
+
+
+def _delta_decode(values):
+    total = 0
+    out = []
+    for value in values:
+        total += value
+        out.append(total)
+    return out
+
+
+def _load_columns(conn, snapshot_id):
+    """Return (village_ids, populations, owner_ids) lists for one snapshot."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT base_id, village_ids, populations, owner_ids FROM village_snapshots WHERE snapshot_id=?",
+                   (snapshot_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return [], [], []
+
+    base_id, id_blob, pop_blob, owner_blob = row
+    village_ids = _delta_decode(_unpack(id_blob))
+    populations = list(_unpack(pop_blob))
+    owner_ids = list(_unpack(owner_blob))
+
+    if base_id is not None:
+        base = load_snapshot(conn, base_id)
+        for i, village_id in enumerate(village_ids):
+            base_pop, base_owner = base.get(village_id, (0, 0))
+            populations[i] += base_pop
+            owner_ids[i] += base_owner
+
+    return village_ids, populations, owner_ids
+
+
+def load_snapshot(conn, snapshot_id):
+    """
+    Load one snapshot.
+
+    Returns: dict of village_id -> (population, owner_id)
+    """
+    village_ids, populations, owner_ids = _load_columns(conn, snapshot_id)
+    return {vid: (pop, owner) for vid, pop, owner in zip(village_ids, populations, owner_ids)}
+
+
+def record_snapshot(conn, villages, taken_at=None, keyframe_interval=KEYFRAME_INTERVAL):
+    """
+    Append a snapshot of the world.
+
+    Args:
+        conn: Database connection
+        villages: Iterable of (village_id, population, owner_id)
+        taken_at: Unix time of the crawl (defaults to now)
+        keyframe_interval: Snapshots between full keyframes
+
+    Returns: the new integer snapshot ID
+    """
+    taken_at = int(taken_at if taken_at is not None else time.time())
+    rows = sorted({int(vid): (int(pop), int(owner)) for vid, pop, owner in villages}.items())
+    village_ids = [vid for vid, _ in rows]
+    populations = [pop for _, (pop, _) in rows]
+    owner_ids = [owner for _, (_, owner) in rows]
+
+    cursor = conn.cursor()
+    cursor.execute("SELECT snapshot_id FROM village_snapshots WHERE base_id IS NULL ORDER BY snapshot_id DESC LIMIT 1")
+    keyframe = cursor.fetchone()
+    base_id = None
+    if keyframe is not None:
+        cursor.execute("SELECT COUNT(*) FROM village_snapshots WHERE base_id=?", (keyframe[0],))
+        if cursor.fetchone()[0] + 1 < keyframe_interval:
+            base_id = keyframe[0]
+
+    if base_id is not None:
+        base = load_snapshot(conn, base_id)
+        for i, village_id in enumerate(village_ids):
+            base_pop, base_owner = base.get(village_id, (0, 0))
+            populations[i] -= base_pop
+            owner_ids[i] -= base_owner
+
+    cursor.execute("INSERT INTO snapshots (taken_at, village_count) VALUES (?, ?)", (taken_at, len(rows)))
+    snapshot_id = cursor.lastrowid
+    cursor.execute("INSERT INTO village_snapshots (snapshot_id, base_id, village_ids, populations, owner_ids) VALUES (?, ?, ?, ?, ?)",
+                   (snapshot_id, base_id, _pack(_delta_encode(village_ids)), _pack(populations), _pack(owner_ids)))
+    conn.commit()
+
+    logger.info(f"Recorded world snapshot {snapshot_id} with {len(rows)} villages")
+    return snapshot_id
+
+
+def get_snapshots(conn):
+    """Return all (snapshot_id, taken_at, village_count) rows, oldest first."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT snapshot_id, taken_at, village_count FROM snapshots ORDER BY snapshot_id")
+    return cursor.fetchall()
+
+
+def _snapshot_pair(conn, hours, now=None):
+    """
+    Find the latest snapshot and the latest one taken at least `hours` before it.
+
+    Falls back to the oldest snapshot if history is shorter than the window.
+    Returns: ((old_id, old_time), (new_id, new_time)) or None
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT snapshot_id, taken_at FROM snapshots ORDER BY snapshot_id DESC LIMIT 1")
+    latest = cursor.fetchone()
+    if latest is None:
+        return None
+
+    cutoff = (now if now is not None else latest[1]) - hours * 3600
+    cursor.execute("SELECT snapshot_id, taken_at FROM snapshots WHERE taken_at <= ? AND snapshot_id < ? "
+                   "ORDER BY snapshot_id DESC LIMIT 1", (cutoff, latest[0]))
+    older = cursor.fetchone()
+    if older is None:
+        cursor.execute("SELECT snapshot_id, taken_at FROM snapshots ORDER BY snapshot_id LIMIT 1")
+        older = cursor.fetchone()
+    if older[0] == latest[0]:
+        return None
+    return older, latest
+
+
+def village_growth(conn, hours=24):
+    """
+    Population growth per village over the last `hours`.
+
+    Returns: list of (village_id, owner_id, old_population, new_population, growth_per_hour),
+    fastest growing first. Villages missing from the older snapshot are left out.
+    """
+    pair = _snapshot_pair(conn, hours)
+    if pair is None:
+        return []
+    (old_id, old_time), (new_id, new_time) = pair
+    span = max(new_time - old_time, 1) / 3600
+
+    old = load_snapshot(conn, old_id)
+    results = []
+    for village_id, (population, owner_id) in load_snapshot(conn, new_id).items():
+        if village_id in old:
+            old_population = old[village_id][0]
+            results.append((village_id, owner_id, old_population, population, (population - old_population) / span))
+
+    results.sort(key=lambda r: r[4], reverse=True)
+    return results
+
+
+def player_growth(conn, hours=24):
+    """
+    Total population growth per player over the last `hours`.
+
+    Returns: dict of owner_id -> (old_population, new_population, growth_per_hour)
+    """
+    pair = _snapshot_pair(conn, hours)
+    if pair is None:
+        return {}
+    (old_id, old_time), (new_id, new_time) = pair
+    span = max(new_time - old_time, 1) / 3600
+
+    totals = {}
+    for index, snapshot_id in enumerate((old_id, new_id)):
+        for population, owner_id in load_snapshot(conn, snapshot_id).values():
+            entry = totals.setdefault(owner_id, [0, 0])
+            entry[index] += population
+
+    return {owner: (old, new, (new - old) / span) for owner, (old, new) in totals.items() if old and new}
+
+
+def inactive_players(conn, hours=24):
+    """
+    Players whose total population has not grown over the last `hours`.
+
+    Returns: list of owner IDs, smallest population first
+    """
+    growth = player_growth(conn, hours)
+    inactive = [(new, owner) for owner, (old, new, _) in growth.items() if new <= old]
+    return [owner for _, owner in sorted(inactive)]
+
+
+def new_villages(conn, hours=24):
+    """
+    Villages founded (or first seen) within the last `hours`.
+
+    Returns: list of (village_id, owner_id, population)
+    """
+    pair = _snapshot_pair(conn, hours)
+    if pair is None:
+        return []
+    (old_id, _), (new_id, _) = pair
+
+    old = load_snapshot(conn, old_id)
+    return [(village_id, owner_id, population)
+            for village_id, (population, owner_id) in load_snapshot(conn, new_id).items()
+            if village_id not in old]
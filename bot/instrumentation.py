@@ -0,0 +1,44 @@
+# instrumentation.py
+"""
+The optional diagnostics every entry point switches on from the environment.
+
+    TBOT_TELEMETRY=1          request telemetry in the database (telemetry.py)
+    TBOT_METRICS_PORT=9464    Prometheus endpoint (metrics.py)
+    TBOT_TRACE=trace.json     span trace (tracing.py)
+    TBOT_RECORD=run.jsonl.gz  request recording (replay.py)
+    TBOT_PARSE_WORKERS=0      parse pool processes (parse_pool.py)
+
+The bot, CLI, TUI and daemon call enable_from_env() on start and disable()
+on the way out.
+"""
+
+import logging
+
+from . import metrics, parse_pool, replay, telemetry, tracing
+
+logger = logging.getLogger(__name__)
+
+_telemetry_writer = None
+
+
+def enable_from_env():
+    """Enable each feature whose environment variable is set."""
+    global _telemetry_writer
+    _telemetry_writer = telemetry.enable_from_env()
+    metrics.enable_from_env()
+    tracing.enable_from_env()
+    replay.enable_from_env()
+    parse_pool.enable_from_env()
+
+
+def disable():
+    """Stop everything enable_from_env() started: worker processes, server, files and the telemetry writer."""
+    global _telemetry_writer
+    parse_pool.disable()
+    replay.stop_recording()
+    tracing.disable()
+    metrics.disable()
+    telemetry.disable()
+    if _telemetry_writer is not None:
+        _telemetry_writer.close()
+        _telemetry_writer = None
@@ -3,7 +3,10 @@
 import httpx
 import logging
 from .database import save_empty_spot, delete_all_empty_spots
+from .db_writer import EmptySpotRecord
 from bs4 import BeautifulSoup
+from . import profiling
+from .telemetry import event_hooks
 
 logger = logging.getLogger(__name__)
 
@@ -23,16 +26,23 @@ def generate_spiral_village_ids(center_id, max_villages=1500, max_radius=25):
     return ids[:max_villages]
 
 async def is_village_empty(cookies, village_id):
-    async with httpx.AsyncClient(cookies=cookies) as client:
+    async with httpx.AsyncClient(cookies=cookies, event_hooks=event_hooks()) as client:
         response = await client.get(f"https://fun.gotravspeed.com/village3.php?id={village_id}")
         return '»building a new village' in response.text
 
-async def find_empty_village_spots(cookies, potential_village_ids, conn):
+@profiling.profiled
+async def find_empty_village_spots(cookies, potential_village_ids, conn, writer=None):
     """
     Find and save empty village spots.
+    With a DatabaseWriter, spots are queued instead of committed one by one.
     """
     delete_all_empty_spots(conn)
     for village_id in potential_village_ids:
         if await is_village_empty(cookies, village_id):
-            save_empty_spot(conn, village_id, 0)  # 0 indicates not settled
+            if writer is not None:
+                writer.submit(EmptySpotRecord(village_id, 0))
+            else:
+                save_empty_spot(conn, village_id, 0)  # 0 indicates not settled
             logger.info(f"Found empty spot at village ID {village_id}")
+    if writer is not None:
+        await writer.aflush()
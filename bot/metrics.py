@@ -0,0 +1,318 @@
+# metrics.py
+"""
+Live metrics of a running bot in Prometheus text format.
+
+The registry holds counters, gauges and histograms, and callback gauges
+that are read at scrape time. enable() serves them from a small HTTP
+server on localhost, at /metrics. The server runs on its own thread, so it
+keeps answering across the CLI's separate event loops.
+
+The bot records:
+- tbot_requests_total{endpoint, status} and
+  tbot_request_duration_seconds{endpoint}, from the telemetry event hooks
+  that every client already installs;
+- tbot_shop_purchases_total{shop, outcome}, from the storage and production
+  loops (purchases per second is rate() of the success series);
+- tbot_training_queue_seconds{village, building}, from the TrainingEngine;
+- tbot_build_queue_steps, the preset buildings still to be processed;
+- the DatabaseWriter's queue depth and commit times, and the Orchestrator's
+  jobs and host queues, once they are tracked.
+
+Usage:
+    metrics.enable(port=9464)
+    # curl http://127.0.0.1:9464/metrics
+
+The bot, CLI, TUI and daemon entry points start the server when
+TBOT_METRICS_PORT is set.
+"""
+
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+PORT = 9464
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # Seconds
+
+_lock = threading.Lock()
+_server = None
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def samples(self):
+        """(sample name, ((label, value), ...), value) tuples."""
+        with _lock:
+            items = list(self.values.items())
+        for key, value in items:
+            yield self.name, tuple(zip(self.labels, key)), value
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def remove(self, **labels):
+        with _lock:
+            self.values.pop(self._key(labels), None)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with _lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self.values.items()]
+        for key, (counts, total, count) in items:
+            labels = tuple(zip(self.labels, key))
+            for bound, cumulative in zip(self.buckets, counts):
+                yield f"{self.name}_bucket", labels + (('le', _format_value(float(bound))),), cumulative
+            yield f"{self.name}_bucket", labels + (('le', '+Inf'),), count
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class CallbackGauge(_Metric):
+    """
+    A gauge read at scrape time.
+
+    fn returns a number, or {label value tuple: number} for labelled gauges.
+    kind='counter' exports a running total kept elsewhere.
+    """
+
+    def __init__(self, name, help, fn, labels=(), kind='gauge'):
+        super().__init__(name, help, labels)
+        self.fn = fn
+        self.kind = kind
+
+    def samples(self):
+        value = self.fn()
+        if not isinstance(value, dict):
+            yield self.name, (), value
+            return
+        for key, sample in value.items():
+            key = key if isinstance(key, tuple) else (key,)
+            yield self.name, tuple(zip(self.labels, map(str, key))), sample
+
+
+class Registry:
+    """Named metrics, rendered together in Prometheus text format."""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        """Add a metric. An existing metric of the same name is returned instead, except callbacks, which replace it."""
+        with _lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None and not isinstance(metric, CallbackGauge):
+                return existing
+            self.metrics[metric.name] = metric
+        return metric
+
+    def unregister(self, name):
+        with _lock:
+            self.metrics.pop(name, None)
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def callback(self, name, help, fn, labels=(), kind='gauge'):
+        return self.register(CallbackGauge(name, help, fn, labels, kind))
+
+    def render(self):
+        """All metrics in Prometheus text exposition format."""
+        with _lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                logger.debug(f"Could not collect {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help.replace(chr(92), chr(92) * 2)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter('tbot_requests_total', "Game requests by endpoint class and HTTP status",
+                            ('endpoint', 'status'))
+REQUEST_SECONDS = REGISTRY.histogram('tbot_request_duration_seconds', "Game request latency, body included",
+                                     ('endpoint',))
+SHOP_PURCHASES = REGISTRY.counter('tbot_shop_purchases_total', "Shop purchases by shop and outcome",
+                                  ('shop', 'outcome'))
+TRAINING_QUEUE = REGISTRY.gauge('tbot_training_queue_seconds', "Seconds of troops queued in a training building",
+                                ('village', 'building'))
+BUILD_QUEUE = REGISTRY.gauge('tbot_build_queue_steps', "Preset buildings still to be processed")
+
+
+def observe_request(endpoint, status, seconds):
+    """Record one finished game request."""
+    REQUESTS.inc(endpoint=endpoint, status=status)
+    REQUEST_SECONDS.observe(seconds, endpoint=endpoint)
+
+
+def shop_purchase(shop, success):
+    """Record one storage or production purchase attempt."""
+    SHOP_PURCHASES.inc(shop=shop, outcome='success' if success else 'failure')
+
+
+def track_writer(writer, registry=REGISTRY):
+    """Export a DatabaseWriter's queue depth and commit figures."""
+    registry.callback('tbot_db_writer_queue_depth', "Records waiting for the DatabaseWriter",
+                      lambda: writer.queue.qsize())
+    registry.callback('tbot_db_writer_rows_written_total', "Rows written by the DatabaseWriter",
+                      lambda: writer.rows_written, kind='counter')
+    registry.callback('tbot_db_writer_errors_total', "Failed DatabaseWriter batches",
+                      lambda: writer.errors, kind='counter')
+    registry.callback('tbot_db_writer_last_commit_seconds', "Duration of the DatabaseWriter's last commit",
+                      lambda: writer.last_commit_seconds)
+
+
+def track_orchestrator(orchestrator, registry=REGISTRY):
+    """Export an Orchestrator's job slots and per-host request queues."""
+    jobs = orchestrator.jobs
+    registry.callback('tbot_jobs_running', "Jobs holding an Orchestrator slot, per account",
+                      lambda: {(username,): jobs.held.get(username, 0) for username in orchestrator.sessions},
+                      ('account',))
+    registry.callback('tbot_jobs_queued', "Jobs waiting for an Orchestrator slot, per account",
+                      lambda: {(username,): jobs.waiters.waiting(username) for username in orchestrator.sessions},
+                      ('account',))
+    registry.callback('tbot_host_queue_depth', "Requests waiting for a host's rate budget",
+                      lambda: {(host,): limiter.waiters.waiting() for host, limiter in list(orchestrator.limiters.items())},
+                      ('host',))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def enable(port=PORT, host='127.0.0.1', registry=REGISTRY):
+    """
+    Serve the registry at http://host:port/metrics on a background thread.
+
+    Returns: the HTTPServer (its server_address holds the bound port when port is 0)
+    """
+    global _server
+    disable()
+    handler = type('Handler', (_Handler,), {'registry': registry})
+    _server = ThreadingHTTPServer((host, port), handler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info(f"Metrics served at http://{host}:{_server.server_address[1]}/metrics")
+    return _server
+
+
+def enable_from_env(var='TBOT_METRICS_PORT'):
+    """Start the server if the environment variable holds a port. Returns the server or None."""
+    value = os.environ.get(var, '').strip()
+    if not value.isdigit():
+        return None
+    try:
+        return enable(int(value))
+    except OSError as e:
+        logger.warning(f"Could not serve metrics on port {value}: {e}")
+        return None
+
+
+def disable():
+    """Stop the server; metrics keep being recorded until the process exits."""
+    global _server
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+    _server = None
+
+
+def is_enabled():
+    return _server is not None
@@ -0,0 +1,345 @@
+# orchestrator.py
+"""
+Many accounts in one process.
+
+The Orchestrator holds a SessionManager per account. All of them send their
+requests through one shared connection pool, with these limits:
+
+- one global connection budget (max_connections) for all accounts and hosts;
+- a token-bucket rate budget per host, so fun.gotravspeed.com and
+  netus.gotravspeed.com are limited separately;
+- when a host is saturated, tokens go round-robin to the accounts waiting
+  on it, so an account with many workers cannot starve one with few;
+- job slots (max_jobs) are also handed out round-robin across accounts.
+
+Each account keeps its own cookies, since only the transport is shared.
+
+    orchestrator = Orchestrator(max_connections=64, host_rates={'fun.gotravspeed.com': 40})
+    session = orchestrator.add_account('abaddon', 'secret', 'roman', db, server_id=9)
+    orchestrator.submit('abaddon', 'storage', increase_storage_async(...))
+    await orchestrator.join()
+    print(orchestrator.stats())
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+import httpx
+
+from . import profiling, tracing
+from .async_db import run_db
+from .database import get_all_users, get_user
+from .session_manager import SessionManager
+
+logger = logging.getLogger(__name__)
+
+MAX_CONNECTIONS = 64    # Connections across all accounts and hosts
+HOST_RATE = 20.0        # Requests per second per host
+HOST_BURST = 20         # Requests a host may get at once after being idle
+MAX_JOBS = 16           # Jobs running at once across all accounts
+STATS_WINDOW = 60       # Seconds of history behind the per-second rates
+
+
+class _RoundRobin:
+    """Waiting futures queued per key, served one key at a time in rotation."""
+
+    def __init__(self):
+        self.queues = {}
+        self.order = deque()
+
+    def push(self, key, future):
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = self.queues[key] = deque()
+            self.order.append(key)
+        queue.append(future)
+
+    def pop(self):
+        """Next waiting future, skipping cancelled ones. None if nobody waits."""
+        while self.order:
+            key = self.order.popleft()
+            queue = self.queues[key]
+            while queue and queue[0].done():
+                queue.popleft()
+            if not queue:
+                del self.queues[key]
+                continue
+            future = queue.popleft()
+            if queue:
+                self.order.append(key)
+            else:
+                del self.queues[key]
+            return future
+        return None
+
+    def waiting(self, key=None):
+        if key is not None:
+            return sum(not f.done() for f in self.queues.get(key, ()))
+        return sum(not f.done() for queue in self.queues.values() for f in queue)
+
+
+class FairSlots:
+    """A semaphore whose free slots go round-robin to the keys waiting for one."""
+
+    def __init__(self, slots):
+        self.free = slots
+        self.waiters = _RoundRobin()
+        self.held = {}
+
+    async def acquire(self, key):
+        if self.free > 0 and not self.waiters.waiting():
+            self.free -= 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self.waiters.push(key, future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self.release(key, counted=False)  # Granted just as we were cancelled
+                raise
+        self.held[key] = self.held.get(key, 0) + 1
+
+    def release(self, key, counted=True):
+        if counted:
+            self.held[key] -= 1
+        future = self.waiters.pop()
+        if future is not None:
+            future.set_result(None)
+        else:
+            self.free += 1
+
+    def slot(self, key):
+        return _Slot(self, key)
+
+
+class _Slot:
+    def __init__(self, slots, key):
+        self.slots = slots
+        self.key = key
+
+    async def __aenter__(self):
+        await self.slots.acquire(self.key)
+
+    async def __aexit__(self, *exc):
+        self.slots.release(self.key)
+
+
+class HostLimiter:
+    """
+    Token bucket for one host, granting tokens round-robin across accounts.
+
+    Args:
+        rate: Requests per second
+        burst: Bucket size
+    """
+
+    def __init__(self, rate=HOST_RATE, burst=HOST_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.waiters = _RoundRobin()
+        self.pump = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, key):
+        self._refill()
+        if self.tokens >= 1 and not self.waiters.waiting():
+            self.tokens -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.push(key, future)
+        self._start_pump()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just as we were cancelled: put the token back for the next waiter
+                self.tokens = min(self.burst, self.tokens + 1)
+                self._start_pump()
+            raise
+
+    def _start_pump(self):
+        if self.waiters.waiting() and (self.pump is None or self.pump.done()):
+            self.pump = asyncio.create_task(self._pump())
+
+    async def _pump(self):
+        """Hand out tokens to waiters as the bucket refills."""
+        while self.waiters.waiting():
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                continue
+            future = self.waiters.pop()
+            if future is not None:
+                self.tokens -= 1
+                future.set_result(None)
+
+
+class _Counters:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.recent = deque()  # Monotonic times of recent requests
+
+    def add(self, now, ok):
+        self.requests += 1
+        self.errors += not ok
+        self.recent.append(now)
+        while self.recent and self.recent[0] < now - STATS_WINDOW:
+            self.recent.popleft()
+
+    def summary(self, now):
+        while self.recent and self.recent[0] < now - STATS_WINDOW:
+            self.recent.popleft()
+        return {'requests': self.requests, 'errors': self.errors, 'per_second': len(self.recent) / STATS_WINDOW}
+
+
+class AccountTransport(httpx.AsyncBaseTransport):
+    """
+    One account's view of the shared pool.
+
+    Closing it (as AsyncClient.aclose() does) leaves the shared pool open;
+    Orchestrator.close() closes that.
+    """
+
+    def __init__(self, orchestrator, account):
+        self.orchestrator = orchestrator
+        self.account = account
+
+    async def handle_async_request(self, request):
+        return await self.orchestrator.send(self.account, request)
+
+    async def aclose(self):
+        pass
+
+
+class Orchestrator:
+    """
+    Runs many accounts' sessions and jobs in one process.
+
+    Args:
+        max_connections: Connection budget shared by all accounts
+        host_rates: {host: requests per second} overriding `rate`
+        rate: Default requests per second per host
+        burst: Token bucket size per host
+        max_jobs: Jobs running at once across all accounts
+        transport: Underlying transport (default: a pooled AsyncHTTPTransport)
+    """
+
+    def __init__(self, max_connections=MAX_CONNECTIONS, host_rates=None, rate=HOST_RATE, burst=HOST_BURST,
+                 max_jobs=MAX_JOBS, transport=None):
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.transport = transport or httpx.AsyncHTTPTransport(limits=limits)
+        self.host_rates = dict(host_rates or {})
+        self.rate = rate
+        self.burst = burst
+        self.limiters = {}
+        self.jobs = FairSlots(max_jobs)
+        self.sessions = {}
+        self.tasks = {}       # username -> set of running job tasks
+        self.hosts = {}       # host -> _Counters
+        self.accounts = {}    # username -> _Counters
+        self.total = _Counters()
+        self.started = time.monotonic()
+
+    def limiter(self, host):
+        limiter = self.limiters.get(host)
+        if limiter is None:
+            limiter = self.limiters[host] = HostLimiter(self.host_rates.get(host, self.rate), self.burst)
+        return limiter
+
+    async def send(self, account, request):
+        """Send one request through the shared pool within its host's rate budget."""
+        host = request.url.host
+        await self.limiter(host).acquire(account)
+        ok = False
+        try:
+            response = await self.transport.handle_async_request(request)
+            ok = response.status_code < 500
+            return response
+        finally:
+            now = time.monotonic()
+            self.total.add(now, ok)
+            self.hosts.setdefault(host, _Counters()).add(now, ok)
+            self.accounts.setdefault(account, _Counters()).add(now, ok)
+
+    def add_account(self, username, password, civilization, conn, server_id=9):
+        """Create the account's SessionManager on the shared pool. Returns it."""
+        session = SessionManager(username, password, civilization, conn, server_id,
+                                 transport=AccountTransport(self, username))
+        self.sessions[username] = session
+        return session
+
+    async def add_users(self, conn, civilization='roman', server_id=9):
+        """Add every account stored in the users table. Returns their SessionManagers."""
+        sessions = []
+        for (username,) in await run_db(conn, get_all_users):
+            user = await run_db(conn, get_user, username)
+            sessions.append(self.add_account(username, user[1], civilization, conn, server_id))
+        return sessions
+
+    async def login_all(self):
+        """Log every account in concurrently. Returns {username: True/False}."""
+        results = await asyncio.gather(*(session.get_cookies() for session in self.sessions.values()),
+                                       return_exceptions=True)
+        return {username: bool(result) and not isinstance(result, Exception)
+                for username, result in zip(self.sessions, results)}
+
+    def submit(self, username, name, coro):
+        """
+        Run a job for an account once a job slot is free.
+
+        Slots are granted round-robin across accounts, so every account's
+        queue makes progress. Returns the job's task.
+        """
+        async def job():
+            try:
+                async with self.jobs.slot(username):
+                    logger.info(f"[{username}] {name} started")
+                    with tracing.span(f"{username}:{name}", 'job', root=True), profiling.label(f"{username}:{name}"):
+                        return await coro
+            finally:
+                coro.close()  # No-op once it ran; avoids a never-awaited warning if cancelled while queued
+
+        task = asyncio.create_task(job(), name=f"{username}:{name}")
+        self.tasks.setdefault(username, set()).add(task)
+        task.add_done_callback(self.tasks[username].discard)
+        return task
+
+    async def join(self):
+        """Wait for every submitted job. Returns their results (exceptions included)."""
+        tasks = [task for tasks in self.tasks.values() for task in tasks]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self):
+        """Aggregate, per-host and per-account request counts and current rates."""
+        now = time.monotonic()
+        return {
+            'elapsed': now - self.started,
+            'total': self.total.summary(now),
+            'hosts': {host: counters.summary(now) for host, counters in self.hosts.items()},
+            'accounts': {
+                username: dict(self.accounts[username].summary(now) if username in self.accounts else {},
+                               running=self.jobs.held.get(username, 0),
+                               queued=self.jobs.waiters.waiting(username))
+                for username in self.sessions
+            },
+        }
+
+    async def close(self):
+        """Cancel running jobs, wait for them to unwind, then close every session and the shared pool."""
+        tasks = [task for tasks in self.tasks.values() for task in tasks]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for session in self.sessions.values():
+            await session.close()
+        await self.transport.aclose()
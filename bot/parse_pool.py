@@ -0,0 +1,154 @@
+# parse_pool.py
+"""
+Optional process pool for CPU-bound page parsing.
+
+With many requests in flight, BeautifulSoup parsing keeps one core busy
+while the others idle. When the pool is enabled, large pages are parsed in
+worker processes:
+
+- only the raw response bytes (and their encoding) go into the pool;
+- only the parser's compact records (lists of tuples) come back.
+
+Pages smaller than min_size stay in-process, on a thread. For those,
+pickling and the round trip to a worker cost more than the parse itself.
+Parsers must be module-level functions taking the page text, such as
+fetch_all_villages.parse_profile, so they can be pickled by reference.
+
+    parse_pool.enable(workers=4)
+    villages = await parse_pool.parse(parse_profile, response.content, response.encoding)
+
+The crawler uses parse() for statistics and profile pages. The bot and the
+daemon enable the pool when TBOT_PARSE_WORKERS is set (0 means one worker
+per core). Run `python -m bot.parse_pool` for a 1..N core scaling benchmark.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from . import tracing
+
+logger = logging.getLogger(__name__)
+
+SMALL_PAGE = 16 * 1024   # Bytes below which a page is parsed in-process
+
+_executor = None
+_workers = 0
+_min_size = SMALL_PAGE
+
+
+def _decode_and_parse(parser, content, encoding):
+    """Runs in the worker (or a thread): bytes in, records out."""
+    return parser(content.decode(encoding or 'utf-8', errors='replace'))
+
+
+def _warm():
+    return os.getpid()
+
+
+def enable(workers=None, min_size=SMALL_PAGE):
+    """
+    Start the worker processes (one per core if workers is None).
+
+    Workers are spawned rather than forked, since the bot has threads (the
+    DatabaseWriter, AsyncDatabase pools) that must not be copied. They are
+    started now, so the first pages do not wait for a cold start.
+    """
+    global _executor, _workers, _min_size
+    disable()
+    _workers = workers or os.cpu_count() or 1
+    _min_size = min_size
+    _executor = ProcessPoolExecutor(max_workers=_workers, mp_context=multiprocessing.get_context('spawn'))
+    for future in [_executor.submit(_warm) for _ in range(_workers)]:
+        future.result()
+    logger.info(f"Parse pool enabled with {_workers} workers (pages >= {min_size} bytes)")
+
+
+def enable_from_env(var='TBOT_PARSE_WORKERS'):
+    """Enable the pool if the environment variable is set; 0 means one worker per core."""
+    value = os.environ.get(var)
+    if value is None or not value.strip().isdigit():
+        return False
+    enable(int(value) or None)
+    return True
+
+
+def disable():
+    """Shut the worker processes down; parsing goes back to threads."""
+    global _executor, _workers
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+    _executor = None
+    _workers = 0
+
+
+def is_enabled():
+    return _executor is not None
+
+
+async def parse(parser, content, encoding='utf-8'):
+    """
+    Parse a page off the event loop.
+
+    Args:
+        parser: Module-level function taking the page text
+        content: Raw response bytes
+        encoding: Response encoding
+
+    Returns: whatever parser returns
+    """
+    with tracing.span(parser.__name__, 'parse', bytes=len(content)):
+        if _executor is None or len(content) < _min_size:
+            return await asyncio.to_thread(_decode_and_parse, parser, content, encoding)
+        return await asyncio.get_running_loop().run_in_executor(_executor, _decode_and_parse, parser, content, encoding)
+
+
+def sample_profile(villages=300):
+    """A player profile page about the size of a large account's, for benchmarks."""
+    rows = ''.join(
+        f'<tr><td class="nam"><a href="karte.php?d={100000 + i}">Village {i}</a> <span class="none">(capital)</span></td>'
+        f'<td class="hab">{100 + i % 900}</td><td class="tribe">Roman</td><td class="oases"></td>'
+        f'<td class="aligned_coords">({i % 401 - 200}|{i // 401 - 200})</td></tr>'
+        for i in range(villages))
+    chrome = '<div class="menu">' + '<a href="#">link</a>' * 200 + '</div>'
+    return (f'<html><head><title>Profile</title></head><body>{chrome}'
+            f'<table id="villages"><thead><tr><th>Name</th></tr></thead><tbody>{rows}</tbody></table>'
+            f'{chrome}</body></html>').encode()
+
+
+async def _bench(content, pages, workers):
+    if workers:
+        enable(workers, min_size=0)
+    else:
+        disable()
+    from .fetch_all_villages import parse_profile
+    start = time.perf_counter()
+    results = await asyncio.gather(*(parse(parse_profile, content) for _ in range(pages)))
+    elapsed = time.perf_counter() - start
+    assert all(len(result) == len(results[0]) for result in results)
+    disable()
+    return elapsed
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Profile-page parse throughput from 1 to N worker processes.")
+    parser.add_argument('--pages', type=int, default=400)
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--villages', type=int, default=300, help="Villages per sample profile page")
+    args = parser.parse_args()
+
+    content = sample_profile(args.villages)
+    print(f"{args.pages} pages of {len(content) / 1024:.0f} KiB, {os.cpu_count()} cores")
+    baseline = asyncio.run(_bench(content, args.pages, 0))
+    print(f"{'threads (no pool)':<20} {args.pages / baseline:>8.1f} pages/s")
+    counts = sorted({1, 2, 4, 8, 16, args.max_workers} & set(range(1, args.max_workers + 1)))
+    single = None
+    for workers in counts:
+        elapsed = asyncio.run(_bench(content, args.pages, workers))
+        single = single or elapsed
+        print(f"{f'{workers} workers':<20} {args.pages / elapsed:>8.1f} pages/s  x{single / elapsed:.2f}")
@@ -1,9 +1,14 @@
 import asyncio
+import contextlib
 import httpx
 from bs4 import BeautifulSoup
 from .database import save_task, save_stats
+from .async_db import run_db
 import logging
 import time
+from . import metrics, profiling
+from .telemetry import event_hooks, task_scope
+from .checkpoint import Checkpoint
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -11,8 +16,12 @@ logger = logging.getLogger(__name__)
 httpx_logger = logging.getLogger("httpx")
 httpx_logger.setLevel(logging.WARNING)
 
+PROGRESS_EVERY = 10  # Successes between progress callbacks
 
-async def increase_production_async(username, password, loops, conn, cookies=None, debug=False):
+
+@profiling.profiled
+async def increase_production_async(username, password, loops, conn, cookies=None, debug=False, run_name=None,
+                                    client=None, callback=None):
     """
     Increase production resources.
     
@@ -20,11 +29,15 @@ async def increase_production_async(username, password, loops, conn, cookies=Non
         username: Username for saving stats
         password: Password (kept for backwards compatibility, not used if cookies provided)
         loops: Number of times to increase production
-        conn: Database connection
+        conn: Database connection or AsyncDatabase
         cookies: Optional pre-authenticated cookies. If not provided, will login.
         debug: If True, print detailed response info
+        run_name: Name of the run; an unfinished run with this name is resumed
+                  from its last checkpoint instead of starting over
+        client: Optional shared AsyncClient (e.g. SessionManager.get_client()); it is left open
+        callback: Optional progress callback, called every PROGRESS_EVERY successes
     """
-    if cookies is None:
+    if cookies is None and client is None:
         from .session_manager import SessionManager
         session_manager = SessionManager(username, password, '', conn)
         cookies = await session_manager.get_cookies()
@@ -42,18 +55,26 @@ async def increase_production_async(username, password, loops, conn, cookies=Non
     }
 
     # Use follow_redirects=False so we can detect success via 302
-    async with httpx.AsyncClient(cookies=cookies, headers=headers, follow_redirects=False) as client:
-        completed = 0
+    if client is not None:
+        client_context = contextlib.nullcontext(client)
+    else:
+        client_context = httpx.AsyncClient(cookies=cookies, headers=headers, follow_redirects=False, event_hooks=event_hooks())
+    async with client_context as client, \
+            task_scope('production'), \
+            Checkpoint(conn, run_name, username, 'production', loops) as checkpoint:
+        resumed_from = checkpoint.completed
         start_time = time.time()
         
-        for i in range(loops):
+        for i in range(checkpoint.remaining):
             # Get fresh key
-            get_response = await client.get("https://fun.gotravspeed.com/buy2.php?t=0")
+            get_response = await client.get("https://fun.gotravspeed.com/buy2.php?t=0", headers=headers)
             soup = BeautifulSoup(get_response.text, 'html.parser')
             key_element = soup.find('input', {'name': 'key'})
 
             if key_element is None:
                 logger.error("Failed to find key for production. Retrying...")
+                metrics.shop_purchase('production', False)
+                await checkpoint.step(False)
                 await asyncio.sleep(0.5)
                 continue
 
@@ -69,27 +90,37 @@ async def increase_production_async(username, password, loops, conn, cookies=Non
             }
             
             response = await client.post(
-                "https://fun.gotravspeed.com/buy2.php?t=0&Shop=done", 
-                data=data
+                "https://fun.gotravspeed.com/buy2.php?t=0&Shop=done",
+                data=data,
+                headers=headers,
+                follow_redirects=False
             )
             
             # 302 redirect means SUCCESS!
             if response.status_code == 302:
-                completed += 1
+                metrics.shop_purchase('production', True)
+                await checkpoint.step(True)
                 end_time = time.time()
                 elapsed_time = end_time - start_time
-                speed = completed / elapsed_time if elapsed_time > 0 else 0
-                logger.info(f"✅ Production Increased - {completed}/{loops} - ({speed:.2f}/sec)")
+                speed = (checkpoint.completed - resumed_from) / elapsed_time if elapsed_time > 0 else 0
+                logger.info(f"✅ Production Increased - {checkpoint.completed}/{checkpoint.requested} - ({speed:.2f}/sec)")
+                if callback and checkpoint.completed % PROGRESS_EVERY == 0:
+                    callback(f"Production: {checkpoint.completed}/{checkpoint.requested} ({speed:.2f}/sec)")
             else:
                 # Check for success message in response
                 soup = BeautifulSoup(response.text, 'html.parser')
                 success = soup.find('span', class_='succes')
                 if success and 'You got' in success.text:
-                    completed += 1
-                    logger.info(f"✅ Production Increased - {completed}/{loops}")
+                    metrics.shop_purchase('production', True)
+                    await checkpoint.step(True)
+                    logger.info(f"✅ Production Increased - {checkpoint.completed}/{checkpoint.requested}")
                 else:
+                    metrics.shop_purchase('production', False)
+                    await checkpoint.step(False)
                     logger.warning(f"⚠️ Request may have failed - status {response.status_code}")
 
-        save_task(conn, username, 'production', loops)
-        save_stats(conn, username, 'production', loops, completed)
-        logger.info(f"Production increase completed. Success: {completed}/{loops}")
+        await run_db(conn, save_task, username, 'production', checkpoint.requested)
+        await run_db(conn, save_stats, username, 'production', checkpoint.requested, checkpoint.completed)
+        logger.info(f"Production increase completed. Success: {checkpoint.completed}/{checkpoint.requested}")
+        if callback:
+            callback(f"Production increase completed. Success: {checkpoint.completed}/{checkpoint.requested}")
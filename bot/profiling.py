@@ -0,0 +1,317 @@
+# profiling.py
+"""
+Sampling profiler that understands asyncio.
+
+A sampler thread looks at every thread's stack every INTERVAL seconds and
+keeps two profiles per task:
+- cpu: the stacks that were running, weighted by the CPU time their thread
+  used since the previous sample (per-thread CPU clocks, where available);
+- wall: where each of the task's coroutines was, weighted by the interval.
+  Suspended coroutines are walked down their await chain, so time spent in
+  an await on a request, a sleep or a lock shows up against the line that
+  awaited it.
+
+Tasks are the coroutines decorated with @profiled (apply_preset,
+find_empty_spots, the shop loops, ...), TaskManager tasks and daemon jobs.
+Tasks they start inherit their label, and the outermost label wins.
+Event loop time outside any task is labelled 'main'. Work running on other
+threads (to_thread parses, AsyncDatabase, the DatabaseWriter) goes into a
+'threads' profile keyed by thread name.
+
+On stop, write() saves into the output directory, for each label:
+- <label>.cpu.collapsed and <label>.wall.collapsed: collapsed stacks
+  ("frame;frame;frame microseconds") for flamegraph.pl, speedscope or
+  inferno;
+- <label>.txt: the functions with the most self and total time.
+
+    asyncio.run(profiling.run(main(), 'profiles'))
+
+The CLI (tbot --profile [DIR]) and tbot-daemon (--profile DIR) use run().
+"""
+
+import asyncio
+import functools
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import weakref
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+INTERVAL = 0.01          # Seconds between samples
+PROFILE_DIR = 'profiles'
+MAX_DEPTH = 128          # Frames kept per stack
+TOP_FUNCTIONS = 25       # Functions listed per table in the .txt summaries
+
+_labels = weakref.WeakKeyDictionary()   # Task -> stack of labels
+_profiler = None
+
+
+def _frame_name(code):
+    path = code.co_filename.replace('\\', '/').split('/')
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+
+
+def _thread_stack(frame):
+    """Stack of a thread, outermost first, starting below the event loop's callback runner."""
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        code = frame.f_code
+        if code.co_name == '_run' and code.co_filename.endswith(os.path.join('asyncio', 'events.py')):
+            break
+        names.append(_frame_name(code))
+        frame = frame.f_back
+    return tuple(reversed(names))
+
+
+def _await_stack(task):
+    """Where a suspended task is: its coroutine chain, then what the innermost one awaits."""
+    names = []
+    awaitable = task.get_coro()
+    while awaitable is not None and len(names) < MAX_DEPTH:
+        frame = getattr(awaitable, 'cr_frame', None) or getattr(awaitable, 'gi_frame', None)
+        if frame is None:
+            break
+        names.append(_frame_name(frame.f_code))
+        awaitable = getattr(awaitable, 'cr_await', None) or getattr(awaitable, 'gi_yieldfrom', None)
+    if awaitable is not None:
+        names.append(f"[await {type(awaitable).__name__}]")
+    return tuple(names)
+
+
+def _cpu_clock(ident):
+    """Per-thread CPU clock, or None where the platform has none."""
+    try:
+        return time.pthread_getcpuclockid(ident)
+    except (AttributeError, OSError):
+        return None
+
+
+def _label(task):
+    labels = _labels.get(task) if task is not None else None
+    return labels[0] if labels else None
+
+
+class ProfileLabel:
+    """Context manager labelling the current task (and the tasks it starts)."""
+
+    def __init__(self, name):
+        self.name = name
+        self.task = None
+
+    def __enter__(self):
+        if _profiler is not None:
+            self.task = asyncio.current_task()
+            if self.task is not None:
+                _labels.setdefault(self.task, []).append(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        if self.task is not None:
+            labels = _labels.get(self.task)
+            if labels:
+                labels.pop()
+
+
+def label(name):
+    """Attribute the current task's samples to `name` while the block runs."""
+    return ProfileLabel(name)
+
+
+def profiled(fn):
+    """Decorator: profile an async function as its own task while the profiler runs."""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        with label(fn.__name__):
+            return await fn(*args, **kwargs)
+    return wrapper
+
+
+async def labelled(name, coro):
+    """Await coro under a label (for tasks started with create_task)."""
+    with label(name):
+        return await coro
+
+
+class Profiler:
+    """
+    Samples the event loop thread and every other thread.
+
+    Args:
+        loop: The event loop whose tasks are profiled
+        interval: Seconds between samples
+    """
+
+    def __init__(self, loop, interval=INTERVAL):
+        self.loop = loop
+        self.interval = interval
+        self.loop_thread = threading.get_ident()
+        self.cpu = {}          # label -> Counter(stack -> microseconds)
+        self.wall = {}
+        self.threads = Counter()
+        self.samples = 0
+        self.clocks = {}       # thread ident -> (clock id, last reading)
+        self.started = None
+        self.stopping = threading.Event()
+        self.thread = None
+        self.previous_factory = None
+
+    def _task_factory(self, loop, coro, **kwargs):
+        if self.previous_factory is not None:
+            task = self.previous_factory(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        parent = _label(asyncio.current_task(loop))
+        if parent is not None:
+            _labels[task] = [parent]
+        return task
+
+    def start(self):
+        self.previous_factory = self.loop.get_task_factory()
+        self.loop.set_task_factory(self._task_factory)
+        self.started = time.perf_counter()
+        self.thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.loop.set_task_factory(self.previous_factory)
+
+    def _run(self):
+        while not self.stopping.wait(self.interval):
+            try:
+                self._sample()
+            except Exception as e:  # A task or frame finished under us; skip the sample
+                logger.debug(f"Profiler sample skipped: {e}")
+
+    def _cpu_used(self, ident):
+        """Microseconds of CPU the thread used since its last sample (None without CPU clocks)."""
+        entry = self.clocks.get(ident)
+        if entry is None:
+            clock = _cpu_clock(ident)
+            if clock is None:
+                return None
+            self.clocks[ident] = (clock, time.clock_gettime(clock))
+            return 0
+        clock, last = entry
+        try:
+            now = time.clock_gettime(clock)
+        except OSError:
+            return 0
+        self.clocks[ident] = (clock, now)
+        return int((now - last) * 1e6)
+
+    def _sample(self):
+        me = threading.get_ident()
+        wall = int(self.interval * 1e6)
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        running = asyncio.current_task(self.loop)
+        self.samples += 1
+
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = _thread_stack(frame)
+            used = self._cpu_used(ident)
+            used = wall if used is None else used
+            if ident == self.loop_thread:
+                name = _label(running) or 'main'
+                if running is not None:
+                    self.wall.setdefault(name, Counter())[stack] += wall
+                if used:
+                    self.cpu.setdefault(name, Counter())[stack] += used
+            elif used:
+                self.threads[(names.get(ident, str(ident)),) + stack] += used
+
+        for task in asyncio.all_tasks(self.loop):
+            name = _label(task)
+            if name is not None and task is not running:
+                self.wall.setdefault(name, Counter())[_await_stack(task)] += wall
+
+    def profiles(self):
+        """{(label, kind): Counter(stack -> microseconds)}, with other threads as ('threads', 'cpu')."""
+        profiles = {(name, 'cpu'): stacks for name, stacks in self.cpu.items()}
+        profiles.update({(name, 'wall'): stacks for name, stacks in self.wall.items()})
+        if self.threads:
+            profiles[('threads', 'cpu')] = self.threads
+        return profiles
+
+    def write(self, directory=PROFILE_DIR):
+        """Write the collapsed stacks and summaries. Returns the paths written."""
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        summaries = {}
+        for (name, kind), stacks in sorted(self.profiles().items()):
+            base = os.path.join(directory, re.sub(r'[^\w.-]+', '_', name))
+            path = f"{base}.{kind}.collapsed"
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, micros in stacks.most_common():
+                    if stack and micros:
+                        f.write(f"{';'.join(stack)} {micros}\n")
+            paths.append(path)
+            summaries.setdefault(base, []).append((kind, stacks))
+        for base, profiles in summaries.items():
+            path = f"{base}.txt"
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(summarize(profiles, time.perf_counter() - self.started, self.samples))
+            paths.append(path)
+        return paths
+
+
+def summarize(profiles, elapsed, samples):
+    """Text tables of the functions with the most self and total time in each profile."""
+    lines = [f"{samples} samples over {elapsed:.1f}s"]
+    for kind, stacks in profiles:
+        total = sum(stacks.values()) or 1
+        own, inclusive = Counter(), Counter()
+        for stack, micros in stacks.items():
+            if not stack:
+                continue
+            own[stack[-1]] += micros
+            for name in set(stack):
+                inclusive[name] += micros
+        for title, counter in (('self', own), ('total', inclusive)):
+            lines.append(f"\n{kind} time, by {title} ({total / 1e6:.2f}s sampled)")
+            for name, micros in counter.most_common(TOP_FUNCTIONS):
+                lines.append(f"  {micros / 1e6:>9.2f}s {micros / total:>6.1%}  {name}")
+    return '\n'.join(lines) + '\n'
+
+
+def start(interval=INTERVAL):
+    """Start profiling the running event loop. Returns the Profiler."""
+    global _profiler
+    _profiler = Profiler(asyncio.get_running_loop(), interval)
+    _profiler.start()
+    logger.info(f"Profiling every {interval * 1000:.0f} ms")
+    return _profiler
+
+
+def stop(directory=PROFILE_DIR):
+    """Stop profiling and write the dumps. Returns the paths written."""
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is None:
+        return []
+    profiler.stop()
+    paths = profiler.write(directory)
+    logger.info(f"Profiles written to {directory}/ ({len(paths)} files)")
+    return paths
+
+
+def is_enabled():
+    return _profiler is not None
+
+
+async def run(coro, directory=PROFILE_DIR, interval=INTERVAL):
+    """Await coro with the profiler running, then write the dumps to directory."""
+    start(interval)
+    try:
+        return await coro
+    finally:
+        stop(directory)
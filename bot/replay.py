@@ -0,0 +1,299 @@
+# replay.py
+"""
+Record game traffic to a fixture archive and serve it back offline.
+
+Recording: while enabled, every request made by a client with
+telemetry.event_hooks() (that is, every client the bot creates) is
+appended to the archive with its response and latency. Before anything is
+written:
+- Cookie, Authorization and Set-Cookie headers are dropped;
+- form fields such as password are replaced with REDACTED;
+- the logged-in accounts' usernames and passwords are replaced wherever
+  they appear.
+
+The archive is JSON lines, gzipped when the path ends in .gz.
+
+Replay: ReplayTransport serves an archive to httpx. A request gets the
+next recorded response for the same method, host, path and query,
+falling back to the same path with any query. Responses for one key are
+served in recorded order and cycle, so a 50-request recording can drive
+a 50k-loop benchmark. Latency is the recorded one (scaled), or fixed,
+plus jitter.
+
+    TBOT_RECORD=fixtures/fun.jsonl.gz tbot        # record a session
+
+    transport = ReplayTransport('fixtures/fun.jsonl.gz', scale=0.5, jitter=0.2)
+    async with httpx.AsyncClient(transport=transport) as client:
+        ...
+    with replay.installed(transport):             # for code that builds its own clients
+        await apply_preset(cookies, server_url, preset)
+
+`python -m bot.replay <archive>` summarizes an archive.
+"""
+
+import asyncio
+import atexit
+import base64
+import contextlib
+import gzip
+import json
+import logging
+import os
+import random
+import statistics
+import threading
+import time
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+SECRET_FIELDS = ('password', 'pw', 'name')     # Form fields never written to an archive
+SECRET_HEADERS = ('cookie', 'authorization', 'set-cookie')
+DROPPED_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding', 'connection')  # Bodies are stored decoded
+REDACTED = 'REDACTED'
+
+_recorder = None
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def load(path):
+    """All entries of an archive, in recorded order."""
+    with _open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _headers(headers):
+    return {name: value for name, value in headers.items()
+            if name.lower() not in SECRET_HEADERS and name.lower() not in DROPPED_HEADERS}
+
+
+class Recorder:
+    """
+    Appends sanitized request/response pairs to an archive.
+
+    Args:
+        path: Archive path (.jsonl or .jsonl.gz)
+        redact: Strings (usernames, passwords) replaced with REDACTED everywhere
+    """
+
+    def __init__(self, path, redact=()):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.secrets = {value for value in redact if value}
+        self.lock = threading.Lock()
+        self.file = _open(path, 'w')
+        self.count = 0
+
+    def _scrub(self, text):
+        for secret in self.secrets:
+            text = text.replace(secret, REDACTED)
+        return text
+
+    def _form(self, request):
+        body = request.content.decode('utf-8', errors='replace')
+        if 'application/x-www-form-urlencoded' not in request.headers.get('content-type', ''):
+            return self._scrub(body)
+        fields = httpx.QueryParams(body)
+        return self._scrub(str(httpx.QueryParams([(key, REDACTED if key.lower() in SECRET_FIELDS else value)
+                                                  for key, value in fields.multi_items()])))
+
+    def add(self, response, elapsed):
+        """Write one finished response (its body must have been read)."""
+        request = response.request
+        entry = {
+            'method': request.method,
+            'url': self._scrub(str(request.url)),
+            'request_headers': _headers(request.headers),
+            'request_body': self._form(request) if request.content else '',
+            'status': response.status_code,
+            'headers': _headers(response.headers),
+            'elapsed': round(elapsed, 6),
+            'time': time.time(),
+        }
+        try:
+            entry['body'] = self._scrub(response.content.decode('utf-8'))
+        except UnicodeDecodeError:
+            entry['body_b64'] = base64.b64encode(response.content).decode('ascii')
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        with self.lock:
+            if self.file is not None:
+                self.file.write(line)
+                self.count += 1
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def start_recording(path, redact=()):
+    """Record every hooked request to path until stop_recording()."""
+    global _recorder
+    stop_recording()
+    _recorder = Recorder(path, redact)
+    logger.info(f"Recording requests to {path}")
+    return _recorder
+
+
+def stop_recording():
+    """Close the archive. Returns the number of entries written."""
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder is None:
+        return 0
+    recorder.close()
+    logger.info(f"Recorded {recorder.count} requests to {recorder.path}")
+    return recorder.count
+
+
+def enable_from_env(var='TBOT_RECORD'):
+    """Start recording if the environment variable holds an archive path. Returns True if started."""
+    path = os.environ.get(var, '').strip()
+    if not path:
+        return False
+    start_recording(path)
+    atexit.register(stop_recording)
+    return True
+
+
+def is_recording():
+    return _recorder is not None
+
+
+def redact(*values):
+    """Never write these strings (an account's username and password) to the archive."""
+    if _recorder is not None:
+        _recorder.secrets.update(value for value in values if value)
+
+
+def record(response, elapsed):
+    """Called from the telemetry response hook once the body has been read."""
+    if _recorder is not None:
+        _recorder.add(response, elapsed)
+
+
+def _route(method, url):
+    return method, url.host, url.path, tuple(sorted(url.params.multi_items()))
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """
+    Serves recorded responses.
+
+    Args:
+        archive: Archive path, or a list of entries
+        latency: Fixed seconds per response (default: each entry's recorded latency)
+        scale: Multiplier for recorded latencies
+        jitter: Random +/- fraction applied to every delay
+        strict: Raise on requests with no recording instead of answering 404
+        seed: Seed for the jitter, for repeatable runs
+    """
+
+    def __init__(self, archive, latency=None, scale=1.0, jitter=0.0, strict=False, seed=None):
+        entries = load(archive) if isinstance(archive, str) else list(archive)
+        self.latency = latency
+        self.scale = scale
+        self.jitter = jitter
+        self.strict = strict
+        self.random = random.Random(seed)
+        self.routes = {}
+        self.paths = {}
+        for entry in entries:
+            url = httpx.URL(entry['url'])
+            self.routes.setdefault(_route(entry['method'], url), []).append(entry)
+            self.paths.setdefault((entry['method'], url.host, url.path), []).append(entry)
+        self.positions = {}
+        self.served = 0
+        self.misses = 0
+
+    def _next(self, key, entries):
+        position = self.positions.get(key, 0)
+        self.positions[key] = position + 1
+        return entries[position % len(entries)]
+
+    def match(self, request):
+        """The recorded entry to answer request with, or None."""
+        key = _route(request.method, request.url)
+        if key in self.routes:
+            return self._next(key, self.routes[key])
+        path = key[:3]
+        if path in self.paths:
+            return self._next(path, self.paths[path])
+        return None
+
+    def delay(self, entry):
+        delay = self.latency if self.latency is not None else entry.get('elapsed', 0) * self.scale
+        if self.jitter:
+            delay *= 1 + self.random.uniform(-self.jitter, self.jitter)
+        return max(delay, 0.0)
+
+    async def handle_async_request(self, request):
+        await request.aread()
+        entry = self.match(request)
+        if entry is None:
+            self.misses += 1
+            if self.strict:
+                raise httpx.ConnectError(f"No recording for {request.method} {request.url}", request=request)
+            logger.warning(f"No recording for {request.method} {request.url}")
+            return httpx.Response(404, request=request)
+
+        await asyncio.sleep(self.delay(entry))
+        self.served += 1
+        if 'body_b64' in entry:
+            content = base64.b64decode(entry['body_b64'])
+        else:
+            content = entry.get('body', '').encode('utf-8')
+        return httpx.Response(entry['status'], headers=entry.get('headers', {}), content=content, request=request)
+
+
+@contextlib.contextmanager
+def installed(transport):
+    """
+    Make transport the default of every AsyncClient created inside the block.
+
+    For replaying code that builds its own clients (presets, map scans);
+    clients given an explicit transport keep it.
+    """
+    original = httpx.AsyncClient.__init__
+
+    def __init__(self, *args, **kwargs):
+        if kwargs.get('transport') is None:
+            kwargs['transport'] = transport
+        original(self, *args, **kwargs)
+
+    httpx.AsyncClient.__init__ = __init__
+    try:
+        yield transport
+    finally:
+        httpx.AsyncClient.__init__ = original
+
+
+def summarize(entries):
+    """Entries, statuses and median recorded latency per method and path."""
+    groups = {}
+    for entry in entries:
+        url = httpx.URL(entry['url'])
+        group = groups.setdefault((entry['method'], url.host, url.path), {'count': 0, 'statuses': {}, 'elapsed': []})
+        group['count'] += 1
+        group['statuses'][entry['status']] = group['statuses'].get(entry['status'], 0) + 1
+        group['elapsed'].append(entry.get('elapsed', 0))
+    for group in groups.values():
+        group['median_ms'] = statistics.median(group.pop('elapsed')) * 1000
+    return groups
+
+
+if __name__ == "__main__":
+    import sys
+
+    for (method, host, path), group in sorted(summarize(load(sys.argv[1])).items()):
+        statuses = ', '.join(f"{status}x{count}" for status, count in sorted(group['statuses'].items()))
+        print(f"{method:<5} {host}{path:<24} {group['count']:>6}  {group['median_ms']:>7.1f} ms  {statuses}")
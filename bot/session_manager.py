@@ -5,6 +5,9 @@ import logging
 import asyncio
 from bs4 import BeautifulSoup
 from .database import save_user
+from .async_db import run_db
+from . import replay
+from .telemetry import event_hooks
 
 INITIAL_BASE_URL = "https://gotravspeed.com"
 HEADERS = {
@@ -33,6 +36,9 @@ SERVERS = {
     32: {'name': 'Netus', 'url': 'https://netus.gotravspeed.com', 'speed': '20M'},
 }
 
+# Connection pool size for the shared in-game client
+MAX_CONNECTIONS = 32
+
 logger = logging.getLogger(__name__)
 
 
@@ -41,14 +47,18 @@ class SessionManager:
     Manages login sessions and cookies for the application.
     """
 
-    def __init__(self, username, password, civilization, conn, server_id=9):
+    def __init__(self, username, password, civilization, conn, server_id=9, transport=None):
         self.username = username
         self.password = password
+        replay.redact(username, password)
         self.civilization = civilization
         self.conn = conn
         self.cookies = None
+        self.client = None
         self.server_id = server_id
         self.server_url = SERVERS.get(server_id, SERVERS[9])['url']
+        # Optional shared transport (see orchestrator.py); None gives each client its own pool
+        self.transport = transport
 
     async def login(self, retries=3):
         """
@@ -57,7 +67,8 @@ class SessionManager:
         """
         for attempt in range(retries):
             try:
-                async with httpx.AsyncClient(follow_redirects=True, timeout=30.0) as client:
+                async with httpx.AsyncClient(follow_redirects=True, timeout=30.0, transport=self.transport,
+                                             event_hooks=event_hooks()) as client:
                     response = await client.get(INITIAL_BASE_URL, headers=HEADERS)
                     response.raise_for_status()
 
@@ -93,8 +104,10 @@ class SessionManager:
                     response.raise_for_status()
 
                     logger.info(f"Successfully logged in to server {SERVERS.get(self.server_id, {}).get('name', self.server_id)}")
-                    save_user(self.conn, self.username, self.password)
+                    await run_db(self.conn, save_user, self.username, self.password)
                     self.cookies = client.cookies
+                    if self.client is not None:
+                        self.client.cookies = self.cookies
 
                     return self.cookies
                     
@@ -131,6 +144,26 @@ class SessionManager:
         if self.cookies is None:
             self.cookies = await self.login()
         return self.cookies
+
+    async def get_client(self):
+        """
+        Return a pooled client bound to this session's cookies.
+        The client is created on first use and reused until close().
+        """
+        if self.client is None or self.client.is_closed:
+            cookies = await self.get_cookies()
+            limits = httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS)
+            self.client = httpx.AsyncClient(cookies=cookies, headers=HEADERS, timeout=30.0, limits=limits,
+                                            event_hooks=event_hooks(), transport=self.transport)
+        return self.client
+
+    async def close(self):
+        """
+        Close the pooled client, if one was opened.
+        """
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
     
     @staticmethod
     async def fetch_servers(username: str, password: str):
@@ -4,6 +4,7 @@ Village settling module for Travian.
 
 Features:
 - CP requirements table
+- CP extraction and next-village projection
 - Celebration logic (Town Hall)
 - Build Residence if needed
 - Train settlers
@@ -12,13 +13,22 @@ Features:
 """
 
 import asyncio
+import contextlib
+import html as html_lib
 import httpx
 import logging
+import re
+from datetime import datetime, timedelta
 from bs4 import BeautifulSoup
+from . import profiling
+from .telemetry import event_hooks
+from .troop_inventory import check_troops
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
+SETTLER = 10  # Troop index of settlers for every tribe
+
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36',
     'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9',
@@ -80,47 +90,148 @@ def get_required_cp(village_count: int) -> int:
     return int(2434700 * (1.03 ** (next_village - 40)))
 
 
+# Pages that show culture points, tried in order
+CP_PAGES = [
+    "spieler.php",
+    "build.php?gid=25&s=2",  # Residence - culture points tab
+    "build.php?gid=26&s=2",  # Palace - culture points tab
+]
+
+_TAG_RE = re.compile(r'<[^>]+>')
+_NUMBER = r'(\d[\d,.]*)'
+# Total CP produced so far ("Your villages have produced 1,234 points in total")
+_CP_TOTAL_RES = [
+    re.compile(r'produced\s+' + _NUMBER + r'\s+(?:culture\s+)?points', re.IGNORECASE),
+    re.compile(r'culture\s+points?\s*:?\s*' + _NUMBER, re.IGNORECASE),
+]
+# Account-wide CP per day ("Production of all villages: 56 Culture points per day")
+_CP_DAILY_RES = [
+    re.compile(r'all\s+villages\s*:?\s*' + _NUMBER, re.IGNORECASE),
+    re.compile(r'points?\s+per\s+day\s*:\s*' + _NUMBER, re.IGNORECASE),
+    re.compile(_NUMBER + r'\s+(?:culture\s+)?points?\s+per\s+day', re.IGNORECASE),
+]
+# CP needed for the next village ("To found or conquer a new village you need 2,600 points")
+_CP_REQUIRED_RE = re.compile(r'you\s+need\s+' + _NUMBER + r'\s+(?:culture\s+)?points', re.IGNORECASE)
+
+
+_THOUSANDS_DOT_RE = re.compile(r'\.(?=\d{3}(?!\d))')
+
+
+def _to_int(number: str) -> int:
+    """Parse '2,600', '2.600' or '56.5' (rounded); a '.' is a thousands separator only before exactly three digits."""
+    number = _THOUSANDS_DOT_RE.sub('', number.replace(',', '')).rstrip('.')
+    return round(float(number))
+
+
+def parse_culture_points(html: str) -> dict:
+    """
+    Extract culture point figures from a page.
+
+    Runs a handful of anchored patterns over the page text once, instead of
+    matching every element.
+
+    Returns: dict with 'current', 'per_day' and 'required' (None when not shown)
+    """
+    text = html_lib.unescape(_TAG_RE.sub(' ', html))
+    text = re.sub(r'\s+', ' ', text)
+
+    def first(patterns):
+        for pattern in patterns:
+            match = pattern.search(text)
+            if match:
+                return _to_int(match.group(1))
+        return None
+
+    return {
+        'current': first(_CP_TOTAL_RES),
+        'per_day': first(_CP_DAILY_RES),
+        'required': first([_CP_REQUIRED_RE]),
+    }
+
+
+def count_villages(html: str) -> int:
+    """Count the rows of the village table on profile.php."""
+    soup = BeautifulSoup(html, 'html.parser')
+    return len(soup.select('#villages tbody tr'))
+
+
+def project_next_village(current_cp: int, cp_per_day: int, village_count: int,
+                         required_cp: int = None, now: datetime = None):
+    """
+    Project when the next village unlocks.
+
+    Args:
+        current_cp: Culture points produced so far
+        cp_per_day: Account-wide culture point production
+        village_count: Villages currently owned
+        required_cp: CP needed as shown by the game (defaults to CP_REQUIREMENTS)
+        now: Reference time (defaults to now)
+
+    Returns: datetime when enough CP is reached, or None if production is zero
+    """
+    now = now or datetime.now()
+    if required_cp is None:
+        required_cp = get_required_cp(village_count)
+    if current_cp >= required_cp:
+        return now
+    if not cp_per_day or cp_per_day <= 0:
+        return None
+    return now + timedelta(days=(required_cp - current_cp) / cp_per_day)
+
+
+async def get_cp_status(client, server_url: str) -> dict:
+    """
+    Fetch culture points, production and village count, and project the next village.
+
+    Returns: dict with 'current', 'per_day', 'villages', 'required' and 'next_village_at'
+    """
+    cp = {'current': None, 'per_day': None, 'required': None}
+    for page in CP_PAGES:
+        response = await client.get(f"{server_url}/{page}")
+        if response.status_code != 200:
+            continue
+        found = parse_culture_points(response.text)
+        for key, value in found.items():
+            if cp[key] is None:
+                cp[key] = value
+        if cp['current'] is not None and cp['per_day'] is not None:
+            break
+
+    response = await client.get(f"{server_url}/profile.php")
+    village_count = max(1, count_villages(response.text))
+
+    current = cp['current'] or 0
+    per_day = cp['per_day'] or 0
+    required = cp['required'] or get_required_cp(village_count)
+
+    return {
+        'current': current,
+        'per_day': per_day,
+        'villages': village_count,
+        'required': required,
+        'next_village_at': project_next_village(current, per_day, village_count, required),
+    }
+
+
 async def get_current_cp(client, server_url: str) -> tuple:
     """
     Get current CP and CP production from the game.
     
     Returns: (current_cp, cp_production_per_day, village_count)
     """
-    # Check profile or statistics page for CP info
-    response = await client.get(f"{server_url}/spieler.php")
-    soup = BeautifulSoup(response.text, 'html.parser')
-    
-    current_cp = 0
-    cp_production = 0
-    village_count = 0
-    
-    # Look for CP display
-    # Usually shown as "Culture Points: X/Y" or similar
-    for td in soup.find_all(['td', 'span', 'div']):
-        text = td.text.lower()
-        if 'culture' in text or 'cp' in text or 'kulturpunkt' in text:
-            # Try to extract numbers
-            import re
-            numbers = re.findall(r'[\d,]+', text)
-            if numbers:
-                current_cp = int(numbers[0].replace(',', ''))
-                if len(numbers) > 1:
-                    cp_production = int(numbers[1].replace(',', ''))
-    
-    # Count villages
-    village_links = soup.find_all('a', href=lambda x: x and 'village' in str(x).lower())
-    village_count = len(set([v.get('href') for v in village_links if v.get('href')]))
-    
-    # If we couldn't find village count, try profile
-    if village_count == 0:
-        response = await client.get(f"{server_url}/profile.php")
-        soup = BeautifulSoup(response.text, 'html.parser')
-        village_table = soup.find('table', {'id': 'villages'})
-        if village_table:
-            rows = village_table.find_all('tr')
-            village_count = max(1, len(rows) - 1)  # Subtract header
-    
-    return current_cp, cp_production, max(1, village_count)
+    status = await get_cp_status(client, server_url)
+    return status['current'], status['per_day'], status['villages']
+
+
+def format_projection(status: dict) -> str:
+    """Human-readable ETA for the next village from a get_cp_status() result."""
+    eta = status['next_village_at']
+    if eta is None:
+        return "No CP production - next village cannot be projected"
+    if status['current'] >= status['required']:
+        return "Next village available now"
+    remaining = str(eta - datetime.now()).split('.')[0]
+    return f"Next village at {eta:%Y-%m-%d %H:%M} (in {remaining})"
 
 
 async def run_celebration(client, server_url: str, callback=None) -> bool:
@@ -201,14 +312,15 @@ async def check_and_celebrate(cookies, server_url: str, callback=None) -> bool:
     
     Returns: True if we have enough CP (or started celebration)
     """
-    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS) as client:
-        current_cp, cp_prod, village_count = await get_current_cp(client, server_url)
-        required_cp = get_required_cp(village_count)
+    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS, event_hooks=event_hooks()) as client:
+        status = await get_cp_status(client, server_url)
+        current_cp, village_count, required_cp = status['current'], status['villages'], status['required']
         
         if callback:
-            callback(f"Current CP: {current_cp:,}")
+            callback(f"Current CP: {current_cp:,} (+{status['per_day']:,}/day)")
             callback(f"Villages: {village_count}")
             callback(f"Required for village {village_count + 1}: {required_cp:,}")
+            callback(format_projection(status))
         
         if current_cp >= required_cp:
             if callback:
@@ -272,6 +384,7 @@ async def check_if_empty(client, server_url: str, village_id: int) -> bool:
         return False
 
 
+@profiling.profiled
 async def find_empty_spots(cookies, server_url: str, center_village_id: int = 160801, 
                            max_spots: int = 10, max_radius: int = 15, callback=None):
     """
@@ -291,7 +404,7 @@ async def find_empty_spots(cookies, server_url: str, center_village_id: int = 16
     spots = []
     ids_to_check = generate_spiral_ids(center_village_id, max_villages=500, max_radius=max_radius)
     
-    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS) as client:
+    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS, event_hooks=event_hooks()) as client:
         for i, vid in enumerate(ids_to_check):
             if len(spots) >= max_spots:
                 break
@@ -322,26 +435,21 @@ async def get_coordinates_from_id(village_id: int) -> tuple:
     return (x, y)
 
 
-async def check_settlers_available(client, server_url: str, residence_pos: int) -> int:
-    """Check how many settlers are available in Residence/Palace."""
-    response = await client.get(f"{server_url}/build.php?id={residence_pos}")
-    soup = BeautifulSoup(response.text, 'html.parser')
-    
-    # Look for settler count in the troops available
-    settlers = 0
-    for elem in soup.find_all(['td', 'span', 'div']):
-        text = elem.text.lower()
-        if 'settler' in text:
-            import re
-            numbers = re.findall(r'\d+', text)
-            if numbers:
-                settlers = int(numbers[0])
-                break
-    
-    return settlers
+async def check_settlers_available(client, server_url: str, village_id=None, inventory=None) -> int:
+    """
+    Check how many settlers are at home, from the rally point.
+
+    Uses the cached TroopInventory if one is given.
+    """
+    if inventory is not None:
+        home = await inventory.home(village_id)
+    else:
+        home = (await check_troops(client, server_url, village_id)).home
+    return home.get(SETTLER, 0)
 
 
-async def smart_settle(cookies, server_url: str, callback=None):
+@profiling.profiled
+async def smart_settle(cookies, server_url: str, callback=None, client=None):
     """
     Smart settling with all checks:
     1. Check CP - run celebration if needed
@@ -354,8 +462,13 @@ async def smart_settle(cookies, server_url: str, callback=None):
         cookies: Session cookies
         server_url: Server URL
         callback: Progress callback
+        client: Optional shared AsyncClient (e.g. SessionManager.get_client()); it is left open
     """
-    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS) as client:
+    if client is not None:
+        client_context = contextlib.nullcontext(client)
+    else:
+        client_context = httpx.AsyncClient(cookies=cookies, headers=HEADERS, event_hooks=event_hooks())
+    async with client_context as client:
         if callback:
             callback("=== SMART SETTLE ===")
         
@@ -363,11 +476,11 @@ async def smart_settle(cookies, server_url: str, callback=None):
         if callback:
             callback("Step 1: Checking Culture Points...")
         
-        current_cp, cp_prod, village_count = await get_current_cp(client, server_url)
-        required_cp = get_required_cp(village_count)
+        status = await get_cp_status(client, server_url)
+        current_cp, village_count, required_cp = status['current'], status['villages'], status['required']
         
         if callback:
-            callback(f"  Current CP: {current_cp:,}")
+            callback(f"  Current CP: {current_cp:,} (+{status['per_day']:,}/day)")
             callback(f"  Villages: {village_count}")
             callback(f"  Required for #{village_count + 1}: {required_cp:,}")
         
@@ -380,6 +493,7 @@ async def smart_settle(cookies, server_url: str, callback=None):
             await run_celebration(client, server_url, callback)
             
             if callback:
+                callback(f"  {format_projection(status)}")
                 callback("  ⚠ Wait for celebration to complete before settling")
             return False
         
@@ -427,7 +541,7 @@ async def smart_settle(cookies, server_url: str, callback=None):
         if callback:
             callback("\nStep 3: Checking settlers...")
         
-        settlers = await check_settlers_available(client, server_url, residence_pos)
+        settlers = await check_settlers_available(client, server_url)
         
         if callback:
             callback(f"  Available settlers: {settlers}")
@@ -0,0 +1,250 @@
+# spatial.py
+"""
+In-memory spatial index over the world map.
+
+The map is 401x401 tiles (-200..200 on both axes) and wraps around at the
+edges, so distances and queries are computed on a torus. Items are bucketed
+into square grid cells; queries only visit the cells that can contain a hit.
+
+Run `python -m bot.spatial` for a benchmark on a synthetic 50k-village world.
+"""
+
+import logging
+import math
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+MAP_MIN = -200
+MAP_SIZE = 401
+DEFAULT_CELL_SIZE = 8
+
+
+def wrap_delta(a: int, b: int) -> int:
+    """Shortest distance between two coordinates on the wrapped axis."""
+    d = abs(a - b) % MAP_SIZE
+    return min(d, MAP_SIZE - d)
+
+
+def distance(x1: int, y1: int, x2: int, y2: int) -> float:
+    """Euclidean distance between two tiles, taking map wraparound into account."""
+    return math.hypot(wrap_delta(x1, x2), wrap_delta(y1, y2))
+
+
+def _cell_ranges(lo: int, hi: int, cell_size: int, cells: int):
+    """Cell indexes covering the map coordinates lo..hi, which may wrap."""
+    if hi - lo + 1 >= MAP_SIZE:
+        return range(cells)
+    lo_off = (lo - MAP_MIN) % MAP_SIZE
+    hi_off = (hi - MAP_MIN) % MAP_SIZE
+    lo_cell, hi_cell = lo_off // cell_size, hi_off // cell_size
+    if lo_off <= hi_off:
+        return range(lo_cell, hi_cell + 1)
+    if lo_cell <= hi_cell:
+        # Both ends of the wrapped range fall in overlapping cells
+        return range(cells)
+    return list(range(lo_cell, cells)) + list(range(0, hi_cell + 1))
+
+
+class SpatialIndex:
+    """
+    Grid-bucket index of (x, y, item) entries.
+
+    Query results are lists of (distance, x, y, item) sorted by distance.
+    """
+
+    def __init__(self, cell_size: int = DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = math.ceil(MAP_SIZE / cell_size)
+        self.buckets = {}
+        self.count = 0
+
+    @classmethod
+    def build(cls, entries, cell_size: int = DEFAULT_CELL_SIZE):
+        """Build an index from an iterable of (x, y, item)."""
+        index = cls(cell_size)
+        for x, y, item in entries:
+            index.add(x, y, item)
+        return index
+
+    @classmethod
+    def from_db(cls, conn, cell_size: int = DEFAULT_CELL_SIZE):
+        """Build an index over the villages table; items are the table rows."""
+        cursor = conn.cursor()
+        cursor.execute("SELECT username, village_id, village_name, x_coord, y_coord FROM villages")
+        return cls.build(((row[3], row[4], row) for row in cursor.fetchall()), cell_size)
+
+    def _cell(self, x: int, y: int):
+        return ((x - MAP_MIN) % MAP_SIZE) // self.cell_size, ((y - MAP_MIN) % MAP_SIZE) // self.cell_size
+
+    def add(self, x: int, y: int, item):
+        """Add one entry."""
+        self.buckets.setdefault(self._cell(x, y), []).append((x, y, item))
+        self.count += 1
+
+    def __len__(self):
+        return self.count
+
+    def _scan(self, x_lo: int, x_hi: int, y_lo: int, y_hi: int):
+        """Yield every entry in the cells covering the (possibly wrapping) box."""
+        cols = _cell_ranges(x_lo, x_hi, self.cell_size, self.cells)
+        rows = _cell_ranges(y_lo, y_hi, self.cell_size, self.cells)
+        for cx in cols:
+            for cy in rows:
+                bucket = self.buckets.get((cx, cy))
+                if bucket:
+                    yield from bucket
+
+    def within_radius(self, x: int, y: int, radius: float):
+        """All entries within `radius` tiles of (x, y), nearest first."""
+        r = int(math.ceil(radius))
+        results = []
+        for ex, ey, item in self._scan(x - r, x + r, y - r, y + r):
+            d = distance(x, y, ex, ey)
+            if d <= radius:
+                results.append((d, ex, ey, item))
+        results.sort(key=lambda entry: entry[0])
+        return results
+
+    def nearest(self, x: int, y: int, k: int = 10, max_radius: float = MAP_SIZE):
+        """The `k` entries nearest to (x, y), nearest first."""
+        radius = float(self.cell_size)
+        while True:
+            results = self.within_radius(x, y, radius)
+            if len(results) >= k or radius >= max_radius:
+                return results[:k]
+            radius = min(radius * 2, max_radius)
+
+    def in_box(self, x_min: int, y_min: int, x_max: int, y_max: int):
+        """
+        All entries inside the box, inclusive.
+
+        A box with x_min > x_max (or y_min > y_max) wraps across the map edge.
+        """
+        x_hi = x_max if x_max >= x_min else x_max + MAP_SIZE
+        y_hi = y_max if y_max >= y_min else y_max + MAP_SIZE
+        cx = (x_min + x_hi) / 2
+        cy = (y_min + y_hi) / 2
+
+        def inside(value, lo, hi):
+            return (value - lo) % MAP_SIZE <= hi - lo
+
+        results = []
+        for ex, ey, item in self._scan(x_min, x_hi, y_min, y_hi):
+            if inside(ex, x_min, x_hi) and inside(ey, y_min, y_hi):
+                results.append((distance(round(cx), round(cy), ex, ey), ex, ey, item))
+        results.sort(key=lambda entry: entry[0])
+        return results
+
+
+_world_indexes = {}  # database file -> (villages table version, SpatialIndex)
+
+
+def _database_key(conn):
+    """The file behind the connection's main database (the connection itself for in-memory ones)."""
+    for _, name, path in conn.execute("PRAGMA database_list"):
+        if name == 'main':
+            return path or id(conn)
+    return id(conn)
+
+
+def _villages_version(conn):
+    """
+    Cheap marker that changes whenever the villages table does.
+
+    Every write is a DELETE or an INSERT OR REPLACE, and replaced rows get a
+    new rowid, so the row count and the highest rowid together move on each one.
+    """
+    return conn.execute("SELECT COUNT(*), MAX(rowid) FROM villages").fetchone()
+
+
+def rebuild_world_index(conn, cell_size: int = DEFAULT_CELL_SIZE):
+    """Rebuild the village index of the connection's database."""
+    start = time.perf_counter()
+    version = _villages_version(conn)
+    index = SpatialIndex.from_db(conn, cell_size)
+    _world_indexes[_database_key(conn)] = (version, index)
+    logger.info(f"Spatial index rebuilt: {len(index)} villages in {time.perf_counter() - start:.2f}s")
+    return index
+
+
+def get_world_index(conn):
+    """
+    Return the village index of the connection's database, rebuilding it
+    whenever the villages table changed since it was built (e.g. after
+    another process re-crawled the world).
+    """
+    cached = _world_indexes.get(_database_key(conn))
+    if cached is None or cached[0] != _villages_version(conn):
+        return rebuild_world_index(conn)
+    return cached[1]
+
+
+def targets_near_village(conn, username: str, village_id: int, k: int = None, radius: float = None):
+    """
+    Find other players' villages around one of our villages.
+
+    Args:
+        conn: Database connection
+        username: Our username (our own villages are excluded)
+        village_id: Which of our villages to search around
+        k: Return the k nearest targets
+        radius: Return every target within this many tiles
+
+    Returns: list of (distance, x, y, villages row), nearest first
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT x_coord, y_coord FROM villages WHERE username=? AND village_id=?", (username, village_id))
+    origin = cursor.fetchone()
+    if origin is None:
+        return []
+
+    index = get_world_index(conn)
+    x, y = origin
+    if radius is not None:
+        results = index.within_radius(x, y, radius)
+    else:
+        # Over-fetch so excluding our own villages still leaves k targets
+        results = index.nearest(x, y, (k or 10) + 50)
+
+    targets = [entry for entry in results if entry[3][0] != username]
+    return targets[:k] if k else targets
+
+
+def benchmark(villages: int = 50000, queries: int = 1000, seed: int = 1):
+    """Compare indexed queries against a full scan on a synthetic world."""
+    rng = random.Random(seed)
+    entries = [(rng.randint(-200, 200), rng.randint(-200, 200), i) for i in range(villages)]
+    origins = [(rng.randint(-200, 200), rng.randint(-200, 200)) for _ in range(queries)]
+
+    start = time.perf_counter()
+    index = SpatialIndex.build(entries)
+    build_time = time.perf_counter() - start
+
+    def timed(fn):
+        start = time.perf_counter()
+        for x, y in origins:
+            fn(x, y)
+        return (time.perf_counter() - start) / queries * 1000
+
+    def scan_radius(x, y, radius=25):
+        return sorted(d for d in (distance(x, y, ex, ey) for ex, ey, _ in entries) if d <= radius)
+
+    results = {
+        'villages': villages,
+        'build_ms': build_time * 1000,
+        'knn10_ms': timed(lambda x, y: index.nearest(x, y, 10)),
+        'radius25_ms': timed(lambda x, y: index.within_radius(x, y, 25)),
+        'box50_ms': timed(lambda x, y: index.in_box(x - 25, y - 25, x + 25, y + 25)),
+    }
+
+    # A full scan is orders of magnitude slower, so time it on a few origins only
+    origins = origins[:20]
+    queries = len(origins)
+    results['scan_radius25_ms'] = timed(scan_radius)
+    return results
+
+if __name__ == "__main__":
+    for name, value in benchmark().items():
+        print(f"{name:<18} {value:,.3f}" if isinstance(value, float) else f"{name:<18} {value:,}")
@@ -0,0 +1,319 @@
+# telemetry.py
+"""
+Per-request telemetry for game traffic.
+
+When enabled, every request made by a client created with
+`event_hooks=event_hooks()` is recorded to the request_log table: endpoint
+class, status, latency, bytes on the wire and the id of the task that made it.
+Rows go through the DatabaseWriter, so recording never blocks the event loop.
+
+Raw rows are kept for RAW_RETENTION_HOURS. After that they are downsampled
+into hourly per-endpoint rollups (request and success counts, bytes and a
+log-scale latency histogram), and rollups are dropped after
+ROLLUP_RETENTION_DAYS. Percentiles are exact over raw rows and accurate to
+about 5% over rolled-up hours.
+
+Usage:
+    writer = DatabaseWriter().start()
+    telemetry.enable(writer)
+    async with httpx.AsyncClient(event_hooks=telemetry.event_hooks()) as client:
+        with telemetry.task_scope('storage'):
+            ...
+
+The bot, CLI and TUI entry points turn it on when TBOT_TELEMETRY=1 is set.
+Run `python -m bot.telemetry` for a report over the last 24 hours.
+"""
+
+import contextvars
+import itertools
+import logging
+import math
+import os
+import time
+import zlib
+from array import array
+
+from . import metrics, replay, tracing
+from .db_writer import DatabaseWriter, RequestRecord
+
+logger = logging.getLogger(__name__)
+
+RAW_RETENTION_HOURS = 48      # Raw rows older than this are rolled up
+ROLLUP_RETENTION_DAYS = 90    # Hourly rollups older than this are dropped
+ROLLUP_INTERVAL = 600         # Seconds between downsampling runs
+
+# Latency histogram: bucket i holds latencies up to HISTOGRAM_GROWTH ** i ms
+HISTOGRAM_GROWTH = 1.1
+HISTOGRAM_BUCKETS = 120       # Last bucket covers anything above ~90 seconds
+
+# Query parameters that select a different page type on the same script
+ENDPOINT_PARAMS = ('gid', 't', 'tt', 's')
+
+current_task = contextvars.ContextVar('telemetry_task', default=None)
+_task_ids = itertools.count(1)
+_writer = None
+
+
+def enable(writer, rollup_interval=ROLLUP_INTERVAL, retention_hours=RAW_RETENTION_HOURS):
+    """
+    Start recording requests through a running DatabaseWriter.
+
+    Downsampling is scheduled as a maintenance job on the writer thread.
+    """
+    global _writer
+    _writer = writer
+    writer.add_maintenance(lambda conn: rollup(conn, retention_hours=retention_hours), rollup_interval)
+    metrics.track_writer(writer)
+    logger.info("Request telemetry enabled")
+
+
+def enable_from_env(var='TBOT_TELEMETRY'):
+    """Enable telemetry with its own writer if the environment variable is set. Returns the writer or None."""
+    if os.environ.get(var, '').lower() not in ('1', 'true', 'yes'):
+        return None
+    writer = DatabaseWriter().start()
+    enable(writer)
+    return writer
+
+
+def disable():
+    """Stop recording requests."""
+    global _writer
+    _writer = None
+
+
+def is_enabled():
+    return _writer is not None
+
+
+def endpoint_class(url):
+    """
+    Group URLs by page type, e.g. 'build.php?gid=19' or 'buy2.php?t=2'.
+
+    Village and position ids are dropped so the classes stay few.
+    """
+    name = url.path.rsplit('/', 1)[-1] or '/'
+    params = [f"{key}={url.params[key]}" for key in ENDPOINT_PARAMS if key in url.params]
+    return f"{name}?{'&'.join(params)}" if params else name
+
+
+class TaskScope:
+    """Context manager (sync or async) tagging requests made inside it with a task id."""
+
+    def __init__(self, name):
+        self.task_id = f"{name}-{time.strftime('%Y%m%d%H%M%S')}-{next(_task_ids)}"
+        self.token = None
+
+    def __enter__(self):
+        self.token = current_task.set(self.task_id)
+        return self.task_id
+
+    def __exit__(self, *exc):
+        current_task.reset(self.token)
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc):
+        self.__exit__(*exc)
+
+
+def task_scope(name):
+    """Tag requests made inside the block with a fresh task id built from `name`."""
+    return TaskScope(name)
+
+
+async def _on_request(request):
+    if tracing.is_enabled():
+        request.extensions['trace_span'] = tracing.start(endpoint_class(request.url), 'http', method=request.method)
+    if _writer is not None or metrics.is_enabled() or replay.is_recording():
+        request.extensions['telemetry_start'] = time.perf_counter()
+
+
+async def _on_response(response):
+    start = response.request.extensions.get('telemetry_start')
+    span = response.request.extensions.get('trace_span')
+    if start is None and span is None:
+        return
+    # Read the body here so latency covers the whole transfer
+    await response.aread()
+    if span is not None:
+        span.end(status=response.status_code)
+    if start is None:
+        return
+    latency_ms = (time.perf_counter() - start) * 1000
+    endpoint = endpoint_class(response.request.url)
+    metrics.observe_request(endpoint, response.status_code, latency_ms / 1000)
+    replay.record(response, latency_ms / 1000)
+    if _writer is not None:
+        _writer.submit(RequestRecord(time.time(), current_task.get(), endpoint, response.status_code,
+                                     latency_ms, response.num_bytes_downloaded or len(response.content)))
+
+
+def event_hooks():
+    """httpx event hooks that record requests while telemetry, metrics, tracing or replay recording is on."""
+    return {'request': [_on_request], 'response': [_on_response]}
+
+
+def is_success(status):
+    """The game answers successful form posts with a 302, so redirects count as success."""
+    return 200 <= status < 400
+
+
+def _bucket(latency_ms):
+    if latency_ms <= 1:
+        return 0
+    return min(HISTOGRAM_BUCKETS - 1, math.ceil(math.log(latency_ms) / math.log(HISTOGRAM_GROWTH)))
+
+
+def _bucket_value(index):
+    """Representative latency of a bucket (geometric middle of its range)."""
+    return HISTOGRAM_GROWTH ** (index - 0.5) if index else 1.0
+
+
+def _pack_histogram(counts):
+    return zlib.compress(array('I', counts).tobytes())
+
+
+def _unpack_histogram(blob):
+    counts = array('I')
+    counts.frombytes(zlib.decompress(blob))
+    return list(counts)
+
+
+def _hour(ts):
+    return int(ts // 3600 * 3600)
+
+
+def rollup(conn, now=None, retention_hours=RAW_RETENTION_HOURS, rollup_days=ROLLUP_RETENTION_DAYS):
+    """
+    Downsample raw rows older than the retention window into hourly rollups.
+
+    Only whole hours are rolled up, and existing rollup rows are merged, so the
+    function can run any number of times.
+
+    Returns: number of raw rows rolled up
+    """
+    now = now if now is not None else time.time()
+    cutoff = _hour(now - retention_hours * 3600)
+    cursor = conn.cursor()
+    cursor.execute("SELECT ts, endpoint, status, latency_ms, bytes FROM request_log WHERE ts < ?", (cutoff,))
+    rows = cursor.fetchall()
+
+    groups = {}
+    for ts, endpoint, status, latency_ms, size in rows:
+        group = groups.get((_hour(ts), endpoint))
+        if group is None:
+            group = groups[(_hour(ts), endpoint)] = [0, 0, 0, [0] * HISTOGRAM_BUCKETS]
+        group[0] += 1
+        group[1] += is_success(status)
+        group[2] += size or 0
+        group[3][_bucket(latency_ms)] += 1
+
+    for (hour, endpoint), (requests, successes, size, histogram) in groups.items():
+        cursor.execute("SELECT requests, successes, bytes, latency_histogram FROM request_rollup WHERE hour=? AND endpoint=?",
+                       (hour, endpoint))
+        existing = cursor.fetchone()
+        if existing is not None:
+            requests += existing[0]
+            successes += existing[1]
+            size += existing[2]
+            histogram = [a + b for a, b in zip(histogram, _unpack_histogram(existing[3]))]
+        cursor.execute("INSERT OR REPLACE INTO request_rollup (hour, endpoint, requests, successes, bytes, latency_histogram) "
+                       "VALUES (?, ?, ?, ?, ?, ?)", (hour, endpoint, requests, successes, size, _pack_histogram(histogram)))
+
+    cursor.execute("DELETE FROM request_log WHERE ts < ?", (cutoff,))
+    cursor.execute("DELETE FROM request_rollup WHERE hour < ?", (_hour(now - rollup_days * 86400),))
+    conn.commit()
+
+    if rows:
+        logger.info(f"Rolled up {len(rows)} request rows into {len(groups)} hourly buckets")
+    return len(rows)
+
+
+def _percentile(weighted, pct):
+    """Nearest-rank percentile over sorted (value, weight) pairs."""
+    total = sum(weight for _, weight in weighted)
+    rank = max(1, math.ceil(total * pct / 100))
+    seen = 0
+    for value, weight in weighted:
+        seen += weight
+        if seen >= rank:
+            return value
+    return weighted[-1][0]
+
+
+def latency_percentiles(conn, hours=24, percentiles=(50, 95, 99), now=None):
+    """
+    Latency percentiles per endpoint class over the last `hours`.
+
+    Returns: dict of endpoint -> {'requests': n, 'p50': ms, 'p95': ms, 'p99': ms}
+    """
+    since = (now if now is not None else time.time()) - hours * 3600
+    samples = {}
+
+    cursor = conn.cursor()
+    cursor.execute("SELECT endpoint, latency_ms FROM request_log WHERE ts >= ?", (since,))
+    for endpoint, latency_ms in cursor.fetchall():
+        samples.setdefault(endpoint, []).append((latency_ms, 1))
+
+    cursor.execute("SELECT endpoint, latency_histogram FROM request_rollup WHERE hour >= ?", (_hour(since),))
+    for endpoint, blob in cursor.fetchall():
+        entries = samples.setdefault(endpoint, [])
+        entries.extend((_bucket_value(i), count) for i, count in enumerate(_unpack_histogram(blob)) if count)
+
+    results = {}
+    for endpoint, weighted in samples.items():
+        weighted.sort()
+        result = {'requests': sum(weight for _, weight in weighted)}
+        for pct in percentiles:
+            result[f"p{pct}"] = _percentile(weighted, pct)
+        results[endpoint] = result
+    return results
+
+
+def success_rate_by_hour(conn, hours=24, endpoint=None, now=None):
+    """
+    Request count and success rate for each hour of the last `hours`.
+
+    Returns: list of (hour_start, requests, successes, success_rate), oldest first
+    """
+    since = (now if now is not None else time.time()) - hours * 3600
+    totals = {}
+
+    cursor = conn.cursor()
+    query = ("SELECT CAST(ts / 3600 AS INTEGER) * 3600, COUNT(*), SUM(status >= 200 AND status < 400) "
+             "FROM request_log WHERE ts >= ?")
+    params = [since]
+    if endpoint is not None:
+        query += " AND endpoint = ?"
+        params.append(endpoint)
+    cursor.execute(query + " GROUP BY 1", params)
+    for hour, requests, successes in cursor.fetchall():
+        totals[hour] = [requests, successes]
+
+    query = "SELECT hour, SUM(requests), SUM(successes) FROM request_rollup WHERE hour >= ?"
+    params = [_hour(since)]
+    if endpoint is not None:
+        query += " AND endpoint = ?"
+        params.append(endpoint)
+    cursor.execute(query + " GROUP BY hour", params)
+    for hour, requests, successes in cursor.fetchall():
+        entry = totals.setdefault(hour, [0, 0])
+        entry[0] += requests
+        entry[1] += successes
+
+    return [(hour, requests, successes, successes / requests if requests else 0.0)
+            for hour, (requests, successes) in sorted(totals.items())]
+
+if __name__ == "__main__":
+    from datetime import datetime
+    from .database import init_db
+
+    conn = init_db()
+    print(f"{'Endpoint':<28} {'Requests':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for endpoint, result in sorted(latency_percentiles(conn).items()):
+        print(f"{endpoint:<28} {result['requests']:>9,} {result['p50']:>9.1f} {result['p95']:>9.1f} {result['p99']:>9.1f}")
+    print()
+    for hour, requests, successes, rate in success_rate_by_hour(conn):
+        print(f"{datetime.fromtimestamp(hour):%Y-%m-%d %H:00}  {requests:>7,} requests  {rate:.1%} success")
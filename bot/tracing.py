@@ -0,0 +1,259 @@
+# tracing.py
+"""
+Spans showing where a slow run spends its time.
+
+Each TaskManager task and daemon job is a root span. Inside it, these
+become child spans with their durations:
+- game requests, through the telemetry event hooks every client installs;
+- parses (parse_pool, rally point, training and send forms, presets);
+- AsyncDatabase calls;
+- the sleeps of preset runs.
+
+DatabaseWriter commits happen on its own thread, so they get their own
+track rather than a parent.
+
+Spans are written to a file in the Chrome trace event format. The file
+holds one event per line, after an opening '['. chrome://tracing, Perfetto
+(ui.perfetto.dev) and speedscope load it as is, and `python -m bot.tracing
+trace.json` totals the time per category for each root span.
+
+    tracing.enable('trace.json')
+    with tracing.span('storage', 'task', root=True):
+        ...
+
+The bot, CLI, TUI and daemon entry points enable tracing when TBOT_TRACE
+holds a file path.
+"""
+
+import asyncio
+import atexit
+import contextvars
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+current_span = contextvars.ContextVar('tracing_span', default=None)
+_span_ids = itertools.count(1)
+_track_ids = itertools.count(1)
+_EPOCH = time.time() - time.perf_counter()   # Turns perf_counter readings into unix time
+_exporter = None
+
+
+class _Exporter:
+    """Appends trace events to a file, one JSON object per line."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'w', encoding='utf-8')
+        self.file.write('[\n')
+        self.tracks = {}
+        self.pid = os.getpid()
+
+    def track(self, name):
+        """Trace viewer thread id of a named track, announcing new tracks."""
+        with self.lock:
+            tid = self.tracks.get(name)
+            if tid is None:
+                tid = self.tracks[name] = next(_track_ids)
+                self._write({'ph': 'M', 'name': 'thread_name', 'pid': self.pid, 'tid': tid, 'args': {'name': name}})
+        return tid
+
+    def emit(self, event):
+        with self.lock:
+            self._write(event)
+
+    def _write(self, event):
+        if self.file is not None:
+            self.file.write(json.dumps(event, default=str) + ',\n')
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class Span:
+    """
+    One timed operation.
+
+    Use it as a context manager (sync or async) to make it the parent of the
+    spans started inside it, or call end() for spans that start and finish
+    in different callbacks, such as requests.
+    """
+
+    def __init__(self, name, category, parent=None, root=False, args=None):
+        self.name = name
+        self.category = category
+        self.args = dict(args or {})
+        self.id = next(_span_ids)
+        self.parent = None if root else parent
+        if self.parent is not None:
+            self.tid = self.parent.tid
+        elif root:
+            self.tid = _exporter.track(f"{name} #{self.id}")
+        else:
+            self.tid = _exporter.track(threading.current_thread().name)
+        self.start = time.perf_counter()
+        self.token = None
+
+    def end(self, **args):
+        exporter = _exporter
+        if exporter is None:
+            return
+        end = time.perf_counter()
+        self.args.update(args)
+        self.args['span_id'] = self.id
+        if self.parent is not None:
+            self.args['parent_id'] = self.parent.id
+        exporter.emit({'ph': 'X', 'name': self.name, 'cat': self.category, 'pid': exporter.pid, 'tid': self.tid,
+                       'ts': round((_EPOCH + self.start) * 1e6), 'dur': round((end - self.start) * 1e6),
+                       'args': self.args})
+
+    def __enter__(self):
+        self.token = current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        current_span.reset(self.token)
+        if exc_type is not None:
+            self.end(error=exc_type.__name__)
+        else:
+            self.end()
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc):
+        self.__exit__(*exc)
+
+
+class _NoSpan:
+    """Stand-in while tracing is off."""
+
+    def end(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def start(name, category, root=False, **args):
+    """Start a span under the current one without entering it. Finish it with end()."""
+    if _exporter is None:
+        return _NO_SPAN
+    return Span(name, category, current_span.get(), root, args)
+
+
+def span(name, category, root=False, **args):
+    """A span to use as a context manager; spans started inside it become its children."""
+    return start(name, category, root, **args)
+
+
+async def sleep(seconds):
+    """asyncio.sleep, traced as a 'sleep' span."""
+    with span('sleep', 'sleep', seconds=seconds):
+        await asyncio.sleep(seconds)
+
+
+async def to_thread(fn, *args, category='parse'):
+    """asyncio.to_thread, traced as a span named after fn."""
+    with span(getattr(fn, '__name__', 'call'), category):
+        return await asyncio.to_thread(fn, *args)
+
+
+async def root(name, coro, category='task'):
+    """Await coro inside a root span (for tasks started with create_task)."""
+    with span(name, category, root=True):
+        return await coro
+
+
+def enable(path='trace.json'):
+    """Start writing spans to path."""
+    global _exporter
+    disable()
+    _exporter = _Exporter(path)
+    atexit.register(disable)
+    logger.info(f"Tracing to {path}")
+
+
+def enable_from_env(var='TBOT_TRACE'):
+    """Enable tracing if the environment variable holds a file path. Returns True if enabled."""
+    path = os.environ.get(var, '').strip()
+    if not path:
+        return False
+    enable(path)
+    return True
+
+
+def disable():
+    """Stop tracing and close the file."""
+    global _exporter
+    if _exporter is not None:
+        _exporter.close()
+        atexit.unregister(disable)
+    _exporter = None
+
+
+def is_enabled():
+    return _exporter is not None
+
+
+def read_trace(path):
+    """Span events of a trace file written by enable()."""
+    events = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip().rstrip(',')
+            if line and line not in ('[', ']'):
+                event = json.loads(line)
+                if event.get('ph') == 'X':
+                    events.append(event)
+    return events
+
+
+def summarize(events):
+    """
+    Time per category of the direct children of each root span.
+
+    Children that overlap (concurrent requests) are each counted in full, so
+    a category can add up to more than its root's duration.
+
+    Returns: {root name: {'duration': s, category: s, ...}}
+    """
+    roots = {event['args']['span_id']: event for event in events
+             if 'parent_id' not in event['args'] and event['cat'] in ('task', 'job')}
+    summary = {f"{event['name']} #{span_id}": {'duration': event['dur'] / 1e6} for span_id, event in roots.items()}
+    for event in events:
+        parent = roots.get(event['args'].get('parent_id'))
+        if parent is not None:
+            entry = summary[f"{parent['name']} #{parent['args']['span_id']}"]
+            entry[event['cat']] = entry.get(event['cat'], 0) + event['dur'] / 1e6
+    return summary
+
+
+if __name__ == "__main__":
+    import sys
+
+    for name, entry in summarize(read_trace(sys.argv[1] if len(sys.argv) > 1 else 'trace.json')).items():
+        duration = entry.pop('duration', 0)
+        parts = ', '.join(f"{category} {seconds:.2f}s" for category, seconds in sorted(entry.items(), key=lambda e: -e[1]))
+        print(f"{name:<32} {duration:>8.2f}s  {parts}")
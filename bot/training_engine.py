@@ -0,0 +1,221 @@
+# training_engine.py
+"""
+Parallel max-training engine.
+
+Keeps the barracks, stable and siege workshop of each village training at the
+same time. Every cycle the engine reads all training buildings of a village
+concurrently, and every building whose queue has dropped below the target
+length is refilled. The village's resources are split across the configured
+units by ratio, using the maximum trainable count the game shows next to each
+unit. The engine then sleeps until the next queue is due.
+
+    engine = TrainingEngine(client, server_url, {'legionnaire': 3, 'equites_imperatoris': 1, 'ram': 1})
+    await engine.run(duration=3600)
+    print(engine.report())
+"""
+
+import asyncio
+import contextlib
+import logging
+import time
+
+from . import metrics, tracing
+from .troop_training import TROOP_IDS, TRAINING_BUILDINGS, parse_training_form
+
+logger = logging.getLogger(__name__)
+
+ENGINE_BUILDINGS = ('barracks', 'stable', 'siege_workshop')
+QUEUE_TARGET = 300      # Refill a building once less than this many seconds are queued
+MIN_WAIT = 5            # Shortest pause between cycles
+RESOURCE_WAIT = 30      # Pause when a building is due but nothing is affordable
+MAX_WAIT = 600          # Longest pause between cycles
+
+
+def resolve_ratio(ratio, tribe='roman'):
+    """
+    Turn a ratio keyed by unit name or troop index into {troop_index: weight}.
+
+    Raises ValueError for unit names the tribe does not have.
+    """
+    troop_ids = TROOP_IDS.get(tribe, {})
+    resolved = {}
+    for unit, weight in ratio.items():
+        if isinstance(unit, str) and not unit.isdigit():
+            if unit not in troop_ids:
+                raise ValueError(f"Unknown {tribe} unit: {unit}")
+            unit = troop_ids[unit]
+        if weight > 0:
+            resolved[int(unit)] = weight
+    return resolved
+
+
+def parse_ratio(text, tribe='roman'):
+    """Parse 'legionnaire=3, imperian=1' (or '1=3,3=1') into {troop_index: weight}."""
+    ratio = {}
+    for part in text.split(','):
+        if '=' in part:
+            unit, weight = part.split('=', 1)
+            ratio[unit.strip().lower()] = float(weight)
+    return resolve_ratio(ratio, tribe)
+
+
+def allocate(pages, ratio):
+    """
+    Split the village's resources across units by ratio.
+
+    A unit's max is what all current resources would buy, and training uses
+    resources linearly. So giving unit i the share w_i / sum(w) of every
+    resource buys floor(max_i * w_i / sum(w)) of it, and the shares together
+    never exceed what is in stock.
+
+    Args:
+        pages: {building: parsed training form} for the buildings to refill
+        ratio: {troop_index: weight}
+
+    Returns: {building: [(unit, count), ...]}
+    """
+    available = {}
+    for building, page in pages.items():
+        for unit in page['units']:
+            if unit['index'] in ratio:
+                available[unit['index']] = (building, unit)
+
+    total = sum(ratio[index] for index in available)
+    plan = {}
+    for index, (building, unit) in available.items():
+        count = int(unit['max'] * ratio[index] / total)
+        if count > 0:
+            plan.setdefault(building, []).append((unit, count))
+    return plan
+
+
+class TrainingEngine:
+    """
+    Keeps every training building of one or more villages busy.
+
+    Args:
+        client: Logged-in AsyncClient (e.g. SessionManager.get_client())
+        server_url: Game server URL
+        ratio: Units to train and their weights, by name or troop index
+        tribe: Tribe used to resolve unit names
+        villages: Village IDs to manage; None manages the active village
+        positions: Overrides for building positions, e.g. {'stable': 22}
+        queue_target: Seconds of queue to keep in each building
+        callback: Optional progress callback
+        inventory: Optional TroopInventory to record queued troops in
+        village_lock: Optional asyncio.Lock held during each village's cycle; the
+            newdid= requests switch the session's active village
+    """
+
+    def __init__(self, client, server_url, ratio, tribe='roman', villages=None, positions=None,
+                 queue_target=QUEUE_TARGET, callback=None, inventory=None, village_lock=None):
+        self.client = client
+        self.server_url = server_url
+        self.ratio = resolve_ratio(ratio, tribe)
+        self.villages = list(villages) if villages else [None]
+        self.positions = {building: TRAINING_BUILDINGS[building] for building in ENGINE_BUILDINGS}
+        self.positions.update(positions or {})
+        self.queue_target = queue_target
+        self.callback = callback
+        self.inventory = inventory
+        self.village_lock = village_lock
+        self.started = time.monotonic()
+        self.stats = {}
+
+    def _log(self, message):
+        logger.info(message)
+        if self.callback:
+            self.callback(message)
+
+    def _url(self, village_id, building):
+        url = f"{self.server_url}/build.php?id={self.positions[building]}"
+        return f"{url}&newdid={village_id}" if village_id else url
+
+    async def _read(self, village_id, building):
+        response = await self.client.get(self._url(village_id, building))
+        response.raise_for_status()
+        return building, await tracing.to_thread(parse_training_form, response.text)
+
+    async def _train(self, village_id, building, page, orders):
+        """POST one building's orders. Returns True if the game accepted them."""
+        form_data = dict(page['hidden'])
+        for unit, count in orders:
+            form_data[unit['input']] = str(count)
+        form_data.update({'s1.x': '50', 's1.y': '10'})
+
+        response = await self.client.post(self._url(village_id, building), data=form_data)
+        if response.status_code not in (200, 302):
+            self._log(f"Training failed at {building}: HTTP {response.status_code}")
+            return False
+
+        stats = self.stats.setdefault(village_id, {'troops': 0, 'by_unit': {}})
+        for unit, count in orders:
+            stats['troops'] += count
+            stats['by_unit'][unit['name']] = stats['by_unit'].get(unit['name'], 0) + count
+        if self.inventory is not None:
+            self.inventory.record_training(village_id, {unit['index']: count for unit, count in orders})
+        summary = ', '.join(f"{count} {unit['name']}" for unit, count in orders)
+        self._log(f"Village {village_id or 'active'} {building}: queued {summary}")
+        return True
+
+    async def cycle(self, village_id=None):
+        """
+        Refill the due buildings of one village.
+
+        Returns: seconds until a building of this village is due again
+        """
+        results = await asyncio.gather(*(self._read(village_id, building) for building in self.positions),
+                                       return_exceptions=True)
+        pages = {}
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning(f"Could not read training building of village {village_id}: {result}")
+                continue
+            building, page = result
+            metrics.TRAINING_QUEUE.set(page['queue_seconds'], village=village_id or 'active', building=building)
+            if page['units']:
+                pages[building] = page
+
+        due = {building: page for building, page in pages.items() if page['queue_seconds'] < self.queue_target}
+        plan = allocate(due, self.ratio)
+        await asyncio.gather(*(self._train(village_id, building, pages[building], orders)
+                               for building, orders in plan.items()))
+
+        waits = [page['queue_seconds'] - self.queue_target for building, page in pages.items() if building not in due]
+        # Refilled buildings are checked again soon; starved ones once resources have grown
+        waits += [MIN_WAIT if building in plan else RESOURCE_WAIT for building in due]
+        return min(max(min(waits, default=MAX_WAIT), MIN_WAIT), MAX_WAIT)
+
+    async def run(self, duration=None, cycles=None):
+        """
+        Refill queues until `duration` seconds or `cycles` passes have elapsed (forever if neither).
+
+        Returns: report()
+        """
+        deadline = time.monotonic() + duration if duration else None
+        done = 0
+        while True:
+            waits = []
+            for village_id in self.villages:
+                async with self.village_lock or contextlib.nullcontext():
+                    waits.append(await self.cycle(village_id))
+            done += 1
+            if cycles and done >= cycles:
+                break
+            wait = min(waits)
+            if deadline is not None:
+                if time.monotonic() + wait >= deadline:
+                    break
+            await asyncio.sleep(wait)
+        return self.report()
+
+    def report(self):
+        """
+        Troops queued per village since the engine started.
+
+        Returns: {village_id: {'troops': n, 'per_hour': rate, 'by_unit': {name: n}}}
+        """
+        hours = max(time.monotonic() - self.started, 60) / 3600
+        return {village_id: {'troops': stats['troops'], 'per_hour': stats['troops'] / hours,
+                             'by_unit': dict(stats['by_unit'])}
+                for village_id, stats in self.stats.items()}
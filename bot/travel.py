@@ -0,0 +1,287 @@
+# travel.py
+"""
+Travel times and synchronized attack waves.
+
+Travel time follows the game's rules. The slowest unit sets the pace. The
+Tournament Square speeds up every tile beyond the first TOURNAMENT_SQUARE_RANGE,
+and the server's troop speed multiplies everything. The game rounds travel
+to whole seconds, and arrivals are ordered by the time each send was
+processed.
+
+Waves are landed together by:
+- measuring the offset between our monotonic clock and server time from the
+  Date headers of a few requests timed to bisect the server's second
+  boundary, plus the round-trip time;
+- aiming each send at the middle of the server second it has to leave in,
+  with WAVE_GAP between waves so they arrive in order;
+- loading every wave's send page shortly before its send, which warms one
+  pooled connection per wave and prefetches its key;
+- sleeping on the monotonic clock and finishing the last few milliseconds
+  with a short spin.
+"""
+
+import asyncio
+import logging
+import math
+import statistics
+import time
+from email.utils import parsedate_to_datetime
+
+from .spatial import distance
+from .troop_training import TROOP_IDS
+from .farm_list import parse_send_page
+
+logger = logging.getLogger(__name__)
+
+# Fields per hour at speed 1x, keyed like TROOP_IDS
+UNIT_SPEEDS = {
+    'roman': {
+        'legionnaire': 6,
+        'praetorian': 5,
+        'imperian': 7,
+        'equites_legati': 16,
+        'equites_imperatoris': 14,
+        'equites_caesaris': 10,
+        'ram': 4,
+        'catapult': 3,
+        'senator': 4,
+        'settler': 5,
+    },
+    'teuton': {
+        'clubswinger': 7,
+        'spearman': 7,
+        'axeman': 6,
+        'scout': 9,
+        'paladin': 10,
+        'teutonic_knight': 9,
+        'ram': 4,
+        'catapult': 3,
+        'chief': 4,
+        'settler': 5,
+    },
+    'gaul': {
+        'phalanx': 7,
+        'swordsman': 6,
+        'pathfinder': 17,
+        'theutates_thunder': 19,
+        'druidrider': 16,
+        'haeduan': 13,
+        'ram': 4,
+        'catapult': 3,
+        'chieftain': 5,
+        'settler': 5,
+    },
+}
+
+TOURNAMENT_SQUARE_RANGE = 30    # Tiles before the Tournament Square bonus applies
+TOURNAMENT_SQUARE_BONUS = 0.1   # Extra speed per Tournament Square level
+
+ATTACK = '3'            # v2v.php attack type: normal attack
+WAVE_GAP = 0.02         # Seconds between consecutive waves inside one server second
+PREWARM = 5.0           # Seconds before a send to load its page
+SPIN = 0.02             # Final stretch of a wait that is spun instead of slept
+LEAD = 30.0             # Default seconds between planning and the first send
+CLOCK_SAMPLES = 8
+
+
+def unit_speed(tribe, troop_index):
+    """Fields per hour of one unit type, by troop index."""
+    for name, index in TROOP_IDS[tribe].items():
+        if index == troop_index:
+            return UNIT_SPEEDS[tribe][name]
+    raise ValueError(f"Unknown {tribe} troop index: {troop_index}")
+
+
+def wave_speed(troops, tribe):
+    """Speed of a group of troops ({troop_index: count}): its slowest unit."""
+    speeds = [unit_speed(tribe, index) for index, count in troops.items() if count > 0]
+    if not speeds:
+        raise ValueError("A wave needs at least one unit")
+    return min(speeds)
+
+
+def travel_seconds(tiles, speed, tournament_square=0, server_speed=1.0):
+    """
+    Travel time in whole seconds, as the game rounds it.
+
+    Args:
+        tiles: Distance in tiles
+        speed: Fields per hour of the slowest unit
+        tournament_square: Tournament Square level in the sending village
+        server_speed: Troop speed multiplier of the server
+    """
+    near = min(tiles, TOURNAMENT_SQUARE_RANGE)
+    far = max(tiles - TOURNAMENT_SQUARE_RANGE, 0)
+    hours = near / speed + far / (speed * (1 + TOURNAMENT_SQUARE_BONUS * tournament_square))
+    return round(hours * 3600 / server_speed)
+
+
+def travel_time(origin, target, troops, tribe, tournament_square=0, server_speed=1.0):
+    """Seconds for `troops` to get from origin (x, y) to target (x, y)."""
+    tiles = distance(origin[0], origin[1], target[0], target[1])
+    return travel_seconds(tiles, wave_speed(troops, tribe), tournament_square, server_speed)
+
+
+def village_coords(conn, village_id):
+    """(x, y) of a village from the villages table, or None."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT x_coord, y_coord FROM villages WHERE village_id=?", (village_id,))
+    return cursor.fetchone()
+
+
+async def sleep_until(deadline):
+    """Sleep until a monotonic deadline, spinning through the last SPIN seconds."""
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        if remaining > SPIN:
+            await asyncio.sleep(remaining - SPIN)
+        else:
+            await asyncio.sleep(0)
+
+
+class ServerClock:
+    """
+    Server time on our monotonic clock.
+
+    Each sample (t0, t1, S) says the server read S whole seconds somewhere
+    between our t0 and t1, so the offset lies in (S - t1, S + 1 - t0).
+    Intersecting those intervals over samples taken at different fractions
+    of a second narrows the offset down to about a round trip.
+    """
+
+    def __init__(self, samples):
+        low = max(server - t1 for t0, t1, server in samples)
+        high = min(server + 1 - t0 for t0, t1, server in samples)
+        if low > high:
+            # Inconsistent samples (clock step or a slow response); fall back to midpoints
+            offsets = [server + 0.5 - (t0 + t1) / 2 for t0, t1, server in samples]
+            low = high = statistics.median(offsets)
+        self.offset = (low + high) / 2
+        self.uncertainty = (high - low) / 2
+        self.rtt = statistics.median(t1 - t0 for t0, t1, _ in samples)
+
+    def now(self):
+        """Current server time (unix seconds)."""
+        return time.monotonic() + self.offset
+
+    def to_monotonic(self, server_time):
+        return server_time - self.offset
+
+
+async def measure_server_clock(client, server_url, samples=CLOCK_SAMPLES):
+    """
+    Sample the server's Date header.
+
+    After the first sample, each request is timed to reach the server right
+    at the second boundary the current estimate predicts. Whichever side of
+    it the server answers from, the offset interval halves.
+    """
+    readings = []
+    for _ in range(samples):
+        if readings:
+            clock = ServerClock(readings)
+            boundary = math.ceil(clock.now() + 0.5)
+            await sleep_until(clock.to_monotonic(boundary) - clock.rtt / 2)
+        t0 = time.monotonic()
+        response = await client.get(f"{server_url}/village1.php")
+        t1 = time.monotonic()
+        date = response.headers.get('date')
+        if date:
+            readings.append((t0, t1, parsedate_to_datetime(date).timestamp()))
+    if not readings:
+        raise RuntimeError("Server sent no Date header; cannot measure its clock")
+
+    clock = ServerClock(readings)
+    logger.info(f"Server clock offset measured: ±{clock.uncertainty * 1000:.0f} ms, round trip {clock.rtt * 1000:.0f} ms")
+    return clock
+
+
+def plan_waves(waves, arrival, clock, tribe, tournament_square=0, server_speed=1.0, gap=WAVE_GAP):
+    """
+    Work out when each wave must be sent.
+
+    Args:
+        waves: List of dicts with 'source' (village ID), 'origin' (x, y),
+               'target' (village ID), 'target_xy' (x, y) and 'troops' {troop_index: count}
+        arrival: Server time (unix seconds) the first wave should land; the
+                 others land in the same second, `gap` apart, in list order
+        clock: ServerClock
+
+    Returns: list of wave dicts extended with 'travel', 'arrival', 'send_server' and 'send_at'
+             (monotonic), sorted by send time
+    """
+    arrival_second = math.floor(arrival)
+    planned = []
+    for order, wave in enumerate(waves):
+        travel = travel_time(wave['origin'], wave['target_xy'], wave['troops'], tribe, tournament_square, server_speed)
+        # Aim at the middle of the send second, nudged so the waves are processed in order
+        send_server = arrival_second - travel + 0.5 + (order - (len(waves) - 1) / 2) * gap
+        planned.append(dict(wave, order=order, travel=travel, arrival=arrival_second,
+                            send_server=send_server,
+                            send_at=clock.to_monotonic(send_server) - clock.rtt / 2))
+    planned.sort(key=lambda wave: wave['send_at'])
+    return planned
+
+
+async def send_wave(client, server_url, wave, attack_type=ATTACK, inventory=None):
+    """Prewarm, wait for the send time, then POST one wave. Returns the wave with timing results."""
+    await sleep_until(wave['send_at'] - PREWARM)
+    response = await client.get(f"{server_url}/v2v.php?id={wave['target']}&newdid={wave['source']}")
+    page = parse_send_page(response.text)
+    if page['key'] is None:
+        return dict(wave, sent=False, error="no send form")
+
+    data = dict(page['hidden'])
+    data.update({'id': str(wave['target']), 'c': attack_type, 'key': page['key']})
+    data.update({f"t[{index}]": str(count) for index, count in wave['troops'].items()})
+
+    await sleep_until(wave['send_at'])
+    fired = time.monotonic()
+    response = await client.post(f"{server_url}/v2v.php?newdid={wave['source']}", data=data)
+    sent = response.status_code in (200, 302)
+    if sent and inventory is not None:
+        inventory.record_send(wave['source'], wave['troops'], wave['travel'])
+    return dict(wave, sent=sent, fired=fired,
+                late_ms=(fired - wave['send_at']) * 1000, status=response.status_code)
+
+
+async def run_waves(client, server_url, waves, tribe, arrival=None, tournament_square=0, server_speed=1.0,
+                    gap=WAVE_GAP, attack_type=ATTACK, clock=None, inventory=None):
+    """
+    Send `waves` so they land together.
+
+    With no arrival time, the waves land as soon as the slowest can, after a
+    LEAD-second planning margin. Each wave runs as its own task, so their
+    pages and connections are warmed independently.
+
+    Returns: list of sent waves with 'late_ms' (how far behind its planned send each POST left)
+    """
+    clock = clock or await measure_server_clock(client, server_url)
+    if arrival is None:
+        slowest = max(travel_time(w['origin'], w['target_xy'], w['troops'], tribe, tournament_square, server_speed)
+                      for w in waves)
+        arrival = clock.now() + LEAD + slowest
+
+    planned = plan_waves(waves, arrival, clock, tribe, tournament_square, server_speed, gap)
+    if planned and planned[0]['send_at'] - PREWARM < time.monotonic():
+        raise ValueError("Arrival time is too soon for the slowest wave")
+
+    for wave in planned:
+        logger.info(f"Wave {wave['order'] + 1}: send at server {time.strftime('%H:%M:%S', time.localtime(wave['send_server']))}"
+                    f", travel {wave['travel']}s")
+    results = await asyncio.gather(*(send_wave(client, server_url, wave, attack_type, inventory) for wave in planned))
+    for wave in sorted(results, key=lambda w: w['order']):
+        logger.info(f"Wave {wave['order'] + 1}: {'sent' if wave['sent'] else 'FAILED'}, "
+                    f"{wave.get('late_ms', 0):.1f} ms after plan")
+    return results
+
+
+if __name__ == "__main__":
+    # Travel table for every unit over a few distances
+    for tribe, units in UNIT_SPEEDS.items():
+        print(tribe)
+        for name, speed in units.items():
+            times = [travel_seconds(tiles, speed, tournament_square=10) for tiles in (10, 30, 60, 100)]
+            print(f"  {name:<22}" + "".join(f"{t // 3600:>4}:{t % 3600 // 60:02}:{t % 60:02}" for t in times))
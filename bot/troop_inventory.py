@@ -0,0 +1,277 @@
+# troop_inventory.py
+"""
+Cached troop inventory per village, read from the rally point.
+
+For each village the inventory keeps:
+- troops at home,
+- troops in transit (attacks, raids and reinforcements on their way),
+- troops returning, with their arrival times,
+- troops in training.
+
+Every count is keyed by troop index (1-10, as in TROOP_IDS).
+
+Sends and training orders update the cache optimistically as they happen.
+The rally point is re-read when a village's data is older than max_age, or
+on a schedule with run(). Local updates made after a page was requested are
+replayed on top of it, so a reconcile never brings back troops that were
+just sent.
+
+Reading another village's rally point (newdid=) switches the session's
+active village to it; pass the account's village lock so that does not
+happen in the middle of other village-scoped work.
+
+    inventory = TroopInventory(client, server_url)
+    troops = await inventory.get(village_id)
+    inventory.record_send(village_id, {1: 50}, travel=1200)
+"""
+
+import asyncio
+import contextlib
+import logging
+import re
+import time
+from collections import namedtuple
+
+from bs4 import BeautifulSoup
+
+from . import tracing
+from .troop_training import parse_duration
+
+logger = logging.getLogger(__name__)
+
+RALLY_POINT = 39          # The rally point is always on building slot 39
+MAX_AGE = 300             # Seconds before a village's inventory is re-read
+RECONCILE_INTERVAL = 60   # Seconds between passes of run()
+
+Movement = namedtuple('Movement', 'kind troops arrives_at')  # kind: 'transit', 'returning' or 'training'
+
+_UNIT_CLASS_RE = re.compile(r'^u(\d+)$')
+
+
+def _unit_index(img):
+    """Troop index (1-10) of a unit image such as <img class="unit u13">, or None for the hero."""
+    for css in img.get('class', []):
+        match = _UNIT_CLASS_RE.match(css)
+        if match:
+            return (int(match.group(1)) - 1) % 10 + 1
+    return None
+
+
+def _section(table):
+    """Heading of the rally point section a troop table is in, lowercased."""
+    heading = table.find_previous(['h4', 'h3'])
+    return heading.get_text(' ', strip=True).lower() if heading else ''
+
+
+def _parse_troop_table(table):
+    """Returns (header text, {troop_index: count}, seconds until arrival or None)."""
+    header = table.find('thead') or table.find('tr')
+    header_text = header.get_text(' ', strip=True).lower() if header else ''
+
+    indexes = [_unit_index(img) for img in table.find_all('img', class_='unit')]
+    troops = {}
+    for row in table.find_all('tr'):
+        cells = row.find_all('td')
+        if len(cells) < len(indexes) or row.find('img', class_='unit'):
+            continue
+        values = [cell.get_text(strip=True) for cell in cells[-len(indexes):]] if indexes else []
+        if values and all(value.isdigit() for value in values):
+            for index, value in zip(indexes, values):
+                if index is not None and int(value):
+                    troops[index] = troops.get(index, 0) + int(value)
+            break
+
+    timer = table.find('span', id=re.compile(r'^timer'))
+    seconds = parse_duration(timer.get_text()) if timer else None
+    return header_text, troops, seconds
+
+
+def parse_rally_point(html):
+    """
+    Parse the rally point overview.
+
+    Tables in the 'incoming' section only count when they are our troops
+    returning. Tables without a timer only count as home when they are our own
+    troops (not reinforcements from other players). Troops shown as '?' (enemy
+    attacks) never count.
+
+    Returns: dict with 'home' {troop_index: count} and 'movements' [(kind, troops, seconds)]
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    home = {}
+    movements = []
+    for table in soup.find_all('table', class_='troop_details'):
+        header, troops, seconds = _parse_troop_table(table)
+        if not troops:
+            continue
+        section = _section(table)
+        if seconds is None:
+            if 'own troops' in header or 'own troops' in section:
+                for index, count in troops.items():
+                    home[index] = home.get(index, 0) + count
+        elif 'return' in header:
+            movements.append(('returning', troops, seconds))
+        elif 'incoming' not in section:
+            movements.append(('transit', troops, seconds))
+    return {'home': home, 'movements': movements}
+
+
+class VillageTroops:
+    """Troops of one village as last read or updated."""
+
+    def __init__(self, home, movements, fetched_at):
+        self.home = dict(home)
+        self.movements = list(movements)
+        self.fetched_at = fetched_at
+
+    def advance(self, now=None):
+        """Bring home the returning and trained troops that have arrived by now."""
+        now = now if now is not None else time.monotonic()
+        remaining = []
+        for movement in self.movements:
+            if movement.arrives_at is not None and movement.arrives_at <= now:
+                if movement.kind in ('returning', 'training'):
+                    _add(self.home, movement.troops)
+            else:
+                remaining.append(movement)
+        self.movements = remaining
+
+    def total(self, kind):
+        """Troops in movements of one kind, summed."""
+        troops = {}
+        for movement in self.movements:
+            if movement.kind == kind:
+                _add(troops, movement.troops)
+        return troops
+
+    def next_return(self):
+        """Monotonic time the next returning troops arrive, or None."""
+        return min((m.arrives_at for m in self.movements if m.kind == 'returning' and m.arrives_at), default=None)
+
+
+def _add(counts, troops, sign=1):
+    for index, count in troops.items():
+        counts[index] = counts.get(index, 0) + sign * count
+
+
+class TroopInventory:
+    """
+    Troop inventories of our villages.
+
+    Args:
+        client: Logged-in AsyncClient (e.g. SessionManager.get_client())
+        server_url: Game server URL
+        max_age: Seconds before get() re-reads a village's rally point
+        rally_point: Building slot of the rally point
+        village_lock: Optional asyncio.Lock held while a rally point is requested
+    """
+
+    def __init__(self, client, server_url, max_age=MAX_AGE, rally_point=RALLY_POINT, village_lock=None):
+        self.client = client
+        self.server_url = server_url
+        self.max_age = max_age
+        self.rally_point = rally_point
+        self.village_lock = village_lock
+        self.villages = {}   # village ID -> VillageTroops
+        self.events = {}     # village ID -> [(at, function, args)] since the last read
+        self.locks = {}
+        self.task = None
+
+    async def reconcile(self, village_id):
+        """
+        Re-read a village's rally point. Returns its VillageTroops.
+
+        With a village_id, this switches the session's active village to it.
+        """
+        lock = self.locks.setdefault(village_id, asyncio.Lock())
+        async with lock:
+            fetched_at = time.monotonic()
+            url = f"{self.server_url}/build.php?id={self.rally_point}"
+            async with self.village_lock or contextlib.nullcontext():
+                response = await self.client.get(f"{url}&newdid={village_id}" if village_id else url)
+            response.raise_for_status()
+            page = await tracing.to_thread(parse_rally_point, response.text)
+
+            movements = [Movement(kind, troops, fetched_at + seconds) for kind, troops, seconds in page['movements']]
+            state = VillageTroops(page['home'], movements, fetched_at)
+            # Replay what happened after the page was requested; it may not be on the page yet
+            events = [event for event in self.events.get(village_id, []) if event[0] >= fetched_at]
+            self.events[village_id] = events
+            for at, apply, args in events:
+                apply(state, at, *args)
+            self.villages[village_id] = state
+            return state
+
+    async def get(self, village_id, max_age=None):
+        """The village's troops, re-read from the rally point if older than max_age seconds."""
+        max_age = self.max_age if max_age is None else max_age
+        state = self.villages.get(village_id)
+        if state is None or time.monotonic() - state.fetched_at > max_age:
+            state = await self.reconcile(village_id)
+        state.advance()
+        return state
+
+    async def home(self, village_id, max_age=None):
+        """{troop_index: count} at home."""
+        return dict((await self.get(village_id, max_age)).home)
+
+    def _record(self, village_id, apply, *args):
+        at = time.monotonic()
+        self.events.setdefault(village_id, []).append((at, apply, args))
+        state = self.villages.get(village_id)
+        if state is not None:
+            apply(state, at, *args)
+
+    def record_send(self, village_id, troops, travel=None, returns=True):
+        """
+        Troops left the village.
+
+        Args:
+            troops: {troop_index: count}
+            travel: One-way travel seconds, if known; the troops then return after 2 * travel
+            returns: False for troops that stay away (reinforcements, settlers)
+        """
+        self._record(village_id, _apply_send, dict(troops), travel, returns)
+
+    def record_training(self, village_id, troops, done_at=None):
+        """Troops were queued for training; they join home at done_at (monotonic) if known."""
+        self._record(village_id, _apply_training, dict(troops), done_at)
+
+    async def run(self, villages, interval=RECONCILE_INTERVAL):
+        """Re-read the villages whose data is stale, every `interval` seconds, until cancelled."""
+        while True:
+            for village_id in villages:
+                try:
+                    await self.get(village_id)
+                except Exception as e:
+                    logger.warning(f"Could not read rally point of village {village_id}: {e}")
+            await asyncio.sleep(interval)
+
+    def start(self, villages, interval=RECONCILE_INTERVAL):
+        """Run run() in the background."""
+        self.task = asyncio.create_task(self.run(villages, interval))
+        return self.task
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+
+def _apply_send(state, at, troops, travel, returns):
+    _add(state.home, troops, -1)
+    if travel is None:
+        state.movements.append(Movement('transit', troops, None))
+        return
+    state.movements.append(Movement('transit', troops, at + travel))
+    if returns:
+        state.movements.append(Movement('returning', troops, at + 2 * travel))
+
+
+def _apply_training(state, at, troops, done_at):
+    state.movements.append(Movement('training', troops, done_at))
+
+
+async def check_troops(client, server_url, village_id=None):
+    """One-off read of a village's rally point. Returns VillageTroops."""
+    return await TroopInventory(client, server_url).reconcile(village_id)
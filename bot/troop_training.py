@@ -8,7 +8,9 @@ Supports all tribes: Roman, Teuton, Gaul
 import asyncio
 import httpx
 import logging
+import re
 from bs4 import BeautifulSoup
+from .telemetry import event_hooks
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
@@ -71,6 +73,76 @@ TRAINING_BUILDINGS = {
 }
 
 
+# "(1234)" max link next to each unit input, or its onclick "...value=1234"
+_MAX_TEXT_RE = re.compile(r'\(\s*(\d[\d,.]*)\s*\)')
+_MAX_ONCLICK_RE = re.compile(r'value\s*=\s*(\d+)')
+
+
+def parse_duration(text: str) -> int:
+    """Parse a timer such as '1:02:03' or '02:03' into seconds (0 if unparseable)."""
+    seconds = 0
+    for part in text.strip().split(':'):
+        if not part.strip().isdigit():
+            return 0
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+def parse_training_form(html: str) -> dict:
+    """
+    Parse a barracks/stable/workshop/residence page.
+
+    Returns: dict with
+        'building': page heading
+        'hidden': hidden form fields to send back with the POST
+        'units': list of {'input': 't[1]', 'index': 1, 'name': ..., 'max': trainable now}
+        'queue_seconds': seconds until the training queue is empty
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    h1 = soup.find('h1')
+
+    form = soup.find('form', {'action': lambda action: action and action.startswith('build.php')})
+    hidden = {}
+    if form:
+        for inp in form.find_all('input', {'type': 'hidden'}):
+            if inp.get('name'):
+                hidden[inp['name']] = inp.get('value', '')
+
+    units = []
+    for inp in soup.find_all('input', {'name': lambda x: x and x.startswith('t[')}):
+        name = inp['name']
+        try:
+            index = int(name[2:-1])
+        except ValueError:
+            continue
+
+        row = inp.find_parent('tr') or inp.find_parent('div')
+        max_count = 0
+        troop_name = name
+        if row:
+            img = row.find('img', class_='unit')
+            if img:
+                troop_name = img.get('alt') or img.get('title') or name
+            link = row.find('a', onclick=_MAX_ONCLICK_RE)
+            if link:
+                max_count = int(_MAX_ONCLICK_RE.search(link['onclick']).group(1))
+            else:
+                matches = _MAX_TEXT_RE.findall(row.get_text(' '))
+                if matches:
+                    max_count = int(re.sub(r'\D', '', matches[-1]))
+
+        units.append({'input': name, 'index': index, 'name': troop_name, 'max': max_count})
+
+    timers = [parse_duration(span.text) for span in soup.select('span[id^=timer]')]
+
+    return {
+        'building': h1.text.strip() if h1 else "Unknown",
+        'hidden': hidden,
+        'units': units,
+        'queue_seconds': max(timers, default=0),
+    }
+
+
 async def get_training_page(client, server_url: str, building_position: int):
     """Fetch the training page and extract form data."""
     response = await client.get(f"{server_url}/build.php?id={building_position}")
@@ -130,17 +202,26 @@ async def train_troops(cookies, server_url: str, building_position: int, troop_i
     Returns:
         True if training was successful
     """
-    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS) as client:
-        # Get the training page to find the form
+    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS, event_hooks=event_hooks()) as client:
+        # Get the training page for the form's hidden fields and the current maximum
         response = await client.get(f"{server_url}/build.php?id={building_position}")
-        soup = BeautifulSoup(response.text, 'html.parser')
+        page = parse_training_form(response.text)
+        unit = next((u for u in page['units'] if u['input'] == troop_input), None)
+        if unit is None:
+            if callback:
+                callback(f"{troop_input} cannot be trained at position {building_position}")
+            logger.error(f"{troop_input} not found in the training form at position {building_position}")
+            return False
+        if unit['max']:
+            amount = min(amount, unit['max'])
         
         # Build form data
-        form_data = {
+        form_data = dict(page['hidden'])
+        form_data.update({
             troop_input: str(amount),
             's1.x': '50',
             's1.y': '10',
-        }
+        })
         
         # Submit training
         response = await client.post(f"{server_url}/build.php?id={building_position}", data=form_data)
@@ -169,25 +250,31 @@ async def train_max_troops(cookies, server_url: str, building_position: int, tro
         loops: How many times to queue training
         callback: Progress callback
     """
-    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS) as client:
+    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS, event_hooks=event_hooks()) as client:
         troop_input = f't[{troop_index}]'
         
         for i in range(loops):
             # Get training page to see max available
             response = await client.get(f"{server_url}/build.php?id={building_position}")
+            page = parse_training_form(response.text)
+            unit = next((u for u in page['units'] if u['input'] == troop_input), None)
+            if unit is None or unit['max'] == 0:
+                if callback:
+                    callback(f"Nothing to train at position {building_position}")
+                break
             
-            # Just train a batch (game shows max available in the input maxlength)
-            form_data = {
-                troop_input: '999999',  # Will be capped to max available
+            form_data = dict(page['hidden'])
+            form_data.update({
+                troop_input: str(unit['max']),
                 's1.x': '50',
                 's1.y': '10',
-            }
+            })
             
             response = await client.post(f"{server_url}/build.php?id={building_position}", data=form_data)
             
             if response.status_code == 200:
                 if callback:
-                    callback(f"Training batch {i+1}/{loops} at position {building_position}")
+                    callback(f"Training batch {i+1}/{loops}: {unit['max']} {unit['name']} at position {building_position}")
             else:
                 if callback:
                     callback(f"Training failed in loop {i+1}")
@@ -205,7 +292,7 @@ async def train_settlers(cookies, server_url: str, residence_position: int = 25,
         count: Number of settlers to train (usually 3 for settling)
         callback: Progress callback
     """
-    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS) as client:
+    async with httpx.AsyncClient(cookies=cookies, headers=HEADERS, event_hooks=event_hooks()) as client:
         # Get residence page
         response = await client.get(f"{server_url}/build.php?id={residence_position}")
         soup = BeautifulSoup(response.text, 'html.parser')
@@ -11,8 +11,7 @@ from textual import on, work
 from rich.text import Text
 from datetime import datetime
 import asyncio
-import httpx
-from bs4 import BeautifulSoup
+from bot.village import parse_resources
 
 
 def format_number(num_str: str) -> str:
@@ -50,6 +49,7 @@ class StatusPanel(Static):
         self.iron = "---"
         self.crop = "---"
         self.session_status = "⚪ Offline"
+        self.jobs = "idle"
         
     def compose(self) -> ComposeResult:
         yield Static(id="status-content")
@@ -61,6 +61,7 @@ class StatusPanel(Static):
         content = f"""[bold cyan]╭─ Session ─────────────────────────────╮[/]
 [bold cyan]│[/] 👤 User:   [yellow]{self.username}[/]
 [bold cyan]│[/] 📡 Status: {self.session_status}
+[bold cyan]│[/] ⚙️  Jobs:   [white]{self.jobs}[/]
 [bold cyan]╰───────────────────────────────────────╯[/]
 
 [bold green]╭─ Storage & Granary ────────────────────╮[/]
@@ -200,7 +201,8 @@ class TravianBotApp(App):
         super().__init__()
         self.session_manager = None
         self.cookies = None
-        self.conn = None
+        self.db = None
+        self.jobs = {}
         
     def compose(self) -> ComposeResult:
         yield Header(show_clock=True)
@@ -216,6 +218,12 @@ class TravianBotApp(App):
         self.log_message("Welcome to Travian Bot!", "success")
         self.log_message("Press [bold]L[/] to login or click the Login button")
         self.log_message("Use keyboard shortcuts shown in the footer")
+
+    async def on_unmount(self):
+        if self.session_manager is not None:
+            await self.session_manager.close()
+        if self.db is not None:
+            await self.db.close()
         
     def log_message(self, message: str, level: str = "info"):
         log_panel = self.query_one("#log-panel", LogPanel)
@@ -248,7 +256,10 @@ class TravianBotApp(App):
         self.log_message("Fetching villages...", "info")
         
     @on(Button.Pressed, "#btn-logout")
-    def on_logout_pressed(self):
+    async def on_logout_pressed(self):
+        self.workers.cancel_group(self, "jobs")
+        if self.session_manager is not None:
+            await self.session_manager.close()
         self.session_manager = None
         self.cookies = None
         self.update_status(
@@ -282,21 +293,37 @@ class TravianBotApp(App):
         self.do_production_increase()
         
     def action_refresh(self):
-        if not self.cookies:
+        if not self.session_manager:
             self.log_message("Please login first!", "error")
             return
         self.log_message("Refreshing stats...", "info")
         self.do_refresh()
         
-    @work(thread=True)
-    def do_login(self):
-        """Perform login in background."""
+    def _job_started(self, name: str):
+        self.jobs[name] = self.jobs.get(name, 0) + 1
+        self.update_status(jobs=self._jobs_text())
+
+    def _job_finished(self, name: str):
+        self.jobs[name] -= 1
+        if not self.jobs[name]:
+            del self.jobs[name]
+        self.update_status(jobs=self._jobs_text())
+
+    def _jobs_text(self) -> str:
+        if not self.jobs:
+            return "idle"
+        return ", ".join(f"{name} x{count}" if count > 1 else name for name, count in self.jobs.items())
+
+    @work(exclusive=True, group="login")
+    async def do_login(self):
+        """Log in on the app's event loop; the session's client and the DB stay open for later jobs."""
         try:
-            from bot.database import init_db
+            from bot.async_db import AsyncDatabase
             from bot.session_manager import SessionManager
             
-            self.log_message("Initializing database...", "info")
-            self.conn = init_db()
+            if self.db is None:
+                self.log_message("Initializing database...", "info")
+                self.db = await asyncio.to_thread(AsyncDatabase().open)
             
             # Hardcoded credentials for now
             username = "abaddon"
@@ -305,8 +332,8 @@ class TravianBotApp(App):
             
             self.log_message(f"Logging in as [yellow]{username}[/]...", "info")
             
-            self.session_manager = SessionManager(username, password, civilization, self.conn)
-            self.cookies = asyncio.run(self.session_manager.login())
+            self.session_manager = SessionManager(username, password, civilization, self.db)
+            self.cookies = await self.session_manager.login()
             
             if self.cookies:
                 self.update_status(
@@ -315,140 +342,113 @@ class TravianBotApp(App):
                 )
                 self.log_message("Login successful!", "success")
                 
-                # Fetch current stats
-                self._fetch_stats_sync()
+                # Open the pooled connections now so the first job does not pay for them
+                await self.session_manager.get_client()
+                await self.fetch_stats()
             else:
                 self.log_message("Login failed!", "error")
                 
         except Exception as e:
             self.log_message(f"Error: {str(e)}", "error")
             
-    @work(thread=True)
-    def do_refresh(self):
+    @work(exclusive=True, group="refresh")
+    async def do_refresh(self):
         """Refresh wrapper."""
-        self._fetch_stats_sync()
+        await self.fetch_stats()
         
-    def _fetch_stats_sync(self):
+    async def fetch_stats(self):
         """Fetch current storage/production stats from game."""
-        if not self.cookies:
+        if not self.session_manager:
             return
             
         try:
             self.log_message("Fetching game stats...", "info")
             
-            with httpx.Client(cookies=self.cookies) as client:
-                response = client.get(
-                    "https://fun.gotravspeed.com/village1.php",
-                    headers={'User-Agent': 'Mozilla/5.0'}
-                )
-                soup = BeautifulSoup(response.text, 'html.parser')
-                
-                # Parse resource data from the #res div
-                res_div = soup.find('div', id='res')
-                if res_div:
-                    # Warehouse capacity
-                    ware = res_div.find('div', class_='ware')
-                    if ware:
-                        self.update_status(storage=format_number(ware.text.strip()))
-                    
-                    # Granary capacity
-                    gran = res_div.find('div', class_='gran')
-                    if gran:
-                        self.update_status(granary=format_number(gran.text.strip()))
-                    
-                    # Resources
-                    wood = res_div.find('div', class_='wood')
-                    if wood:
-                        self.update_status(wood=format_number(wood.text.strip()))
-                        
-                    clay = res_div.find('div', class_='clay')
-                    if clay:
-                        self.update_status(clay=format_number(clay.text.strip()))
-                        
-                    iron = res_div.find('div', class_='iron')
-                    if iron:
-                        self.update_status(iron=format_number(iron.text.strip()))
-                        
-                    crop = res_div.find('div', class_='crop')
-                    if crop:
-                        self.update_status(crop=format_number(crop.text.strip()))
-                    
-                    self.log_message("Stats updated!", "success")
-                else:
-                    self.log_message("Could not find resource data", "warning")
+            client = await self.session_manager.get_client()
+            response = await client.get("https://fun.gotravspeed.com/village1.php")
+            stats = await asyncio.to_thread(parse_resources, response.text)
+            if stats:
+                self.update_status(**{key: format_number(value) for key, value in stats.items()})
+                self.log_message("Stats updated!", "success")
+            else:
+                self.log_message("Could not find resource data", "warning")
                     
         except Exception as e:
             self.log_message(f"Error fetching stats: {str(e)}", "error")
             
-    @work(thread=True)
-    def do_storage_increase(self):
-        """Increase storage in background."""
-        if not self.cookies:
+    @work(group="jobs")
+    async def do_storage_increase(self):
+        """Increase storage on the app's event loop, alongside any other jobs."""
+        if not self.session_manager:
             return
             
+        self._job_started("storage")
         try:
             from bot.storage import increase_storage_async
-            from bot.database import init_db
-            
-            # Create new DB connection for this thread
-            thread_conn = init_db()
             
             loops = 10  # Start with 10 loops
             self.log_message(f"Running storage increase ({loops} loops)...", "info")
             
-            asyncio.run(increase_storage_async(
-                username="abaddon",
-                password="bristleback", 
+            await increase_storage_async(
+                username=self.session_manager.username,
+                password=self.session_manager.password,
                 loops=loops,
-                conn=thread_conn,
-                cookies=self.cookies
-            ))
+                conn=self.db,
+                client=await self.session_manager.get_client(),
+                callback=self.log_message
+            )
             
             self.log_message(f"Storage increase complete!", "success")
             
             # Refresh stats
-            self._fetch_stats_sync()
+            await self.fetch_stats()
             
         except Exception as e:
             self.log_message(f"Error: {str(e)}", "error")
+        finally:
+            self._job_finished("storage")
             
-    @work(thread=True)
-    def do_production_increase(self):
-        """Increase production in background."""
-        if not self.cookies:
+    @work(group="jobs")
+    async def do_production_increase(self):
+        """Increase production on the app's event loop, alongside any other jobs."""
+        if not self.session_manager:
             return
             
+        self._job_started("production")
         try:
             from bot.production import increase_production_async
-            from bot.database import init_db
-            
-            # Create new DB connection for this thread
-            thread_conn = init_db()
             
             loops = 10
             self.log_message(f"Running production increase ({loops} loops)...", "info")
             
-            asyncio.run(increase_production_async(
-                username="abaddon",
-                password="bristleback",
+            await increase_production_async(
+                username=self.session_manager.username,
+                password=self.session_manager.password,
                 loops=loops,
-                conn=thread_conn,
-                cookies=self.cookies
-            ))
+                conn=self.db,
+                client=await self.session_manager.get_client(),
+                callback=self.log_message
+            )
             
             self.log_message(f"Production increase complete!", "success")
             
             # Refresh stats
-            self._fetch_stats_sync()
+            await self.fetch_stats()
             
         except Exception as e:
             self.log_message(f"Error: {str(e)}", "error")
-
+        finally:
+            self._job_finished("production")
 
 def main():
     """Entry point for the TUI app."""
-    app = TravianBotApp()
-    app.run()
+    from bot import instrumentation
+    instrumentation.enable_from_env()
+    try:
+        app = TravianBotApp()
+        app.run()
+    finally:
+        instrumentation.disable()
 
 
 if __name__ == "__main__":
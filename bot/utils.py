@@ -1,5 +1,6 @@
 import httpx
 import logging
+from .telemetry import event_hooks
 
 BASE_URL = "https://fun.gotravspeed.com"
 
@@ -10,7 +11,7 @@ async def switch_village(session_manager, village_id):
     Switch to a different village by ID.
     """
     cookies = await session_manager.get_cookies()
-    async with httpx.AsyncClient(cookies=cookies) as client:
+    async with httpx.AsyncClient(cookies=cookies, event_hooks=event_hooks()) as client:
         response = await client.get(f"{BASE_URL}/village2.php?vid={village_id}")
         if response.status_code == 200:
             logger.info(f"Switched to village ID {village_id}")
@@ -1,30 +1,47 @@
 import httpx
 from bs4 import BeautifulSoup
 from tabulate import tabulate
-from .database import save_village, delete_all_villages_for_user
+from .database import replace_player_villages
+from .async_db import run_db
 import logging
 from .utils import switch_village
 from requests_toolbelt.multipart.encoder import MultipartEncoder
+from .telemetry import event_hooks
 
 BASE_URL = "https://fun.gotravspeed.com"
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def parse_resources(html: str) -> dict:
+    """Read warehouse, granary and resource amounts from the #res div of a village page."""
+    soup = BeautifulSoup(html, 'html.parser')
+    res_div = soup.find('div', id='res')
+    if not res_div:
+        return {}
+    stats = {}
+    for key, css in (('storage', 'ware'), ('granary', 'gran'), ('wood', 'wood'),
+                     ('clay', 'clay'), ('iron', 'iron'), ('crop', 'crop')):
+        div = res_div.find('div', class_=css)
+        if div:
+            stats[key] = div.text.strip()
+    return stats
+
+
 async def fetch_villages(username, session_manager, conn):
     """
     Fetch and save villages for a user.
-    """
-    # Clear existing data for the user
-    delete_all_villages_for_user(conn, username)
 
+    conn may be a sqlite3 connection or an AsyncDatabase; the stored villages
+    are replaced in one transaction once the page has been parsed.
+    """
     cookies = await session_manager.get_cookies()
-    async with httpx.AsyncClient(cookies=cookies) as client:
+    async with httpx.AsyncClient(cookies=cookies, event_hooks=event_hooks()) as client:
         response = await client.get(f"{BASE_URL}/profile.php")
         if response.status_code == 302:  # Session expired
             logger.warning("Session expired, re-authenticating...")
             cookies = await session_manager.login()  # Re-authenticate
-            async with httpx.AsyncClient(cookies=cookies) as new_client:
+            async with httpx.AsyncClient(cookies=cookies, event_hooks=event_hooks()) as new_client:
                 response = await new_client.get(f"{BASE_URL}/profile.php")
 
         response.raise_for_status()
@@ -42,7 +59,9 @@ async def fetch_villages(username, session_manager, conn):
                 x = int(coords[0])
                 y = int(coords[1])
                 village_data.append((name, vid, x, y))
-                save_village(conn, username, vid, name, x, y)
+
+        await run_db(conn, replace_player_villages, [username],
+                     [(username, vid, name, x, y) for name, vid, x, y in village_data])
 
         print(tabulate(village_data, headers=["Village Name", "Village ID", "X Coordinate", "Y Coordinate"], tablefmt="pretty"))
         return village_data
@@ -76,7 +95,7 @@ async def rename_village(session_manager, conn, username):
             await switch_village(session_manager, selected_village[1])
             cookies = await session_manager.get_cookies()
 
-            async with httpx.AsyncClient(cookies=cookies) as client:
+            async with httpx.AsyncClient(cookies=cookies, event_hooks=event_hooks()) as client:
                 # Get the profile edit page
                 response = await client.get(f"{BASE_URL}/profile.php?t=1")
                 response.raise_for_status()